@@ -1,84 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ワークブック構造の確認ツール
+新しいテンプレートのセル配置を確認するために、シートのセル値を文書順に出力します。
+シートXMLは ET.iterparse で逐次解析し、処理済みの行は破棄するため、
+大きなシートでもメモリ使用量はほぼ一定です（共有文字列テーブルのみ保持）。
+
+使い方:
+  python3 analyze_excel.py 報告書.xlsx
+  python3 analyze_excel.py 報告書.xlsx --sheet 2022夏期 --format csv -o cells.csv
+  python3 excel_validator_cli.py inspect 報告書.xlsx --format ndjson
+"""
+
+import argparse
+import os
+import sys
 import zipfile
-import xml.etree.ElementTree as ET
 
-file_path = '/home/ao0604/check_excel/宮下綾介2023夏期現状報告書 -前川.xlsx'
+from report_reader import SharedStrings, cast_number, iter_sheet_rows, workbook_sheets
+
+FORMATS = ('text', 'csv', 'ndjson')
+
+
+def column_letter(index: int) -> str:
+    """1始まりの列番号を列記号（例: 28 -> 'AB'）に変換する"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def iter_cells(archive: zipfile.ZipFile, sheet_path: str, shared_strings: SharedStrings):
+    """シートの値が入っているセルを文書順に (行, 列, 型, 値) で返す"""
+    with archive.open(sheet_path) as stream:
+        for row_number, cells in iter_sheet_rows(stream):
+            for column, cell_type, raw in cells:
+                if raw is None:
+                    continue
+                value = shared_strings[int(raw)] if cell_type == 's' else raw
+                if value:
+                    yield row_number, column, cell_type, value
+
+
+class TextWriter:
+    def __init__(self, out):
+        self.out = out
+        self.current_row = None
+
+    def start_sheet(self, name):
+        self.out.write(f'=== シート: {name} ===\n')
+        self.current_row = None
+
+    def write(self, sheet, row, column, cell_type, value):
+        if row != self.current_row:
+            if self.current_row is not None:
+                self.out.write('\n')
+            self.current_row = row
+            self.out.write(f'Row {row}:\n')
+        self.out.write(f'  {column_letter(column)}{row}: {value}\n')
+
+    def end_sheet(self, name, row_count, cell_count):
+        self.out.write(f'\n（行数: {row_count}, 値のあるセル: {cell_count}）\n\n')
+
+
+class CsvWriter:
+    def __init__(self, out):
+        import csv
+        self.writer = csv.writer(out)
+        self.writer.writerow(['sheet', 'cell', 'row', 'column', 'type', 'value'])
+
+    def start_sheet(self, name):
+        pass
+
+    def write(self, sheet, row, column, cell_type, value):
+        self.writer.writerow([sheet, f'{column_letter(column)}{row}', row, column, cell_type, value])
 
-def parse_cell_ref(cell_ref):
-    col = ''
-    row = ''
-    for char in cell_ref:
-        if char.isalpha():
-            col += char
+    def end_sheet(self, name, row_count, cell_count):
+        pass
+
+
+class NdjsonWriter:
+    def __init__(self, out):
+        import json
+        self.dumps = json.dumps
+        self.out = out
+
+    def start_sheet(self, name):
+        pass
+
+    def write(self, sheet, row, column, cell_type, value):
+        # 数値と真偽値は openpyxl と同じ型で出力する（text / csv は文字列のまま）
+        if cell_type == 'n':
+            value = cast_number(value)
+        elif cell_type == 'b':
+            value = bool(int(value))
+        self.out.write(self.dumps({'sheet': sheet, 'cell': f'{column_letter(column)}{row}', 'row': row,
+                                   'column': column, 'type': cell_type, 'value': value},
+                                  ensure_ascii=False) + '\n')
+
+    def end_sheet(self, name, row_count, cell_count):
+        pass
+
+
+WRITERS = {'text': TextWriter, 'csv': CsvWriter, 'ndjson': NdjsonWriter}
+
+
+def inspect_workbook(file_path, out, output_format='text', sheet_names=None):
+    with zipfile.ZipFile(file_path) as archive:
+        sheets, active = workbook_sheets(archive)
+        unknown = set(sheet_names or ()) - {name for name, _ in sheets}
+        if unknown:
+            raise ValueError(f"シートが見つかりません: {', '.join(sorted(unknown))}")
+
+        writer = WRITERS[output_format](out)
+        shared_strings = SharedStrings(archive)
+        try:
+            for name, sheet_path in sheets:
+                if sheet_names and name not in sheet_names:
+                    continue
+                writer.start_sheet(name)
+                # 行は文書順に現れるため、直前の行番号との比較だけで行数を数えられる
+                last_row = None
+                row_count = 0
+                cell_count = 0
+                for row, column, cell_type, value in iter_cells(archive, sheet_path, shared_strings):
+                    writer.write(name, row, column, cell_type, value)
+                    if row != last_row:
+                        last_row = row
+                        row_count += 1
+                    cell_count += 1
+                writer.end_sheet(name, row_count, cell_count)
+        finally:
+            shared_strings.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='analyze_excel.py',
+                                     description='ワークブックのセル値を文書順に出力')
+    parser.add_argument('file', help='確認するExcelファイル（.xlsx）')
+    parser.add_argument('--sheet', action='append', dest='sheets', metavar='NAME',
+                        help='出力するシート名（複数指定可、既定: すべてのシート）')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='出力形式（既定: text）')
+    parser.add_argument('-o', '--output', help='出力先ファイル（既定: 標準出力）')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.output:
+            newline = '' if args.format == 'csv' else None
+            with open(args.output, 'w', encoding='utf-8', newline=newline) as out:
+                inspect_workbook(args.file, out, args.format, args.sheets)
         else:
-            row += char
-    
-    col_num = 0
-    for char in col:
-        col_num = col_num * 26 + (ord(char) - ord('A') + 1)
-    
-    return (int(row) if row else 0, col_num)
-
-def get_cell_value(cell, shared_strings):
-    v_elem = cell.find('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}v')
-    if v_elem is None:
-        return ''
-    
-    cell_type = cell.get('t', 'n')
-    
-    if cell_type == 's':
-        idx = int(v_elem.text)
-        if idx < len(shared_strings):
-            return shared_strings[idx]
-    elif cell_type == 'n' or cell_type is None:
-        return v_elem.text
-    else:
-        return v_elem.text
-    
-    return ''
-
-with zipfile.ZipFile(file_path, 'r') as zip_file:
-    # Load shared strings
-    shared_strings = []
-    if 'xl/sharedStrings.xml' in zip_file.namelist():
-        with zip_file.open('xl/sharedStrings.xml') as f:
-            tree = ET.parse(f)
-            root = tree.getroot()
-            for si in root.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}si'):
-                t = si.find('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t')
-                if t is not None:
-                    shared_strings.append(t.text)
-    
-    # Create a complete map of all cells
-    with zip_file.open('xl/worksheets/sheet1.xml') as f:
-        tree = ET.parse(f)
-        root = tree.getroot()
-        
-        cell_map = {}
-        
-        rows = root.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row')
-        for row in rows:
-            row_num = row.get('r', '')
-            cells = row.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}c')
-            for cell in cells:
-                cell_ref = cell.get('r', '')
-                value = get_cell_value(cell, shared_strings)
-                if value and cell_ref:
-                    cell_map[cell_ref] = value
-        
-        print('=== COMPLETE EXCEL FILE STRUCTURE ===')
-        print(f'Sheet name: 2022夏期')
-        print(f'Total rows: {len(rows)}')
-        print(f'Total cells with data: {len(cell_map)}')
-        print('\n=== ALL CELL VALUES ===')
-        
-        sorted_cells = sorted(cell_map.items(), key=lambda x: parse_cell_ref(x[0]))
-        
-        current_row = None
-        for cell_ref, value in sorted_cells:
-            row_num, col_num = parse_cell_ref(cell_ref)
-            if current_row is None or current_row != row_num:
-                if current_row is not None:
-                    print()
-                current_row = row_num
-                print(f'Row {row_num}:')
-            print(f'  {cell_ref}: {value}')
\ No newline at end of file
+            if sys.stdout.encoding != 'utf-8':
+                sys.stdout.reconfigure(encoding='utf-8')
+            inspect_workbook(args.file, sys.stdout, args.format, args.sheets)
+    except BrokenPipeError:
+        # head 等で出力先が閉じられた場合は何も表示せずに終了する（終了時のフラッシュでも再発しないようにする）
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 0
+    except (OSError, KeyError, IndexError, ValueError, zipfile.BadZipFile) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+チェック結果の書き戻し（指摘のあったセルの色付けとコメント）
+openpyxl で読み込んで保存し直すと時間がかかり、openpyxl が扱えない書式や図形が
+失われるため、xlsx（zip）を直接書き換えます。
+
+- 変更するのはアクティブシートのXML・スタイル（styles.xml）・コメント関連のパートだけ
+- それ以外のメンバーは圧縮済みのバイト列をそのままコピーする（展開・再圧縮しない）
+- XMLは文字列として必要な箇所だけを書き換え、名前空間の接頭辞や拡張要素はそのまま残す
+
+  python3 excel_validator_cli.py 報告書.xlsx --annotate 報告書_チェック済み.xlsx
+"""
+
+import io
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from excel_validator_cli import SCORE_CELLS, TEXT_SECTIONS
+from report_reader import workbook_sheets, resolve_target
+from zip_patch import save_patched_zip
+
+# 重要度ごとの塗りつぶし色（ARGB）。1つのセルに複数の結果がある場合は最も重いものの色にする
+FILL_COLORS = {'エラー': 'FFFFC7CE', '警告': 'FFFFEB9C', '情報': 'FFDDEBF7'}
+SEVERITY_ORDER = ('エラー', '警告', '情報')
+COMMENT_AUTHOR = '報告書チェッカー'
+
+CELL_ITEM = re.compile(r'セル\((\d+), (\d+)\)')
+
+COMMENTS_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/comments'
+VML_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/vmlDrawing'
+COMMENTS_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.comments+xml'
+VML_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.vmlDrawing'
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+DOC_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+# legacyDrawing より後ろに置く必要があるワークシートの子要素（スキーマの順序）
+AFTER_LEGACY_DRAWING = ('legacyDrawingHF', 'drawingHF', 'picture', 'oleObjects', 'controls',
+                        'webPublishItems', 'tableParts', 'extLst')
+
+
+def finding_cell(result):
+    """結果の項目名から、指摘の対象セル (行, 列) を返す（判定できない場合は None）"""
+    prefix, _, rest = result['item'].partition(' - ')
+    if rest in SCORE_CELLS:
+        return SCORE_CELLS[rest]
+    if prefix == 'テストスコア':
+        return SCORE_CELLS['合計_結果'] if rest == '合計' else None
+    match = CELL_ITEM.fullmatch(rest)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    if rest in TEXT_SECTIONS:
+        return TEXT_SECTIONS[rest][:2]
+    return None
+
+
+def group_findings(results):
+    """セルごとに結果をまとめる: {(行, 列): [結果, ...]}（行・列の順）"""
+    cells = {}
+    for result in results:
+        cell = finding_cell(result)
+        if cell is not None:
+            cells.setdefault(cell, []).append(result)
+    return dict(sorted(cells.items()))
+
+
+def cell_ref(row: int, column: int) -> str:
+    letters = ''
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return f"{letters}{row}"
+
+
+def set_attribute(tag: str, name: str, value) -> str:
+    """開始タグの属性を書き換える（なければ追加する）"""
+    pattern = re.compile(rf'(\s{name}=)("[^"]*"|\'[^\']*\')')
+    if pattern.search(tag):
+        return pattern.sub(lambda m: f'{m.group(1)}"{value}"', tag, count=1)
+    end = len(tag) - (2 if tag.endswith('/>') else 1)
+    return f'{tag[:end]} {name}="{value}"{tag[end:]}'
+
+
+def get_attribute(tag: str, name: str):
+    match = re.search(rf'\s{name}=("([^"]*)"|\'([^\']*)\')', tag)
+    if match is None:
+        return None
+    return match.group(2) if match.group(2) is not None else match.group(3)
+
+
+def root_prefix(xml: str, local_name: str) -> str:
+    """ルート要素の名前空間の接頭辞（'x:' など。既定の名前空間なら ''）"""
+    match = re.search(rf'<(\w+:)?{local_name}[\s>]', xml)
+    if match is None:
+        raise ValueError(f"{local_name} 要素が見つかりません")
+    return match.group(1) or ''
+
+
+def decode_part(data: bytes, name: str) -> str:
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError(f"{name} がUTF-8ではないため書き換えられません")
+
+
+class StyleTable:
+    """styles.xml に塗りつぶしと、それを使うセル書式を追加する"""
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        self.p = root_prefix(xml, 'styleSheet')
+        self.fills = {}
+        self.styles = {}
+
+    def _section(self, name: str):
+        match = re.search(rf'<{self.p}{name}\b[^>]*>(.*?)</{self.p}{name}>', self.xml, re.S)
+        if match is None:
+            raise ValueError(f"styles.xml に {name} がありません")
+        return match
+
+    def _append(self, name: str, item_pattern: str, element: str) -> int:
+        """セクションの末尾に要素を追加し、その番号を返す（count 属性も更新する）"""
+        match = self._section(name)
+        count = len(re.findall(item_pattern, match.group(1), re.S))
+        start_tag = self.xml[match.start():match.start(1)]
+        start_tag = set_attribute(start_tag, 'count', count + 1)
+        self.xml = (self.xml[:match.start()] + start_tag + match.group(1) + element
+                    + self.xml[match.end(1):])
+        return count
+
+    def fill_id(self, severity: str) -> int:
+        if severity not in self.fills:
+            p = self.p
+            self.fills[severity] = self._append(
+                'fills', rf'<{p}fill\b(?:[^>]*/>|.*?</{p}fill>)',
+                f'<{p}fill><{p}patternFill patternType="solid"><{p}fgColor rgb="{FILL_COLORS[severity]}"/>'
+                f'<{p}bgColor indexed="64"/></{p}patternFill></{p}fill>')
+        return self.fills[severity]
+
+    def style_id(self, base: int, severity: str) -> int:
+        """既存のセル書式 base を、塗りつぶしだけ変えて複製した書式の番号を返す"""
+        key = (base, severity)
+        if key not in self.styles:
+            p = self.p
+            fill = self.fill_id(severity)
+            pattern = rf'<{p}xf\b(?:[^>]*?/>|[^>]*>.*?</{p}xf>)'
+            formats = re.findall(pattern, self._section('cellXfs').group(1), re.S)
+            if not 0 <= base < len(formats):
+                base = 0
+            xf = formats[base] if formats else f'<{p}xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            head_end = xf.index('>') + 1
+            head = set_attribute(set_attribute(xf[:head_end], 'fillId', fill), 'applyFill', 1)
+            self.styles[key] = self._append('cellXfs', pattern, head + xf[head_end:])
+        return self.styles[key]
+
+
+def highlight_cells(sheet_xml: str, cells: dict, styles: StyleTable) -> str:
+    """
+    シートXMLの対象セルの書式を、塗りつぶしを追加した書式に置き換える。
+    cells: {(行, 列): 重要度}。対象セルや行がない（空欄の）場合は要素を追加する。
+    """
+    p = root_prefix(sheet_xml, 'worksheet')
+    if re.search(rf'<{p}c(?=[\s/>])(?![^>]*\sr=)', sheet_xml) or \
+            re.search(rf'<{p}row(?=[\s/>])(?![^>]*\sr=)', sheet_xml):
+        raise ValueError("セル位置（r属性）が省略されたシートには書き込めません")
+
+    for (row, column), severity in cells.items():
+        ref = cell_ref(row, column)
+        match = re.search(rf'<{p}c\s[^>]*?\br="{ref}"[^>]*>', sheet_xml)
+        if match:
+            tag = match.group(0)
+            style = styles.style_id(int(get_attribute(tag, 's') or 0), severity)
+            sheet_xml = sheet_xml[:match.start()] + set_attribute(tag, 's', style) + sheet_xml[match.end():]
+            continue
+
+        new_cell = f'<{p}c r="{ref}" s="{styles.style_id(0, severity)}"/>'
+        sheet_xml = insert_cell(sheet_xml, p, row, column, new_cell)
+    return sheet_xml
+
+
+def insert_cell(sheet_xml: str, p: str, row: int, column: int, new_cell: str) -> str:
+    """存在しないセルを、行の中の列順の位置に追加する（行もなければ行ごと追加する）"""
+    row_pattern = re.compile(rf'<{p}row\s[^>]*>')
+    for match in row_pattern.finditer(sheet_xml):
+        number = int(get_attribute(match.group(0), 'r'))
+        if number < row:
+            continue
+        if number > row:
+            return sheet_xml[:match.start()] + f'<{p}row r="{row}">{new_cell}</{p}row>' + sheet_xml[match.start():]
+
+        # spans は省略可能なヒントのため、範囲外のセルを追加する行では削除する
+        tag = re.sub(r'\sspans=("[^"]*"|\'[^\']*\')', '', match.group(0))
+        if tag.endswith('/>'):
+            return sheet_xml[:match.start()] + f'{tag[:-2]}>{new_cell}</{p}row>' + sheet_xml[match.end():]
+        row_end = sheet_xml.index(f'</{p}row>', match.end())
+        position = row_end
+        for cell in re.finditer(rf'<{p}c\s[^>]*?\br="([A-Z]+)\d+"', sheet_xml[match.end():row_end]):
+            if column_number(cell.group(1)) > column:
+                position = match.end() + cell.start()
+                break
+        sheet_xml = sheet_xml[:position] + new_cell + sheet_xml[position:]
+        return sheet_xml[:match.start()] + tag + sheet_xml[match.end():]
+
+    empty = re.search(rf'<{p}sheetData\s*/>', sheet_xml)
+    if empty:
+        return (sheet_xml[:empty.start()] + f'<{p}sheetData><{p}row r="{row}">{new_cell}</{p}row></{p}sheetData>'
+                + sheet_xml[empty.end():])
+    end = sheet_xml.index(f'</{p}sheetData>')
+    return sheet_xml[:end] + f'<{p}row r="{row}">{new_cell}</{p}row>' + sheet_xml[end:]
+
+
+def column_number(letters: str) -> int:
+    number = 0
+    for char in letters:
+        number = number * 26 + ord(char) - ord('A') + 1
+    return number
+
+
+def comment_text(results) -> str:
+    return '\n'.join(f"[{r['severity']}] {r['type']}: {r['detail']}" for r in results)
+
+
+def vml_shape(shape_id: int, row: int, column: int) -> str:
+    # Excel が作成するメモと同じ既定の大きさ・位置（対象セルの右上）
+    return (
+        f'<v:shape id="_x0000_s{shape_id}" type="#_x0000_t202" '
+        'style="position:absolute;margin-left:59.25pt;margin-top:1.5pt;width:180pt;height:90pt;'
+        'z-index:1;visibility:hidden" fillcolor="#ffffe1" o:insetmode="auto">'
+        '<v:fill color2="#ffffe1"/><v:shadow on="t" color="black" obscured="t"/>'
+        '<v:path o:connecttype="none"/><v:textbox style="mso-direction-alt:auto">'
+        '<div style="text-align:left"></div></v:textbox>'
+        '<x:ClientData ObjectType="Note"><x:MoveWithCells/><x:SizeWithCells/>'
+        f'<x:Anchor>{column}, 15, {max(row - 2, 0)}, 10, {column + 3}, 15, {row + 4}, 4</x:Anchor>'
+        f'<x:AutoFill>False</x:AutoFill><x:Row>{row - 1}</x:Row><x:Column>{column - 1}</x:Column>'
+        '</x:ClientData></v:shape>'
+    )
+
+
+VML_NAMESPACES = {'v': 'urn:schemas-microsoft-com:vml', 'o': 'urn:schemas-microsoft-com:office:office',
+                  'x': 'urn:schemas-microsoft-com:office:excel'}
+NOTE_SHAPETYPE = (
+    '<v:shapetype id="_x0000_t202" coordsize="21600,21600" o:spt="202" path="m,l,21600r21600,l21600,xe">'
+    '<v:stroke joinstyle="miter"/><v:path gradientshapeok="t" o:connecttype="rect"/></v:shapetype>'
+)
+
+
+def new_vml(idmap: int) -> str:
+    declarations = ' '.join(f'xmlns:{prefix}="{uri}"' for prefix, uri in VML_NAMESPACES.items())
+    return (f'<xml {declarations}>'
+            f'<o:shapelayout v:ext="edit"><o:idmap v:ext="edit" data="{idmap}"/></o:shapelayout>'
+            f'{NOTE_SHAPETYPE}</xml>')
+
+
+def prepare_vml(vml: str) -> str:
+    """
+    既存のVMLに追加する図形のため、v/o/x の接頭辞の宣言とメモの図形の型を用意する
+    （openpyxl 等は ns0/ns1 のような別の接頭辞で書き出すため）
+    """
+    match = re.search(r'<xml\b[^>]*>', vml)
+    if match is None:
+        raise ValueError("VMLの形式が不明なため書き込めません")
+    tag = match.group(0)
+    for prefix, uri in VML_NAMESPACES.items():
+        if f'xmlns:{prefix}=' not in tag:
+            tag = f'{tag[:-1]} xmlns:{prefix}="{uri}">'
+    vml = vml[:match.start()] + tag + vml[match.end():]
+    if 'id="_x0000_t202"' not in vml:
+        position = match.start() + len(tag)
+        vml = vml[:position] + NOTE_SHAPETYPE + vml[position:]
+    return vml
+
+
+def new_comments() -> str:
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<comments xmlns="{MAIN_NS}"><authors></authors><commentList></commentList></comments>')
+
+
+def new_part_name(names, pattern: str) -> str:
+    number = 1
+    while pattern.format(number) in names:
+        number += 1
+    return pattern.format(number)
+
+
+class ReportAnnotator:
+    """
+    報告書（xlsx）のアクティブシートに、チェック結果の色付けとコメントを書き込む。
+    parts には書き換えた（または追加した）パートだけを保持し、save() で
+    それ以外のメンバーを元のzipからそのままコピーする。
+    """
+
+    def __init__(self, source: str):
+        with open(source, 'rb') as f:
+            self.data = f.read()
+        # 書き換えるパートの読み込み用（元のファイルはコピー元として data を使う）
+        self.archive = zipfile.ZipFile(io.BytesIO(self.data))
+        self.names = set(self.archive.namelist())
+        sheets, active = workbook_sheets(self.archive)
+        self.sheet_path = sheets[active][1]
+        self.parts = {}
+
+    @property
+    def rels_path(self) -> str:
+        directory, _, filename = self.sheet_path.rpartition('/')
+        return f"{directory}/_rels/{filename}.rels"
+
+    def has_part(self, name: str) -> bool:
+        return name in self.parts or name in self.names
+
+    def part(self, name: str) -> str:
+        """パートの内容（書き換え済みならその内容）を返す"""
+        if name not in self.parts:
+            self.parts[name] = decode_part(self.archive.read(name), name)
+        return self.parts[name]
+
+    def annotate(self, results) -> int:
+        """結果を書き込み、書き込んだセルの数を返す"""
+        cells = group_findings(results)
+        if not cells:
+            return 0
+        if 'xl/styles.xml' not in self.names:
+            raise ValueError("styles.xml のないブックには書き込めません")
+
+        styles = StyleTable(self.part('xl/styles.xml'))
+        severities = {cell: min((r['severity'] for r in findings), key=SEVERITY_ORDER.index)
+                      for cell, findings in cells.items()}
+        self.parts[self.sheet_path] = highlight_cells(self.part(self.sheet_path), severities, styles)
+        self.parts['xl/styles.xml'] = styles.xml
+        self.add_comments(cells)
+        return len(cells)
+
+    def sheet_relationships(self):
+        """シートのリレーションシップ: [(Id, 種類, zip内のパス), ...]"""
+        if not self.has_part(self.rels_path):
+            return []
+        base = self.sheet_path.rpartition('/')[0]
+        return [(get_attribute(tag, 'Id'), get_attribute(tag, 'Type'),
+                 resolve_target(base, get_attribute(tag, 'Target') or ''))
+                for tag in re.findall(r'<(?:\w+:)?Relationship\s[^>]*>', self.part(self.rels_path))]
+
+    def add_relationship(self, rel_type: str, path: str) -> str:
+        if not self.has_part(self.rels_path):
+            self.parts[self.rels_path] = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                                          f'<Relationships xmlns="{RELS_NS}"></Relationships>')
+        used = {rel_id for rel_id, _, _ in self.sheet_relationships()}
+        number = 1
+        while f"rId{number}" in used:
+            number += 1
+        rel_id = f"rId{number}"
+        target = posixpath.relpath(path, self.sheet_path.rpartition('/')[0])
+        xml = self.part(self.rels_path)
+        p = root_prefix(xml, 'Relationships')
+        end = xml.rindex(f'</{p}Relationships>')
+        self.parts[self.rels_path] = (xml[:end] + f'<{p}Relationship Id="{rel_id}" Type="{rel_type}" '
+                                      f'Target="{target}"/>' + xml[end:])
+        return rel_id
+
+    def add_content_type(self, element: str, exists: str):
+        xml = self.part('[Content_Types].xml')
+        if re.search(exists, xml):
+            return
+        end = xml.rindex('</Types>')
+        self.parts['[Content_Types].xml'] = xml[:end] + element + xml[end:]
+
+    def add_comments(self, cells: dict):
+        relationships = self.sheet_relationships()
+        comments_path = next((path for _, kind, path in relationships if kind == COMMENTS_TYPE), None)
+        vml_path = next((path for _, kind, path in relationships if kind == VML_TYPE), None)
+
+        if comments_path is None:
+            comments_path = new_part_name(self.names, 'xl/comments{}.xml')
+            self.parts[comments_path] = new_comments()
+            self.add_relationship(COMMENTS_TYPE, comments_path)
+            self.add_content_type(
+                f'<Override PartName="/{comments_path}" ContentType="{COMMENTS_CONTENT_TYPE}"/>',
+                rf'PartName="/{re.escape(comments_path)}"')
+        if vml_path is None:
+            vml_path = new_part_name(self.names, 'xl/drawings/vmlDrawing{}.vml')
+            used = {int(n) for name in self.names if name.endswith('.vml')
+                    for n in re.findall(rb'<o:idmap[^>]*data="(\d+)', self.archive.read(name))}
+            idmap = 1
+            while idmap in used:
+                idmap += 1
+            self.parts[vml_path] = new_vml(idmap)
+            rel_id = self.add_relationship(VML_TYPE, vml_path)
+            self.add_content_type(f'<Default Extension="vml" ContentType="{VML_CONTENT_TYPE}"/>',
+                                  r'Extension="vml"')
+            self.parts[self.sheet_path] = add_legacy_drawing(self.part(self.sheet_path), rel_id)
+
+        comments = self.part(comments_path)
+        p = root_prefix(comments, 'comments')
+        commented = set(re.findall(rf'<{p}comment\s[^>]*?\bref="([A-Z]+\d+)"', comments))
+        authors = re.findall(rf'<{p}author>(.*?)</{p}author>', comments, re.S)
+        if escape(COMMENT_AUTHOR) in authors:
+            author_id = authors.index(escape(COMMENT_AUTHOR))
+        else:
+            author_id = len(authors)
+            comments = re.sub(rf'</{p}authors>|<{p}authors\s*/>',
+                              lambda m: f'<{p}authors>' * m.group(0).endswith('/>')
+                              + f'<{p}author>{escape(COMMENT_AUTHOR)}</{p}author></{p}authors>',
+                              comments, count=1)
+
+        vml = prepare_vml(self.part(vml_path))
+        shape_id = max([int(n) for n in re.findall(r'_x0000_s(\d+)', vml)] or [0])
+        if not shape_id:
+            idmap = re.search(r'<o:idmap[^>]*data="(\d+)', vml)
+            shape_id = int(idmap.group(1)) * 1024 if idmap else 1024
+
+        new_comments_xml, shapes = [], []
+        for (row, column), findings in cells.items():
+            ref = cell_ref(row, column)
+            if ref in commented:
+                # 既存のメモは上書きしない（色付けだけ行う）
+                continue
+            text = escape(comment_text(findings))
+            new_comments_xml.append(
+                f'<{p}comment ref="{ref}" authorId="{author_id}"><{p}text>'
+                f'<{p}t xml:space="preserve">{text}</{p}t></{p}text></{p}comment>')
+            shape_id += 1
+            shapes.append(vml_shape(shape_id, row, column))
+
+        comments = re.sub(rf'</{p}commentList>|<{p}commentList\s*/>',
+                          lambda m: f'<{p}commentList>' * m.group(0).endswith('/>')
+                          + ''.join(new_comments_xml) + f'</{p}commentList>',
+                          comments, count=1)
+        self.parts[comments_path] = comments
+        end = vml.rindex('</xml>')
+        self.parts[vml_path] = vml[:end] + ''.join(shapes) + vml[end:]
+
+    def save(self, output: str):
+        """書き換えたパートだけを圧縮し直して保存する（同じパスへの上書きも可）"""
+        save_patched_zip(self.data, {name: xml.encode('utf-8') for name, xml in self.parts.items()}, output)
+
+
+def add_legacy_drawing(sheet_xml: str, rel_id: str) -> str:
+    """ワークシートに legacyDrawing 要素をスキーマの順序どおりの位置に追加する"""
+    p = root_prefix(sheet_xml, 'worksheet')
+    element = f'<{p}legacyDrawing xmlns:r="{DOC_REL_NS}" r:id="{rel_id}"/>'
+    positions = [match.start() for name in AFTER_LEGACY_DRAWING
+                 for match in [re.search(rf'<{p}{name}[\s/>]', sheet_xml)] if match]
+    position = min(positions) if positions else sheet_xml.rindex(f'</{p}worksheet>')
+    return sheet_xml[:position] + element + sheet_xml[position:]
+
+
+def annotate_report(source: str, output: str, results) -> int:
+    """チェック結果を書き込んだ報告書のコピーを output に保存し、書き込んだセルの数を返す"""
+    from xls_reader import is_xls
+    if is_xls(source):
+        raise ValueError("旧形式（.xls）の報告書には書き込めません")
+    annotator = ReportAnnotator(source)
+    count = annotator.annotate(results)
+    annotator.save(output)
+    return count
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""
+一括チェック
+複数のファイル・フォルダ・zipアーカイブをまとめてチェックし、ファイルごとの件数と
+全体の集計を表示します。各結果には 'file' キーでファイルパス（zip内のファイルは
+「アーカイブ!メンバー」）が付き、-o で1つのレポートにまとめて保存できます。
+
+zipアーカイブ内の報告書は展開せず、メンバーをメモリに読み込んでそのままチェックします。
+
+ワーカーで実行する場合は、zipの中央ディレクトリから見積もった処理コストの大きい順に
+割り当て、大きなファイルが最後に残って1つのワーカーだけが動き続ける状態を避けます。
+"""
+
+import io
+import os
+import time
+import zipfile
+from contextlib import nullcontext
+from typing import NamedTuple, Optional
+
+import metrics
+from excel_validator_cli import SEVERITY_RANK, TEXT_SECTIONS
+
+# フォルダやzipアーカイブ内で対象とする拡張子
+EXCEL_SUFFIXES = ('.xlsx', '.xlsm', '.xls')
+ARCHIVE_SUFFIXES = ('.zip',)
+
+# ファイルを処理する順序
+#   input:  指定した順（フォルダ内は名前順）
+#   cost:   見積もった処理コストの大きい順（ワーカー使用時の既定）
+#   recent: 更新日時の新しい順（同じ日時ならコストの大きい順）
+SCHEDULES = ('input', 'cost', 'recent')
+
+
+class ReportSource(NamedTuple):
+    """チェック対象の報告書。member が None なら通常のファイル、それ以外は path のzip内のメンバー"""
+    key: str
+    path: str
+    member: Optional[str] = None
+
+
+def is_report_name(name: str) -> bool:
+    base = name.replace('\\', '/').rsplit('/', 1)[-1]
+    return (base.lower().endswith(EXCEL_SUFFIXES) and not base.startswith('~$')
+            and not name.startswith('__MACOSX/'))
+
+
+def member_display_name(info: zipfile.ZipInfo) -> str:
+    """
+    zipメンバーの表示名。UTF-8フラグのないファイル名は zipfile が CP437 として読むため、
+    元のバイト列に戻して読み直す。Linux の Info-ZIP 等はフラグなしでUTF-8の名前を格納するため
+    先にUTF-8として読み、読めなければWindowsで作成したzipに多いCP932として読む。
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        raw = info.filename.encode('cp437')
+    except UnicodeEncodeError:
+        return info.filename
+    for encoding in ('utf-8', 'cp932'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return info.filename
+
+
+def iter_archive_sources(path: str):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            infos = [info for info in archive.infolist()
+                     if not info.is_dir() and is_report_name(member_display_name(info))]
+    except (OSError, zipfile.BadZipFile):
+        # 壊れたアーカイブは通常のファイルとして扱い、読み込みエラーとして報告する
+        yield ReportSource(path, path)
+        return
+    for info in sorted(infos, key=member_display_name):
+        yield ReportSource(f"{path}!{member_display_name(info)}", path, info.filename)
+
+
+def iter_report_sources(paths):
+    """
+    ファイルはそのまま、フォルダは配下のExcelファイルとzipアーカイブを名前順に、
+    zipアーカイブは中のExcelファイルを ReportSource として返す（Excelの一時ファイル ~$ は除く）
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    if name.lower().endswith(ARCHIVE_SUFFIXES):
+                        yield from iter_archive_sources(file_path)
+                    elif is_report_name(name):
+                        yield ReportSource(file_path, file_path)
+        elif path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path):
+            yield from iter_archive_sources(path)
+        else:
+            yield ReportSource(path, path)
+
+
+class ArchiveCache:
+    """直前に開いたzipアーカイブを開いたままにして、同じアーカイブのメンバーを続けて読む"""
+
+    def __init__(self):
+        self.path = None
+        self.archive = None
+
+    def read(self, path: str, member: str) -> bytes:
+        if path != self.path:
+            self.close()
+            self.archive = zipfile.ZipFile(path)
+            self.path = path
+        return self.archive.read(member)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+        self.path = None
+        self.archive = None
+
+
+def workbook_cost(path: str) -> int:
+    """ブックの圧縮後サイズから画像・埋め込みオブジェクトを除いた合計（中央ディレクトリのみ読む）"""
+    try:
+        with zipfile.ZipFile(path) as workbook:
+            return sum(info.compress_size for info in workbook.infolist()
+                       if not info.filename.startswith(('xl/media/', 'xl/embeddings/')))
+    except zipfile.BadZipFile:
+        # .xls は圧縮されていないため、ファイルサイズをそのままコストとする
+        return os.path.getsize(path) if path.lower().endswith('.xls') else 0
+    except OSError:
+        # 開けないファイルはすぐに読み込みエラーになるため、コストは最小とする
+        return 0
+
+
+def estimate_costs(sources):
+    """
+    各報告書の処理コストの目安と更新日時を返す。
+    コストは解析するXMLの圧縮後バイト数の目安で、通常のファイルは画像等を除いたサイズ、
+    zip内の報告書は中のブックを展開しないと内訳が分からないため報告書全体のサイズとする。
+    戻り値: [(コスト, 更新日時), ...]（sources と同じ順）
+    """
+    archives = {}
+    estimates = []
+    for source in sources:
+        if source.member is None:
+            try:
+                mtime = os.stat(source.path).st_mtime
+            except OSError:
+                mtime = 0
+            estimates.append((workbook_cost(source.path), mtime))
+            continue
+        if source.path not in archives:
+            try:
+                with zipfile.ZipFile(source.path) as archive:
+                    archives[source.path] = {info.filename: info for info in archive.infolist()}
+            except (OSError, zipfile.BadZipFile):
+                archives[source.path] = {}
+        info = archives[source.path].get(source.member)
+        if info is None:
+            estimates.append((0, 0))
+        else:
+            estimates.append((info.file_size, time.mktime(info.date_time + (0, 0, -1))))
+    return estimates
+
+
+def schedule_tasks(tasks, schedule: str):
+    """
+    tasks: [(番号, ReportSource), ...] を schedule（SCHEDULES のいずれか）の順に並べ替える。
+    コストの大きい順（LPT）に割り当てると、全体の所要時間が最も長いファイルの
+    処理時間に近づく。
+    """
+    if schedule == 'input' or len(tasks) < 2:
+        return list(tasks)
+    estimates = estimate_costs([source for _, source in tasks])
+    order = list(range(len(tasks)))
+    if schedule == 'recent':
+        order.sort(key=lambda i: (-estimates[i][1], -estimates[i][0]))
+    else:
+        order.sort(key=lambda i: -estimates[i][0])
+    return [tasks[i] for i in order]
+
+
+def count_by_severity(results):
+    counts = {severity: 0 for severity in SEVERITY_RANK}
+    for result in results:
+        if result['severity'] in counts:
+            counts[result['severity']] += 1
+    return counts
+
+
+class BatchJournal:
+    """
+    一括チェックの再開用ジャーナル（1行1JSON）。
+    1行目はチェック条件、以降は完了したファイルごとのエントリで、追記のたびに fsync する。
+    途中で強制終了しても記録済みのファイルは失われず、--resume で残りのファイルだけを
+    チェックできる。読み込みに失敗したファイル（タイムアウト・ワーカー異常終了等）は
+    再開時にチェックし直す。書き込み途中で終了した最後の行は読み込み時に切り捨てる。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, settings: dict, resume=False):
+        import json
+        self.json = json
+        self.path = path
+        self.completed = {}
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if not resume:
+                raise ValueError(f"ジャーナルが既に存在します: {path}（続きから実行する場合は --resume を指定してください）")
+            self.load(settings)
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.write_line({'journal': self.VERSION, 'settings': settings})
+
+    def load(self, settings: dict):
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for number, line in enumerate(f):
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = self.json.loads(line)
+                except ValueError:
+                    break
+                if number == 0:
+                    if record.get('journal') != self.VERSION:
+                        raise ValueError(f"ジャーナルの形式が違います: {self.path}")
+                    if record.get('settings') != settings:
+                        raise ValueError("ジャーナル作成時とチェック条件が異なるため再開できません")
+                elif not record.get('failed'):
+                    self.completed[record['file']] = record
+                valid_size += len(line)
+
+        # 書き込み途中で終了した行を切り捨て、続きを正しい位置から追記する
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def write_line(self, record: dict):
+        self.file.write(self.json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def append(self, entry: dict):
+        self.write_line(entry)
+
+    def close(self):
+        self.file.close()
+
+
+def error_entry(key: str, error_type: str, detail: str):
+    """ファイルをチェックできなかったことを表すエントリ"""
+    return {'file': key, 'failed': True, 'results': [{
+        'file': key,
+        'item': 'ファイル読み込み',
+        'type': error_type,
+        'severity': 'エラー',
+        'detail': detail
+    }]}
+
+
+def read_error_entry(key: str, error: Exception):
+    return error_entry(key, '読み込みエラー', f"ファイルの読み込み中にエラーが発生しました: {str(error)}")
+
+
+class BatchValidator:
+    def __init__(self, validator, options: dict, reader=None, near_duplicates=None, journal=None,
+                 zip_limits=None, pool=None, schedule=None, summary=None, history=None, memory_trace=None):
+        """
+        validator:       StudentReportValidatorCLI
+        options:         check_sheet に渡すチェックオプション
+        reader:          読み込みバックエンド（None の場合は run_checks と同じ規則）
+        near_duplicates: 報告書間の類似文章検出の設定（NearDuplicateIndex の引数）。None なら行わない
+        journal:         BatchJournal。指定すると完了したファイルを追記し、記録済みのファイルは省略する
+        zip_limits:      解析前に確認する展開後サイズの上限（check_zip_limits の引数）
+        pool:            IsolatedWorkerPool。指定するとチェックを別プロセスのワーカーで実行する
+        schedule:        処理順（SCHEDULES のいずれか）。None ならワーカー使用時は cost、それ以外は input。
+                         結果の並びは処理順に関わらず入力順になる
+        summary:         SummaryWorkbook。指定すると完了したファイルから1行ずつ書き出す
+        history:         生徒ごとの過去の報告書の索引のフォルダ。指定すると前の期との比較を追加する
+        memory_trace:    MemoryTrace。指定するとファイルごとのメモリ使用量を記録する
+                         （ワーカー使用時はワーカー内は計測できないため、結果の記録の分のみ）
+        """
+        self.validator = validator
+        self.journal = journal
+        self.options = options
+        self.reader = reader
+        self.near_duplicates = near_duplicates
+        self.zip_limits = zip_limits or {}
+        self.pool = pool
+        self.schedule = schedule
+        self.summary = summary
+        self.history = history
+        self.history_index = None
+        self.memory_trace = memory_trace
+        self.entries = {}
+        self.results = []
+        self.file_count = 0
+        self.failed_count = 0
+        self.archives = ArchiveCache()
+
+    def worker_settings(self):
+        """ワーカープロセスで同じ設定の BatchValidator を作るための引数"""
+        settings = {'options': self.options, 'reader': self.reader,
+                    'near_duplicates': self.near_duplicates, 'zip_limits': self.zip_limits}
+        if self.history is not None:
+            settings['history'] = self.history
+        return settings
+
+    def default_reader(self):
+        if self.reader is not None:
+            return self.reader
+        return 'stream' if (self.options.get('min_severity') or self.options.get('fail_fast')) else 'openpyxl'
+
+    def open_source(self, source: ReportSource):
+        """通常のファイルはパスを、zip内のメンバーはメモリ上のファイルオブジェクトを返す"""
+        if source.member is None:
+            return source.path
+        return io.BytesIO(self.archives.read(source.path, source.member))
+
+    def read_snapshot(self, source: ReportSource):
+        """展開後のサイズを確認してから報告書を開き、必要なセルだけを取り出してすぐに閉じる"""
+        from check_registry import snapshot_cells
+        from report_reader import open_report, check_zip_limits, CellSnapshot
+        from xls_reader import is_xls
+        with metrics.stage('read'):
+            data = self.open_source(source)
+            # .xls は圧縮されていないため、展開後サイズの確認は不要
+            if not is_xls(data):
+                check_zip_limits(data, **self.zip_limits)
+            sheet = open_report(data, self.default_reader())
+            try:
+                return CellSnapshot.capture(sheet, snapshot_cells())
+            finally:
+                sheet.close()
+
+    def validate_one(self, source: ReportSource):
+        """
+        1ファイルをチェックし、結果をまとめたエントリを返す。
+        エントリ: {'file': キー, 'failed': 読み込み失敗か, 'results': ['file' キー付きの結果, ...],
+                   'summary': 集計ブック用の文字数とスコア（読み込みに成功した場合のみ）,
+                   'texts': {項目名: 文章}（類似文章検出を行う場合のみ）}
+        """
+        with metrics.timed('check_excel_file_seconds'):
+            try:
+                snapshot = self.read_snapshot(source)
+            except MemoryError:
+                # メモリ不足は呼び出し側（ワーカー）でプロセスごと入れ替えて対処する
+                raise
+            except Exception as e:
+                return read_error_entry(source.key, e)
+            return self.check_snapshot(source.key, snapshot)
+
+    def check_snapshot(self, key: str, snapshot):
+        """読み込み済みのスナップショットをチェックしてエントリを作る"""
+        from batch_summary import report_summary
+        entry = {'file': key, 'failed': False, 'summary': report_summary(snapshot)}
+        if self.near_duplicates is not None:
+            entry['texts'] = {}
+            for section_name, (row, col, _, _) in TEXT_SECTIONS.items():
+                content = snapshot.cell(row=row, column=col).value
+                if isinstance(content, str):
+                    entry['texts'][section_name] = content
+
+        results = self.validator.check_sheet(snapshot, **self.options)
+        if self.history is not None:
+            results += self.history_results(key, snapshot)
+        entry['results'] = [{'file': key, **result} for result in results]
+        return entry
+
+    def history_results(self, key: str, snapshot):
+        """前の期の記録との比較結果（--min-severity 未満のものは除く）"""
+        if self.history_index is None:
+            from history_index import HistoryIndex
+            self.history_index = HistoryIndex(self.history)
+        min_rank = SEVERITY_RANK.get(self.options.get('min_severity'), 0)
+        with metrics.stage('history'):
+            results = self.history_index.check(key, snapshot)
+        return [result for result in results if SEVERITY_RANK[result['severity']] >= min_rank]
+
+    def record(self, index: int, entry: dict, resumed=False):
+        """
+        エントリを記録する（ジャーナルから復元したものは1行表示を省略する）。
+        ワーカー使用時は完了順に届くため、結果は finish() で入力順に並べ直す。
+        """
+        if self.summary is not None:
+            self.summary.add(entry)
+        if not resumed and self.journal is not None:
+            self.journal.append(entry)
+        # 集計ブック用の値は書き出した後は不要なため、全件分を保持しない
+        entry.pop('summary', None)
+        self.entries[index] = entry
+        if resumed:
+            return
+        metrics.record_entry(entry)
+        counts = count_by_severity(entry['results'])
+        mark = '✗' if counts['エラー'] else '✓'
+        print(f"{mark} {entry['file']}: エラー {counts['エラー']}件, 警告 {counts['警告']}件, 情報 {counts['情報']}件")
+
+    def run(self, paths):
+        completed = self.journal.completed if self.journal is not None else {}
+        resumed = 0
+        pending = []
+        try:
+            for index, source in enumerate(iter_report_sources(paths)):
+                if source.key in completed:
+                    self.record(index, completed[source.key], resumed=True)
+                    resumed += 1
+                else:
+                    pending.append((index, source))
+
+            schedule = self.schedule or ('cost' if self.pool is not None else 'input')
+            pending = schedule_tasks(pending, schedule)
+            remaining = len(pending)
+            metrics.set_gauge('check_excel_queue_depth', remaining, queue='batch')
+            if self.pool is not None:
+                if pending:
+                    for index, entry in self.pool.run(pending):
+                        with self.track_memory(entry['file']):
+                            self.record(index, entry)
+                        remaining -= 1
+                        metrics.set_gauge('check_excel_queue_depth', remaining, queue='batch')
+                    print(self.pool.utilization_summary())
+            else:
+                for index, source in pending:
+                    with self.track_memory(source.key):
+                        try:
+                            entry = self.validate_one(source)
+                        except MemoryError:
+                            entry = error_entry(source.key, 'メモリ不足', "メモリ不足のためチェックを中止しました")
+                        self.record(index, entry)
+                    remaining -= 1
+                    metrics.set_gauge('check_excel_queue_depth', remaining, queue='batch')
+        finally:
+            self.archives.close()
+            if self.journal is not None:
+                self.journal.close()
+        if resumed:
+            print(f"ジャーナルに記録済みの {resumed}件 はチェックを省略しました")
+        self.finish()
+        self.display_summary()
+        return self.results
+
+    def track_memory(self, key: str):
+        if self.memory_trace is None:
+            return nullcontext()
+        return self.memory_trace.track(key)
+
+    def finish(self):
+        """入力順に結果を集計し、類似文章の検出を行う"""
+        duplicate_index = None
+        if self.near_duplicates is not None:
+            from near_duplicates import NearDuplicateIndex
+            duplicate_index = NearDuplicateIndex(**self.near_duplicates)
+
+        for index in sorted(self.entries):
+            entry = self.entries[index]
+            self.file_count += 1
+            if entry['failed']:
+                self.failed_count += 1
+            self.results.extend(entry['results'])
+            if duplicate_index is not None:
+                for section_name, content in entry.get('texts', {}).items():
+                    duplicate_index.add((entry['file'], section_name), content)
+
+        if duplicate_index is not None:
+            self.add_near_duplicate_results(duplicate_index)
+
+    def add_near_duplicate_results(self, duplicate_index):
+        """類似文章のクラスタを、クラスタに含まれる各ファイルの警告として追加する"""
+        if SEVERITY_RANK['警告'] < SEVERITY_RANK.get(self.options.get('min_severity'), 0):
+            return
+
+        clusters = [cluster for cluster in duplicate_index.clusters()
+                    if len({file for (file, _), _ in cluster}) > 1]
+        for cluster in clusters:
+            for (file, section_name), score in cluster:
+                others = [(other_file, other_section) for (other_file, other_section), _ in cluster
+                          if other_file != file]
+                examples = '、'.join(f"{other_file} の{other_section}" for other_file, other_section in others[:3])
+                self.results.append({
+                    'file': file,
+                    'item': f"重複文章 - {section_name}",
+                    'type': '他の報告書と酷似',
+                    'severity': '警告',
+                    'detail': f"他の報告書（{len(others)}件）とほぼ同じ文章です（例: {examples}）"
+                })
+        if clusters:
+            print(f"\n類似文章のグループ: {len(clusters)}件（各ファイルに警告として追加しました）")
+
+    def display_summary(self):
+        counts = count_by_severity(self.results)
+        print("\n\n一括チェック結果サマリー:")
+        print("=" * 80)
+        print(f"ファイル数: {self.file_count}件（読み込み失敗: {self.failed_count}件）")
+        print(f"エラー: {counts['エラー']}件")
+        print(f"警告: {counts['警告']}件")
+        print(f"情報: {counts['情報']}件")
+        print("=" * 80)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+一括チェックの読み込み/解析パイプライン
+報告書の読み込み（zipの展開とXML解析）と文章のチェック（誤字脱字・キーワード・文の構成）は
+負荷の性質が違うため、別々のプロセス群に分けて同時に動かします。
+
+- 読み込みプロセス: 必要なセルの値だけを取り出し、値のタプルを共有メモリのスロットに書き込む
+- 解析プロセス:     スロットから値を読み出してチェックし、エントリを返す
+
+スロットの数とスロット番号のキューの長さには上限があるため、解析が追いつかない間は
+読み込みプロセスが待ち（背圧）、読み込んだ値がメモリに溜まり続けることはありません。
+プロセス間で受け渡すのはセルの値のタプルだけで、openpyxl のオブジェクトは渡しません。
+終了時に段ごとの稼働率を表示するため、読み込みと解析のプロセス数の配分を調整できます。
+"""
+
+import multiprocessing
+import pickle
+import queue
+import time
+from multiprocessing import shared_memory
+
+from batch import error_entry, read_error_entry
+from check_registry import snapshot_cells
+
+# 1スロットの大きさ。報告書1件分のセルの値は通常数KBに収まり、
+# 超える場合はスロットを使わずキューで直接受け渡す
+SLOT_SIZE = 64 * 1024
+
+
+class SnapshotRing:
+    """
+    固定長スロットを並べた共有メモリ。空いているスロット番号をキューで管理し、
+    空きがない間は書き込み側を待たせる。
+    """
+
+    def __init__(self, context, slots: int, slot_size=SLOT_SIZE):
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.free = context.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def put(self, values: tuple):
+        """値を書き込み、読み出し用のハンドル（スロット番号, 長さ）を返す"""
+        data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size:
+            return None, data
+        slot = self.free.get()
+        start = slot * self.slot_size
+        self.memory.buf[start:start + len(data)] = data
+        return slot, len(data)
+
+    def take(self, handle) -> tuple:
+        """ハンドルの値を読み出し、スロットを空きに戻す"""
+        slot, payload = handle
+        if slot is None:
+            return pickle.loads(payload)
+        start = slot * self.slot_size
+        data = bytes(self.memory.buf[start:start + payload])
+        self.free.put(slot)
+        return pickle.loads(data)
+
+    def close(self, unlink=False):
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def make_batch(settings: dict):
+    from excel_validator_cli import StudentReportValidatorCLI
+    from batch import BatchValidator
+    return BatchValidator(StudentReportValidatorCLI(verbose=False), **settings)
+
+
+def reader_main(settings: dict, tasks, analysis, results, ring: SnapshotRing):
+    """タスクの報告書を読み込み、セルの値を共有メモリ経由で解析プロセスに渡す"""
+    batch = make_batch(settings)
+    cells = snapshot_cells()
+    started = time.monotonic()
+    busy = 0.0
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            index, source = task
+            begin = time.monotonic()
+            try:
+                snapshot = batch.read_snapshot(source)
+            except MemoryError:
+                results.put(('entry', index, error_entry(source.key, 'メモリ不足',
+                                                         "メモリ不足のためチェックを中止しました")))
+            except Exception as e:
+                results.put(('entry', index, read_error_entry(source.key, e)))
+            else:
+                # セルの値の後ろにシート名を付けて渡す
+                values = tuple(snapshot.cell(row=row, column=col).value for row, col in cells)
+                values += (snapshot.title,)
+                busy += time.monotonic() - begin
+                # スロットや解析待ちのキューが空くまでの待ち時間は稼働時間に含めない
+                analysis.put((index, source.key, ring.put(values)))
+                continue
+            busy += time.monotonic() - begin
+    finally:
+        batch.archives.close()
+        ring.close()
+        results.put(('stats', 'reader', busy, time.monotonic() - started))
+
+
+def analyzer_main(settings: dict, analysis, results, ring: SnapshotRing):
+    """共有メモリからセルの値を受け取ってチェックする"""
+    from report_reader import CellSnapshot
+    batch = make_batch(settings)
+    cells = snapshot_cells()
+    started = time.monotonic()
+    busy = 0.0
+    try:
+        while True:
+            item = analysis.get()
+            if item is None:
+                break
+            index, key, handle = item
+            begin = time.monotonic()
+            values = ring.take(handle)
+            snapshot = CellSnapshot(dict(zip(cells, values)), values[-1])
+            entry = batch.check_snapshot(key, snapshot)
+            busy += time.monotonic() - begin
+            results.put(('entry', index, entry))
+    finally:
+        ring.close()
+        results.put(('stats', 'analyzer', busy, time.monotonic() - started))
+
+
+class PipelinePool:
+    def __init__(self, settings: dict, readers=1, analyzers=1, slots=None):
+        """
+        settings:  BatchValidator.worker_settings() の戻り値
+        readers:   読み込みプロセス数
+        analyzers: 解析プロセス数
+        slots:     共有メモリのスロット数（読み込み済みで解析待ちにできる件数の上限）
+        """
+        self.settings = settings
+        self.readers = max(1, readers)
+        self.analyzers = max(1, analyzers)
+        self.slots = slots or 2 * (self.readers + self.analyzers)
+        self.context = multiprocessing.get_context()
+        # 直前の run() の段ごとの (稼働時間の合計, プロセス数) と経過時間
+        self.stage_busy = {}
+        self.elapsed = 0.0
+
+    def run(self, tasks):
+        """
+        tasks: [(番号, ReportSource), ...]
+        完了したものから (番号, エントリ) を返す（IsolatedWorkerPool.run と同じ形）。
+        """
+        tasks = list(tasks)
+        if not tasks:
+            return
+        context = self.context
+        ring = SnapshotRing(context, self.slots)
+        task_queue = context.Queue()
+        analysis = context.Queue(self.slots)
+        results = context.Queue()
+        for task in tasks:
+            task_queue.put(task)
+        for _ in range(self.readers):
+            task_queue.put(None)
+
+        processes = [context.Process(target=reader_main, daemon=True,
+                                     args=(self.settings, task_queue, analysis, results, ring))
+                     for _ in range(self.readers)]
+        processes += [context.Process(target=analyzer_main, daemon=True,
+                                      args=(self.settings, analysis, results, ring))
+                      for _ in range(self.analyzers)]
+        started = time.monotonic()
+        self.stage_busy = {'reader': [0.0, self.readers], 'analyzer': [0.0, self.analyzers]}
+        stats_received = 0
+        remaining = dict(tasks)
+        try:
+            for process in processes:
+                process.start()
+
+            while remaining:
+                try:
+                    message = results.get(timeout=1)
+                except queue.Empty:
+                    if any(process.exitcode not in (None, 0) for process in processes):
+                        break
+                    continue
+                if message[0] == 'stats':
+                    self.stage_busy[message[1]][0] += message[2]
+                    stats_received += 1
+                    continue
+                _, index, entry = message
+                if remaining.pop(index, None) is not None:
+                    yield index, entry
+
+            # プロセスが異常終了した場合、結果の届いていないファイルはまとめてエラーにする
+            for index, source in list(remaining.items()):
+                del remaining[index]
+                yield index, error_entry(source.key, 'ワーカー異常終了',
+                                         "チェック中に読み込み/解析プロセスが異常終了しました")
+
+            if any(process.exitcode not in (None, 0) for process in processes):
+                return
+            for _ in range(self.analyzers):
+                analysis.put(None)
+            deadline = time.monotonic() + 5
+            while stats_received < len(processes) and time.monotonic() < deadline:
+                try:
+                    message = results.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if message[0] == 'stats':
+                    self.stage_busy[message[1]][0] += message[2]
+                    stats_received += 1
+        finally:
+            self.elapsed = time.monotonic() - started
+            for process in processes:
+                process.join(1)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+            ring.close(unlink=True)
+
+    def utilization_summary(self) -> str:
+        """直前の run() の段ごとの稼働率（稼働時間 / (経過時間 × プロセス数)）を表す1行"""
+        if self.elapsed <= 0:
+            return "パイプライン稼働率: -"
+        parts = []
+        for stage, label in (('reader', '読み込み'), ('analyzer', '解析')):
+            busy, count = self.stage_busy.get(stage, (0.0, 0))
+            if count:
+                parts.append(f"{label} {count}プロセス {busy / (self.elapsed * count):.0%}")
+        return f"パイプライン稼働率: {', '.join(parts)}（経過 {self.elapsed:.1f}秒）"
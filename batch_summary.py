@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+一括チェックの集計ブック（--summary）
+報告書1件を1行（重要度ごとの件数・文章項目ごとの文字数・テストスコア）として、
+クラス（報告書のあるフォルダ / zip内のフォルダ）ごとのシートに書き出します。
+
+openpyxl の書き込み専用モードを使い、各行はファイルのチェックが終わった時点で
+シートの一時ファイルに書き出すため、件数が多くてもメモリ使用量は増えません。
+行の順序はチェックの完了順です（オートフィルタで並べ替えられます）。
+報告書間の類似文章の警告は全件のチェック後に追加されるため、件数に含まれません。
+"""
+
+import os
+import re
+
+from excel_validator_cli import SCORE_CELLS, SEVERITY_RANK, TEXT_SECTIONS
+
+HEADERS = (['ファイル', '状態'] + list(SEVERITY_RANK)[::-1]
+           + [f"{name}（文字数）" for name in TEXT_SECTIONS] + list(SCORE_CELLS))
+COLUMN_WIDTHS = {'A': 48, 'B': 12}
+DEFAULT_CLASS = 'その他'
+# シート名に使えない文字と長さの上限（Excel の制約）
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+MAX_SHEET_NAME = 31
+
+
+def report_summary(snapshot) -> dict:
+    """集計ブックの1行分の値（チェック結果の件数以外）をスナップショットから取り出す"""
+    lengths = {}
+    for name, (row, col, _, _) in TEXT_SECTIONS.items():
+        content = snapshot.cell(row=row, column=col).value
+        lengths[name] = len(str(content)) if content else 0
+    scores = {}
+    for label, (row, col) in SCORE_CELLS.items():
+        value = snapshot.cell(row=row, column=col).value
+        # 数値・文字列以外（日付等）は文字列にして、ジャーナルやプロセス間で受け渡せるようにする
+        scores[label] = value if value is None or isinstance(value, (int, float, str)) else str(value)
+    return {'lengths': lengths, 'scores': scores}
+
+
+def class_name(key: str) -> str:
+    """報告書のキーからクラス名（報告書のあるフォルダ名、zip直下ならzipの名前）を返す"""
+    path, _, member = key.partition('!')
+    if member:
+        folder = member.replace('\\', '/').rpartition('/')[0].rpartition('/')[2]
+        return folder or os.path.splitext(os.path.basename(path))[0] or DEFAULT_CLASS
+    return os.path.basename(os.path.dirname(os.path.abspath(path))) or DEFAULT_CLASS
+
+
+class SummaryWorkbook:
+    """一括チェックのエントリを1行ずつ書き出す集計ブック"""
+
+    def __init__(self, path: str):
+        import openpyxl
+        self.path = path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheets = {}
+        self.row_counts = {}
+        self.sheet_names = set()
+
+    def sheet_for(self, name: str):
+        if name not in self.sheets:
+            from openpyxl.cell import WriteOnlyCell
+            from openpyxl.styles import Font
+
+            title = INVALID_SHEET_CHARS.sub('_', name)[:MAX_SHEET_NAME] or DEFAULT_CLASS
+            number = 2
+            while title in self.sheet_names:
+                suffix = f"({number})"
+                title = title[:MAX_SHEET_NAME - len(suffix)] + suffix
+                number += 1
+            self.sheet_names.add(title)
+
+            sheet = self.workbook.create_sheet(title)
+            for column, width in COLUMN_WIDTHS.items():
+                sheet.column_dimensions[column].width = width
+            sheet.freeze_panes = 'C2'
+            header = []
+            for text in HEADERS:
+                cell = WriteOnlyCell(sheet, text)
+                cell.font = Font(bold=True)
+                header.append(cell)
+            sheet.append(header)
+            self.sheets[name] = sheet
+            self.row_counts[name] = 1
+        return self.sheets[name]
+
+    def add(self, entry: dict):
+        """エントリ（BatchValidator.validate_one の戻り値）を1行として書き出す"""
+        from batch import count_by_severity
+
+        counts = count_by_severity(entry['results'])
+        summary = entry.get('summary') or {}
+        if entry['failed']:
+            status = '読み込み失敗'
+        elif counts['エラー']:
+            status = '要修正'
+        elif counts['警告']:
+            status = '要確認'
+        else:
+            status = 'OK'
+        lengths = summary.get('lengths', {})
+        scores = summary.get('scores', {})
+        row = ([entry['file'], status] + [counts[severity] for severity in list(SEVERITY_RANK)[::-1]]
+               + [lengths.get(name) for name in TEXT_SECTIONS] + [scores.get(label) for label in SCORE_CELLS])
+
+        name = class_name(entry['file'])
+        self.sheet_for(name).append(row)
+        self.row_counts[name] += 1
+
+    def close(self):
+        from openpyxl.utils import get_column_letter
+        if not self.sheets:
+            self.sheet_for(DEFAULT_CLASS)
+        last_column = get_column_letter(len(HEADERS))
+        for name, sheet in self.sheets.items():
+            sheet.auto_filter.ref = f"A1:{last_column}{self.row_counts[name]}"
+        self.workbook.save(self.path)
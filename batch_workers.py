@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+一括チェックのワーカープロセス管理
+1ファイルずつ別プロセスのワーカーに渡してチェックし、異常なファイルが他のファイルや
+本体のプロセスを巻き込まないようにします。
+
+- ファイルごとの制限時間: 超えたワーカーは強制終了し、そのファイルはタイムアウトとして報告
+- メモリ上限: ワーカーの仮想メモリを RLIMIT_AS で制限（Unixのみ）
+- ワーカーの入れ替え: 一定数のファイルを処理したワーカーは終了させ、新しいワーカーに
+  入れ替える（メモリリークの蓄積を防ぐ）
+- 異常終了: ワーカーが落ちた場合もそのファイルだけをエラーとして報告し、続行する
+- 稼働率: ワーカーの枠ごとにチェック中の時間を記録し、終了時に集計を表示できる
+"""
+
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+import metrics
+from batch import error_entry
+
+
+def apply_memory_limit(memory_mb):
+    if not memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Windows では RLIMIT_AS を使えないため、制限時間のみで保護する
+        return
+    limit = int(memory_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def worker_main(conn, settings: dict, memory_mb, max_tasks: int):
+    """
+    ワーカープロセスの本体。ReportSource を受け取ってエントリを返すことを繰り返し、
+    max_tasks 件処理するか、メモリ不足になった時点で終了する。
+    送信するのは (エントリ, このワーカーが終了するか) の組。
+    """
+    apply_memory_limit(memory_mb)
+
+    from excel_validator_cli import StudentReportValidatorCLI
+    from batch import BatchValidator
+
+    batch = BatchValidator(StudentReportValidatorCLI(verbose=False), **settings)
+    try:
+        for done in range(1, max_tasks + 1):
+            try:
+                source = conn.recv()
+            except EOFError:
+                return
+            if source is None:
+                return
+            try:
+                entry = batch.validate_one(source)
+                exiting = done == max_tasks
+            except MemoryError:
+                entry = error_entry(source.key, 'メモリ不足',
+                                    f"メモリ上限（{memory_mb}MB）を超えたためチェックを中止しました")
+                exiting = True
+            conn.send((entry, exiting))
+            if exiting:
+                return
+    finally:
+        batch.archives.close()
+        conn.close()
+
+
+class Worker:
+    def __init__(self, context, settings, memory_mb, max_tasks):
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main,
+                                       args=(child_conn, settings, memory_mb, max_tasks),
+                                       daemon=True)
+        self.process.start()
+        # 子プロセス側の端を閉じておくと、ワーカーが落ちた時に recv() が EOFError になる
+        child_conn.close()
+        self.conn = parent_conn
+        self.task = None
+        self.deadline = None
+        self.started = None
+
+    def assign(self, index, source, timeout):
+        self.task = (index, source)
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.conn.send(source)
+
+    def stop(self, force=False):
+        if force:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class IsolatedWorkerPool:
+    def __init__(self, settings: dict, workers=1, timeout=None, memory_mb=None, max_tasks=100):
+        """
+        settings:  BatchValidator.worker_settings() の戻り値
+        workers:   ワーカープロセス数
+        timeout:   1ファイルあたりの制限時間（秒）。None なら無制限
+        memory_mb: ワーカーの仮想メモリ上限（MB）。None なら無制限
+        max_tasks: 1つのワーカーがこの件数を処理したら新しいワーカーに入れ替える
+        """
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.max_tasks = max(1, max_tasks)
+        self.context = multiprocessing.get_context()
+        self.restarts = 0
+        # 直前の run() での枠ごとのチェック中の時間（秒）と経過時間
+        self.busy_seconds = []
+        self.elapsed = 0.0
+
+    def spawn(self):
+        return Worker(self.context, self.settings, self.memory_mb, self.max_tasks)
+
+    def run(self, tasks):
+        """
+        tasks: [(番号, ReportSource), ...]。リストのほか、ジェネレータも渡せる。
+               ジェネレータの場合は枠が空いた時に次のタスクを1件ずつ取り出す
+               （分散一括チェックのワーカーがリースしたタスクを順に渡す場合等）。
+        完了したものから (番号, エントリ) を返す。
+        """
+        slots = min(self.workers, len(tasks)) if hasattr(tasks, '__len__') else self.workers
+        tasks = iter(tasks)
+        exhausted = False
+        # 入れ替えや強制終了で空いた枠は None にしておき、残りのファイルがある場合だけ起動する
+        workers = [None] * slots
+        self.busy_seconds = [0.0] * len(workers)
+        started = time.monotonic()
+        try:
+            while True:
+                for position, worker in enumerate(workers):
+                    if exhausted:
+                        break
+                    if worker is None or worker.task is None:
+                        task = next(tasks, None)
+                        if task is None:
+                            exhausted = True
+                            break
+                        if worker is None:
+                            worker = workers[position] = self.spawn()
+                        index, source = task
+                        try:
+                            worker.assign(index, source, self.timeout)
+                        except OSError:
+                            # 待機中に終了していたワーカーには送れない（BrokenPipeError 等）
+                            worker.stop(force=True)
+                            workers[position] = None
+                            self.restarts += 1
+                            metrics.inc('check_excel_worker_restarts_total', reason='crash')
+                            yield index, error_entry(source.key, 'ワーカー異常終了',
+                                                     "ワーカープロセスが異常終了していたためチェックできませんでした")
+
+                busy = [worker for worker in workers if worker is not None and worker.task is not None]
+                if not busy:
+                    if exhausted:
+                        break
+                    # 渡せなかったファイルの分の枠が空いている
+                    continue
+
+                deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+                wait_time = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+                ready = wait([worker.conn for worker in busy], wait_time)
+
+                for position, worker in enumerate(workers):
+                    if worker is None or worker.task is None:
+                        continue
+                    index, source = worker.task
+                    now = time.monotonic()
+                    if worker.conn in ready:
+                        try:
+                            entry, exiting = worker.conn.recv()
+                            reason = 'recycle'
+                            if entry['failed'] and entry['results'][0]['type'] == 'メモリ不足':
+                                reason = 'memory'
+                        except (EOFError, OSError):
+                            entry = error_entry(source.key, 'ワーカー異常終了',
+                                                "チェック中にワーカープロセスが異常終了しました")
+                            exiting = True
+                            reason = 'crash'
+                        worker.task = None
+                        self.busy_seconds[position] += now - worker.started
+                        metrics.observe('check_excel_file_seconds', now - worker.started)
+                        if exiting:
+                            worker.stop()
+                            workers[position] = None
+                            self.restarts += 1
+                            metrics.inc('check_excel_worker_restarts_total', reason=reason)
+                        yield index, entry
+                    elif worker.deadline is not None and now >= worker.deadline:
+                        self.busy_seconds[position] += now - worker.started
+                        worker.stop(force=True)
+                        workers[position] = None
+                        self.restarts += 1
+                        metrics.inc('check_excel_worker_restarts_total', reason='timeout')
+                        yield index, error_entry(source.key, 'タイムアウト',
+                                                 f"制限時間（{self.timeout}秒）内にチェックが終わりませんでした")
+        finally:
+            self.elapsed = time.monotonic() - started
+            for worker in workers:
+                if worker is not None:
+                    worker.stop(force=worker.task is not None)
+
+    def utilization_summary(self) -> str:
+        """直前の run() のワーカー稼働率（チェック中の時間 / 経過時間）を表す1行"""
+        if not self.busy_seconds or self.elapsed <= 0:
+            return "ワーカー稼働率: -"
+        rates = [busy / self.elapsed for busy in self.busy_seconds]
+        overall = sum(self.busy_seconds) / (self.elapsed * len(self.busy_seconds))
+        detail = ', '.join(f"{rate:.0%}" for rate in rates)
+        return (f"ワーカー稼働率: {overall:.0%}（{len(rates)}ワーカー: {detail} / "
+                f"経過 {self.elapsed:.1f}秒, 入れ替え {self.restarts}回）")
@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能ベンチマークスクリプト
+CLIの起動時間などを計測し、予算（ミリ秒）を超えた場合は終了コード1を返します。
+
+使い方:
+  python3 benchmark.py startup
+  python3 benchmark.py startup --help-budget 60 --report-budget 250
+  python3 benchmark.py server
+  python3 benchmark.py gate
+  python3 benchmark.py duplicates --texts 50000
+  python3 benchmark.py schedule --workers 4
+  python3 benchmark.py annotate --rows 5000
+  python3 benchmark.py fix --files 200
+  python3 benchmark.py summary --rows 100000
+  python3 benchmark.py typo-index --words 100000
+  python3 benchmark.py phrase-model --chars 200
+  python3 benchmark.py soak --files 10000
+  python3 benchmark.py metrics
+  python3 benchmark.py diff --findings 1000000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(HERE, 'excel_validator_cli.py')
+
+TEXT_CELLS = [(17, 2), (17, 10), (27, 2), (27, 10), (37, 2), (37, 10), (47, 2), (50, 2)]
+
+
+def make_sample_report(path, text=None, bad_scores=False):
+    """チェッカーのセル配置に合わせた小さな報告書を作成する"""
+    import openpyxl
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.title = '2023夏期'
+    for col in range(3, 8):
+        sheet.cell(row=10, column=col, value=80)
+        sheet.cell(row=12, column=col, value=170 + col if bad_scores else 70 + col)
+        sheet.cell(row=14, column=col, value=60)
+    sheet.cell(row=10, column=8, value=400)
+    sheet.cell(row=12, column=8, value=sum(70 + col for col in range(3, 8)))
+    sheet.cell(row=12, column=9, value=5)
+    sheet.cell(row=14, column=8, value=300)
+    if text is None:
+        text = ('数学の関数が苦手で理解が不足している課題があります。'
+                '一次関数のグラフの問題で困難があり、改善のため毎週20問の演習を行います。') * 2
+    for row, col in TEXT_CELLS:
+        sheet.cell(row=row, column=col, value=text)
+    wb.save(path)
+
+
+def cold_start_ms(args, repeat):
+    """新しいインタプリタでコマンドを実行し、最速の実行時間(ms)を返す"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_startup(args):
+    # インタプリタ自体の起動時間を差し引き、CLIが追加するコストを予算と比較する
+    baseline = cold_start_ms(['-c', 'pass'], args.repeat)
+    print(f"インタプリタ起動: {baseline:.1f} ms")
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'report.xlsx')
+        make_sample_report(report)
+        cases = [
+            ('--help', [CLI, '--help'], args.help_budget),
+            ('小さな報告書1件', [CLI, report], args.report_budget),
+        ]
+        for label, cmd, budget in cases:
+            total = cold_start_ms(cmd, args.repeat)
+            overhead = total - baseline
+            status = 'OK' if overhead <= budget else 'NG'
+            failed = failed or status == 'NG'
+            print(f"{label}: {total:.1f} ms（起動差分 {overhead:.1f} ms / 予算 {budget} ms）{status}")
+
+    return 1 if failed else 0
+
+
+def bench_server(args):
+    # 常駐サーバー経由と単独実行で、報告書1件あたりの所要時間を比較する
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'report.xlsx')
+        socket_path = os.path.join(tmp, 'bench.sock')
+        make_sample_report(report)
+
+        standalone = cold_start_ms([CLI, report], args.repeat)
+        server = subprocess.Popen([sys.executable, CLI, 'serve', '--socket', socket_path],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 10
+            while not os.path.exists(socket_path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            via_server = cold_start_ms([CLI, report, '--socket', socket_path], args.repeat)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"単独実行: {standalone:.1f} ms")
+    print(f"常駐サーバー経由: {via_server:.1f} ms（{standalone / via_server:.1f}倍）")
+    return 0
+
+
+def files_per_second(func, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def bench_gate(args):
+    # エラーのある報告書について、全チェックと --fail-fast の処理件数/秒を比較する
+    sys.path.insert(0, HERE)
+    from excel_validator_cli import StudentReportValidatorCLI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'bad.xlsx')
+        make_sample_report(report, text='とゆうことで特になし', bad_scores=True)
+        validator = StudentReportValidatorCLI(verbose=False)
+
+        full = files_per_second(lambda: validator.run_checks(report), args.seconds)
+        gate = files_per_second(
+            lambda: validator.run_checks(report, min_severity='エラー', fail_fast=True),
+            args.seconds)
+
+    print(f"全チェック: {full:.1f} 件/秒")
+    print(f"--fail-fast --min-severity エラー: {gate:.1f} 件/秒（{gate / full:.1f}倍）")
+    return 0
+
+
+def bench_duplicates(args):
+    # 定型句を組み合わせた文章と、その一部を改変したコピーで類似文章検出の所要時間を計測する
+    import random
+    sys.path.insert(0, HERE)
+    from near_duplicates import NearDuplicateIndex
+
+    phrases = ['数学の関数が苦手です', '英語の長文読解に課題があります', '宿題の提出は期限どおりです',
+               '毎週20問の演習を行います', '授業中の集中力が向上しました', '家庭学習の時間を確保しましょう',
+               '理科の計算問題で失点が目立ちます', '前回より平均点が10点上がりました', '復習の習慣をつけましょう',
+               '社会の暗記事項を整理します', '国語の記述問題に取り組みます', '積極的に質問できています']
+    rng = random.Random(0)
+    texts = []
+    for i in range(args.texts):
+        if texts and rng.random() < 0.05:
+            base = rng.choice(texts)
+            texts.append(base[:-3] + rng.choice(phrases)[:3])
+        else:
+            texts.append('。'.join(rng.choice(phrases) for _ in range(8)) + f"。生徒番号{i}。")
+
+    start = time.perf_counter()
+    index = NearDuplicateIndex()
+    for i, text in enumerate(texts):
+        index.add((f"report{i // 8}.xlsx", i % 8), text)
+    clusters = index.clusters()
+    elapsed = time.perf_counter() - start
+
+    print(f"文章数: {len(texts)}件 / 類似グループ: {len(clusters)}件 / 所要時間: {elapsed:.1f} 秒")
+    return 1 if elapsed > args.budget else 0
+
+
+def make_large_report(path, rows):
+    """チェック対象のセルの後ろに大量の行を持つ報告書（処理時間の長いファイル）を作成する"""
+    import openpyxl
+    make_sample_report(path)
+    wb = openpyxl.load_workbook(path)
+    sheet = wb.active
+    for row in range(60, 60 + rows):
+        sheet.cell(row=row, column=2, value=f'備考{row}：授業の振り返りと次回の課題を記録します')
+        sheet.cell(row=row, column=3, value=row)
+    wb.save(path)
+
+
+def bench_schedule(args):
+    # 名前順で最後に来る大きなファイルを含むフォルダで、指定順とコスト順の所要時間を比較する
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'reports')
+        os.mkdir(folder)
+        for i in range(args.small):
+            make_sample_report(os.path.join(folder, f'a{i:03d}.xlsx'))
+        for i in range(args.large):
+            make_large_report(os.path.join(folder, f'z{i:03d}.xlsx'), args.rows)
+
+        timings = {}
+        for schedule in ('input', 'cost'):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, CLI, folder, '--workers', str(args.workers),
+                            '--schedule', schedule], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
+            timings[schedule] = time.perf_counter() - start
+
+    print(f"ファイル数: 小 {args.small}件 + 大 {args.large}件 / ワーカー {args.workers}")
+    print(f"指定順（input）: {timings['input']:.1f} 秒")
+    print(f"コスト順（cost）: {timings['cost']:.1f} 秒（{timings['input'] / timings['cost']:.2f}倍）")
+    return 0
+
+
+def bench_annotate(args):
+    # 同じ指摘を、zipの部分的な書き換えと openpyxl での読み込み・保存で書き込む時間を比較する
+    sys.path.insert(0, HERE)
+    import openpyxl
+    from openpyxl.comments import Comment
+    from openpyxl.styles import PatternFill
+    from excel_validator_cli import StudentReportValidatorCLI
+    from annotate import annotate_report, group_findings, comment_text
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'report.xlsx')
+        if args.rows:
+            make_large_report(report, args.rows)
+        else:
+            make_sample_report(report)
+        wb = openpyxl.load_workbook(report)
+        for row, col in TEXT_CELLS[::2]:
+            wb.active.cell(row=row, column=col, value='とゆうことで特になし')
+        wb.save(report)
+
+        validator = StudentReportValidatorCLI(verbose=False)
+        results = validator.run_checks(report)
+        output = os.path.join(tmp, 'annotated.xlsx')
+
+        def with_openpyxl():
+            wb = openpyxl.load_workbook(report)
+            fill = PatternFill('solid', fgColor='FFFFEB9C')
+            for (row, col), findings in group_findings(results).items():
+                cell = wb.active.cell(row=row, column=col)
+                cell.fill = fill
+                cell.comment = Comment(comment_text(findings), '報告書チェッカー')
+            wb.save(output)
+
+        patched = files_per_second(lambda: annotate_report(report, output, results), args.seconds)
+        full = files_per_second(with_openpyxl, args.seconds)
+
+    print(f"指摘: {len(results)}件 / 行数: {args.rows + 60}")
+    print(f"openpyxl で読み込み・保存: {1000 / full:.1f} ms")
+    print(f"zipの部分書き換え: {1000 / patched:.1f} ms（{patched / full:.1f}倍）")
+    return 0
+
+
+def bench_fix(args):
+    # 半数に誤字を含む報告書のフォルダについて、--fix の所要時間をzipのコピー
+    # （zipfile で全メンバーを読み出して書き直す）と比較する
+    import shutil
+    import zipfile
+    sys.path.insert(0, HERE)
+    from typo_fix import fix_report
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source')
+        os.mkdir(source)
+        clean = os.path.join(source, 'clean.xlsx')
+        typo = os.path.join(source, 'typo.xlsx')
+        make_large_report(clean, args.rows)
+        make_large_report(typo, args.rows)
+        import openpyxl
+        wb = openpyxl.load_workbook(typo)
+        for row, col in TEXT_CELLS:
+            wb.active.cell(row=row, column=col, value='そうゆう理由で、とゆうことです。' * 10)
+        wb.save(typo)
+
+        folder = os.path.join(tmp, 'reports')
+        os.mkdir(folder)
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(folder, f'{i:04d}.xlsx')
+            shutil.copyfile(typo if i % 2 else clean, path)
+            paths.append(path)
+
+        start = time.perf_counter()
+        for path in paths:
+            with zipfile.ZipFile(path) as archive, \
+                    zipfile.ZipFile(path + '.copy', 'w', zipfile.ZIP_DEFLATED) as copy:
+                for info in archive.infolist():
+                    copy.writestr(info, archive.read(info))
+        copy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fixed = sum(len(fix_report(path)) for path in paths)
+        fix_seconds = time.perf_counter() - start
+
+    print(f"ファイル数: {args.files}（うち誤字あり {args.files // 2}）/ 修正: {fixed}箇所")
+    print(f"zipのコピー: {copy_seconds * 1000 / args.files:.2f} ms/件")
+    print(f"--fix: {fix_seconds * 1000 / args.files:.2f} ms/件（コピーの {fix_seconds / copy_seconds:.1f}倍）")
+    return 0
+
+
+def bench_summary(args):
+    # 集計ブックに大量の行を書き出し、所要時間と最大常駐メモリ（RSS）の増加量を計測する
+    # （tracemalloc は書き出しが大幅に遅くなるため使わない。Unixのみ）
+    import resource
+    sys.path.insert(0, HERE)
+    from batch_summary import SummaryWorkbook
+    from excel_validator_cli import SCORE_CELLS, TEXT_SECTIONS
+
+    result = {'item': '誤字脱字 - セル(17, 2)', 'type': '誤字の可能性', 'severity': '警告', 'detail': '-'}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'summary.xlsx')
+        summary = SummaryWorkbook(path)
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        for i in range(args.rows):
+            summary.add({
+                'file': f"{tmp}/{i % args.classes}組/生徒{i:06d}.xlsx", 'failed': False,
+                'results': [result] * (i % 4),
+                'summary': {'lengths': {name: 100 + i % 50 for name in TEXT_SECTIONS},
+                            'scores': {label: 60 + i % 40 for label in SCORE_CELLS}},
+            })
+        summary.close()
+        elapsed = time.perf_counter() - start
+        # ru_maxrss は Linux では KB 単位
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) * 1024
+        size = os.path.getsize(path)
+
+    print(f"行数: {args.rows} / クラス: {args.classes} / ファイルサイズ: {size / 1024 / 1024:.1f}MB")
+    print(f"所要時間: {elapsed:.1f} 秒（{args.rows / elapsed:.0f} 行/秒）")
+    print(f"最大常駐メモリの増加量: {peak / 1024 / 1024:.1f}MB")
+    return 1 if peak > args.memory_budget * 1024 * 1024 else 0
+
+
+def bench_typo_index(args):
+    # 合成した語彙で索引を作り、読み込み時間と1語あたりの検索時間（語彙にある語 / 誤字）を計測する
+    import random
+    sys.path.insert(0, HERE)
+    from typo_index import TypoIndex, write_index
+
+    rng = random.Random(0)
+    letters = [chr(code) for code in range(ord('ァ'), ord('ヺ'))] + ['ー']
+    counts = {}
+    while len(counts) < args.words:
+        word = ''.join(rng.choice(letters) for _ in range(rng.randint(4, 12)))
+        counts[word] = rng.randint(2, 1000)
+    words = list(counts)
+    known = [rng.choice(words) for _ in range(args.lookups)]
+    typos = []
+    for word in known:
+        i = rng.randrange(len(word))
+        typos.append(word[:i] + rng.choice(letters) + word[i + 1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'vocabulary.idx')
+        start = time.perf_counter()
+        write_index(path, counts)
+        build = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        index = TypoIndex(path)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        timings = {}
+        for label, queries in (('語彙にある語', known), ('誤字', typos)):
+            index.cache.clear()
+            start = time.perf_counter()
+            for word in queries:
+                index.suggest(word)
+            timings[label] = (time.perf_counter() - start) / len(queries) * 1e6
+        found = sum(1 for word, typo in zip(known, typos)
+                    if any(candidate == word for candidate, _, _ in index.suggest(typo)))
+        del index
+
+    print(f"語彙: {args.words}語 / 索引: {size / 1024 / 1024:.1f}MB（作成 {build:.1f} 秒）")
+    print(f"読み込み: {load_ms:.2f}ms")
+    for label, microseconds in timings.items():
+        print(f"検索（{label}）: {microseconds:.1f}µs/語")
+    print(f"誤字の候補に元の語が含まれた割合: {found / len(typos):.1%}")
+    return 1 if load_ms > args.load_budget or timings['誤字'] > args.lookup_budget else 0
+
+
+def bench_phrase_model(args):
+    # 合成した文章で文章モデルを作り、報告書1件分（文章項目8つ）の判定時間を計測する
+    import random
+    sys.path.insert(0, HERE)
+    from collections import Counter
+    from phrase_model import DEFAULT_BITS, DEFAULT_ORDER, PhraseModel, build_table, count_ngrams
+
+    rng = random.Random(0)
+    words = ['定期テスト', 'に向けて', '計画的に', '学習を', '進めて', 'います', '英語の', '長文読解', 'では',
+             '課題に', '合わせて', '指導して', '数学の', '計算ミスが', '減って', 'きており', '宿題は',
+             '毎回', 'きちんと', '提出', 'できて', '授業中の', '集中力が', '高く', '質問も', '積極的に',
+             '復習を', '習慣に', 'しましょう', '苦手単元', 'の', 'を', 'が', 'と', '、']
+
+    def text(chars):
+        parts = []
+        while sum(map(len, parts)) < chars:
+            parts.append(''.join(rng.choice(words) for _ in range(rng.randint(4, 10))) + '。')
+        return ''.join(parts)[:chars]
+
+    counter = Counter()
+    for _ in range(args.corpus):
+        count_ngrams(counter, text(args.chars), DEFAULT_ORDER)
+    total = sum(count for ngram, count in counter.items() if len(ngram) == 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'phrases.model')
+        PhraseModel(build_table(counter, DEFAULT_BITS), DEFAULT_ORDER, DEFAULT_BITS, total, 12.0).save(path)
+        start = time.perf_counter()
+        model = PhraseModel.load(path)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        reports = [[text(args.chars) for _ in TEXT_CELLS] for _ in range(args.reports)]
+        start = time.perf_counter()
+        for texts in reports:
+            for content in texts:
+                model.check_text(content)
+        per_report = (time.perf_counter() - start) / len(reports) * 1000
+        del model
+
+    print(f"学習: {args.corpus}文章 / 回数表: {1 << DEFAULT_BITS >> 20}MB / 読み込み: {load_ms:.2f}ms")
+    print(f"判定: {per_report:.2f}ms/件（文章項目 {len(TEXT_CELLS)}つ × {args.chars}文字）"
+          f" 予算 {args.budget:.0f}ms {'OK' if per_report <= args.budget else '超過'}")
+    return 0 if per_report <= args.budget else 1
+
+
+def bench_soak(args):
+    # 常駐サーバーと同じく1つのプロセスで同じ報告書を繰り返しチェックし、ウォームアップ後の
+    # 割り当て中のメモリ（tracemalloc）と常駐メモリ（RSS）の増加量が予算内かを確認する
+    import tracemalloc
+    sys.path.insert(0, HERE)
+    from excel_validator_cli import StudentReportValidatorCLI
+    from memory_trace import MemoryTrace, current_rss, format_bytes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'report.xlsx')
+        # 各チェックが結果を出すよう、スコアの誤りと誤字を含む報告書にする
+        make_sample_report(report, text='とゆうことで宿題は特になし。' * 4, bad_scores=True)
+        trace = MemoryTrace()
+        warm_traced = warm_rss = None
+        start = time.perf_counter()
+        for i in range(args.files):
+            if i == args.warmup:
+                warm_traced = tracemalloc.get_traced_memory()[0]
+                warm_rss = current_rss()
+            validator = StudentReportValidatorCLI(verbose=False)
+            with trace.track(report):
+                validator.run_checks(report, reader=args.reader)
+        elapsed = time.perf_counter() - start
+        traced_growth = tracemalloc.get_traced_memory()[0] - warm_traced
+        rss = current_rss()
+        rss_growth = rss - warm_rss if rss is not None and warm_rss is not None else None
+        trace.report(sys.stdout)
+        trace.close()
+
+    measured = args.files - args.warmup
+    print(f"チェック回数: {args.files}（ウォームアップ {args.warmup}）/ 所要時間: {elapsed:.1f} 秒"
+          f"（{args.files / elapsed:.0f} 件/秒、tracemalloc 有効）")
+    failed = traced_growth > args.memory_budget * 1024 * 1024
+    print(f"ウォームアップ後 {measured}回の割り当ての増加: {format_bytes(traced_growth)}"
+          f"（予算 {args.memory_budget:g}MB）{'NG' if failed else 'OK'}")
+    if rss_growth is not None:
+        rss_failed = rss_growth > args.rss_budget * 1024 * 1024
+        print(f"ウォームアップ後 {measured}回の常駐メモリの増加: {format_bytes(rss_growth)}"
+              f"（予算 {args.rss_budget:g}MB）{'NG' if rss_failed else 'OK'}")
+        failed = failed or rss_failed
+    return 1 if failed else 0
+
+
+def bench_metrics(args):
+    # メトリクスの集計にかかる時間が、1ファイルのチェック時間の予算（%）内かを確認する。
+    # 有効/無効の所要時間の差は1%より計測の揺らぎのほうが大きいため参考として表示し、
+    # 判定には1ファイル分の集計の呼び出しを記録して繰り返し再生した時間を使う
+    sys.path.insert(0, HERE)
+    import metrics
+    from excel_validator_cli import StudentReportValidatorCLI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, 'report.xlsx')
+        # 指摘件数の集計も計測に含まれるよう、スコアの誤りと誤字を含む報告書にする
+        make_sample_report(report, text='とゆうことで宿題は特になし。' * 4, bad_scores=True)
+        validator = StudentReportValidatorCLI(verbose=False)
+
+        def per_file(enabled):
+            metrics.enabled = enabled
+            start = time.perf_counter()
+            for _ in range(args.files):
+                validator.run_checks(report)
+            return (time.perf_counter() - start) / args.files
+
+        per_file(True)
+        disabled, enabled = [], []
+        for _ in range(args.rounds):
+            disabled.append(per_file(False))
+            enabled.append(per_file(True))
+
+        # 1ファイル分の集計の呼び出しを記録する（記録中は集計しない）
+        calls = []
+        api = ('inc', 'set_gauge', 'observe', 'timed', 'stage', 'record_results', 'record_entry')
+        originals = {name: getattr(metrics, name) for name in api}
+
+        def recorder(name):
+            def record(*a, **k):
+                calls.append((name, a, k))
+                return NullTimer()
+            return record
+
+        class NullTimer:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+        for name in api:
+            setattr(metrics, name, recorder(name))
+        try:
+            validator.run_checks(report)
+        finally:
+            for name, func in originals.items():
+                setattr(metrics, name, func)
+
+    # 記録した呼び出しを有効な状態で再生する（rounds 回に分け、最速値を採用）
+    replay = [(name in ('timed', 'stage'), originals[name], a, k) for name, a, k in calls]
+    replays = max(1, args.replays // args.rounds)
+    timings = []
+    metrics.enabled = True
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        for _ in range(replays):
+            for is_timer, func, a, k in replay:
+                if is_timer:
+                    with func(*a, **k):
+                        pass
+                else:
+                    func(*a, **k)
+        timings.append((time.perf_counter() - start) / replays)
+    metrics.enabled = False
+    instrumentation = min(timings)
+
+    base = min(disabled)
+    overhead = instrumentation / base * 100
+    print(f"1ファイルのチェック: {base * 1000:.2f} ms（集計の呼び出し {len(calls)}回）")
+    print(f"集計の所要時間: {instrumentation * 1e6:.1f} µs/ファイル = {overhead:.3f}%"
+          f"（予算 {args.budget:g}%）{'OK' if overhead <= args.budget else 'NG'}")
+    print(f"参考: 有効 {min(enabled) * 1000:.2f} ms / 無効 {base * 1000:.2f} ms"
+          f"（差 {(min(enabled) / base - 1) * 100:+.2f}%、{args.rounds}回の最速値）")
+    return 0 if overhead <= args.budget else 1
+
+
+def bench_diff(args):
+    # 2回分の一括チェックのジャーナルを合成し、diff の所要時間と最大常駐メモリを計測する
+    # （前回の一部の指摘を解消し、新しい指摘を加え、詳細の数字だけを変えた指摘も混ぜる。Unixのみ）
+    import json
+    import random
+    import resource
+
+    rng = random.Random(0)
+    per_file = 20
+    templates = [
+        ('誤字脱字', '誤字の可能性', '警告', "'とゆう' → 'という' の可能性があります"),
+        ('文章内容', '文字数不足', '警告', '現在の学習課題の文字数が少なすぎます（{}文字、推奨: 100文字以上）'),
+        ('テストスコア', '合計不一致', 'エラー', '科目の合計({})と記載された合計(607)が一致しません'),
+        ('内容確認', '不適切な表現', '警告', '「{}」回の遅刻について記載があります'),
+    ]
+    expected = {'解消': 0, '新規': 0, '継続': 0}
+
+    def finding(file, number, value):
+        check, kind, severity, detail = templates[number % len(templates)]
+        return {'file': file, 'item': f"{check} - セル({10 + number}, 2)", 'type': kind, 'severity': severity,
+                'detail': detail.format(value)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path, new_path = os.path.join(tmp, 'old.ndjson'), os.path.join(tmp, 'new.ndjson')
+        with open(old_path, 'w', encoding='utf-8') as old, open(new_path, 'w', encoding='utf-8') as new:
+            for f in (old, new):
+                f.write(json.dumps({'journal': 1, 'settings': {}}) + '\n')
+            for index in range(args.findings // per_file):
+                file = f"報告書/{index % 40}組/生徒{index:06d}.xlsx"
+                before, after = [], []
+                for number in range(per_file):
+                    before.append(finding(file, number, rng.randint(1, 99)))
+                    roll = rng.random()
+                    if roll < 0.05:
+                        expected['解消'] += 1
+                    else:
+                        # 詳細の数字だけが変わった指摘は継続とみなされる
+                        after.append(finding(file, number, rng.randint(1, 99)) if roll < 0.15 else before[-1])
+                        expected['継続'] += 1
+                    if roll > 0.95:
+                        after.append(finding(file, number + per_file, 0))
+                        expected['新規'] += 1
+                for f, results in ((old, before), (new, after)):
+                    f.write(json.dumps({'file': file, 'failed': False, 'results': results},
+                                       ensure_ascii=False) + '\n')
+        size = os.path.getsize(old_path) + os.path.getsize(new_path)
+
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, CLI, 'diff', old_path, new_path, '--counts'],
+                                   capture_output=True, text=True, encoding='utf-8')
+        elapsed = time.perf_counter() - start
+        # ru_maxrss は Linux では KB 単位
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    summary = completed.stdout.strip().splitlines()[-2:-1]
+    want = f"解消: {expected['解消']}件 / 新規: {expected['新規']}件 / 継続: {expected['継続']}件"
+    correct = summary == [want]
+    print(f"指摘: {args.findings}件 × 2 / 入力: {size / 1024 / 1024:.0f}MB")
+    print(f"所要時間: {elapsed:.1f} 秒（予算 {args.budget:g} 秒） / 最大常駐メモリ: {peak / 1024 / 1024:.0f}MB"
+          f"（予算 {args.memory_budget:g}MB）")
+    print(f"照合結果: {(summary or ['-'])[0]}（{'OK' if correct else '期待値: ' + want}）")
+    if not correct or elapsed > args.budget or peak > args.memory_budget * 1024 * 1024:
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生徒現状報告書チェッカー ベンチマーク')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    startup = subparsers.add_parser('startup', help='CLIのコールドスタート時間を計測')
+    startup.add_argument('--repeat', type=int, default=5, help='計測回数（最速値を採用）')
+    startup.add_argument('--help-budget', type=float, default=60, help='--help の予算(ms)')
+    startup.add_argument('--report-budget', type=float, default=250, help='報告書1件の予算(ms)')
+    startup.set_defaults(func=bench_startup)
+
+    server = subparsers.add_parser('server', help='常駐サーバー経由のチェック時間を計測')
+    server.add_argument('--repeat', type=int, default=5, help='計測回数（最速値を採用）')
+    server.set_defaults(func=bench_server)
+
+    gate = subparsers.add_parser('gate', help='--fail-fast によるアップロード判定の処理件数を計測')
+    gate.add_argument('--seconds', type=float, default=3, help='各モードの計測時間（秒）')
+    gate.set_defaults(func=bench_gate)
+
+    duplicates = subparsers.add_parser('duplicates', help='報告書間の類似文章検出の所要時間を計測')
+    duplicates.add_argument('--texts', type=int, default=50000, help='文章セルの数')
+    duplicates.add_argument('--budget', type=float, default=60, help='予算（秒）')
+    duplicates.set_defaults(func=bench_duplicates)
+
+    schedule = subparsers.add_parser('schedule', help='一括チェックの処理順による所要時間の差を計測')
+    schedule.add_argument('--workers', type=int, default=4, help='ワーカー数')
+    schedule.add_argument('--small', type=int, default=40, help='小さな報告書の数')
+    schedule.add_argument('--large', type=int, default=2, help='大きな報告書の数（名前順で最後）')
+    schedule.add_argument('--rows', type=int, default=50000, help='大きな報告書の行数')
+    schedule.set_defaults(func=bench_schedule)
+
+    annotate = subparsers.add_parser('annotate', help='チェック結果の書き込み時間を openpyxl での保存と比較')
+    annotate.add_argument('--rows', type=int, default=5000, help='報告書に追加する行数（0 で最小の報告書）')
+    annotate.add_argument('--seconds', type=float, default=3, help='各方式の計測時間（秒）')
+    annotate.set_defaults(func=bench_annotate)
+
+    fix = subparsers.add_parser('fix', help='--fix の所要時間をzipのコピーと比較')
+    fix.add_argument('--files', type=int, default=200, help='報告書の数')
+    fix.add_argument('--rows', type=int, default=2000, help='報告書に追加する行数')
+    fix.set_defaults(func=bench_fix)
+
+    summary = subparsers.add_parser('summary', help='集計ブックの書き出し時間と最大常駐メモリの増加量を計測')
+    summary.add_argument('--rows', type=int, default=100000, help='行数')
+    summary.add_argument('--classes', type=int, default=20, help='クラス（シート）の数')
+    summary.add_argument('--memory-budget', type=float, default=50, help='最大常駐メモリの増加量の予算(MB)')
+    summary.set_defaults(func=bench_summary)
+
+    typo_index = subparsers.add_parser('typo-index', help='語彙の索引の読み込み時間と検索時間を計測')
+    typo_index.add_argument('--words', type=int, default=100000, help='語彙の語数')
+    typo_index.add_argument('--lookups', type=int, default=2000, help='検索する語の数')
+    typo_index.add_argument('--load-budget', type=float, default=100, help='読み込みの予算(ms)')
+    typo_index.add_argument('--lookup-budget', type=float, default=500, help='誤字1語の検索の予算(µs)')
+    typo_index.set_defaults(func=bench_typo_index)
+
+    phrase_model = subparsers.add_parser('phrase-model', help='文章モデルによる報告書1件の判定時間を計測')
+    phrase_model.add_argument('--chars', type=int, default=200, help='文章項目1つあたりの文字数')
+    phrase_model.add_argument('--corpus', type=int, default=5000, help='学習に使う文章の数')
+    phrase_model.add_argument('--reports', type=int, default=200, help='判定する報告書の数')
+    phrase_model.add_argument('--budget', type=float, default=5, help='報告書1件の予算(ms)')
+    phrase_model.set_defaults(func=bench_phrase_model)
+
+    soak = subparsers.add_parser('soak', help='同じ報告書を繰り返しチェックし、メモリの増加が予算内かを確認')
+    soak.add_argument('--files', type=int, default=10000, help='チェックする回数')
+    soak.add_argument('--warmup', type=int, default=200, help='増加量の計測を始めるまでの回数（キャッシュ等の初期化分）')
+    soak.add_argument('--reader', choices=('openpyxl', 'stream'), help='読み込みバックエンド（既定: openpyxl）')
+    soak.add_argument('--memory-budget', type=float, default=1, help='ウォームアップ後の割り当ての増加量の予算(MB)')
+    soak.add_argument('--rss-budget', type=float, default=8, help='ウォームアップ後の常駐メモリの増加量の予算(MB)')
+    soak.set_defaults(func=bench_soak)
+
+    metrics = subparsers.add_parser('metrics', help='メトリクスの集計による1ファイルあたりの処理時間の増加を計測')
+    metrics.add_argument('--files', type=int, default=50, help='1回の計測でチェックする回数')
+    metrics.add_argument('--rounds', type=int, default=10, help='有効/無効を交互に計測する回数（最速値を採用）')
+    metrics.add_argument('--replays', type=int, default=20000, help='集計の呼び出しを再生する回数')
+    metrics.add_argument('--budget', type=float, default=1, help='1ファイルのチェック時間に対する予算(%%)')
+    metrics.set_defaults(func=bench_metrics)
+
+    diff = subparsers.add_parser('diff', help='2回分のチェック結果の比較（diff）の所要時間と最大常駐メモリを計測')
+    diff.add_argument('--findings', type=int, default=1000000, help='1回分の指摘の件数')
+    diff.add_argument('--budget', type=float, default=20, help='予算（秒）')
+    diff.add_argument('--memory-budget', type=float, default=120, help='最大常駐メモリの予算(MB)')
+    diff.set_defaults(func=bench_diff)
+
+    args = parser.parse_args()
+    if getattr(args, 'warmup', 0) >= getattr(args, 'files', 1):
+        parser.error('--warmup は --files より小さくしてください')
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+チェックの登録
+各チェックは、参照するセル・推定コスト・出しうる最も重い重要度などを CheckSpec として宣言します。
+チェックの実行側（StudentReportValidatorCLI.check_sheet）はこの宣言をもとに、
+
+- コストの安いものから順に実行する
+- しきい値（--min-severity）に満たないチェックや、参照するセルがすべて空のチェックは実行しない
+- 並行実行（-j）時は、CPU負荷の高いチェックをコストが均等になるようにまとめ、
+  まとめたチェックが参照するセルの値だけをワーカーに渡す
+
+学校独自のチェックは、パッケージのエントリポイント（グループ check_excel.checks）で
+本体を変更せずに追加できます。エントリポイントは CheckSpec、CheckSpec のリスト、
+またはそれらを返す関数を指します。
+
+  # 独自チェックのパッケージの pyproject.toml
+  [project.entry-points."check_excel.checks"]
+  attendance = "our_school_checks:ATTENDANCE_CHECK"
+
+  # our_school_checks.py
+  from check_registry import CheckSpec
+
+  def check_attendance(validator, sheet):
+      value = sheet.cell(row=37, column=2).value
+      if value and '欠席' in str(value) and '連絡' not in str(value):
+          validator.add_validation_result("独自 - 出欠", "記載不足", "警告", "欠席時の連絡状況を記載してください")
+
+  ATTENDANCE_CHECK = CheckSpec('attendance', check_attendance, cells=((37, 2),), cost=1,
+                               skip_if_empty=True, message="出欠の記載を確認中...", label="出欠の記載")
+
+  python3 excel_validator_cli.py checks                     # 登録されているチェックの一覧
+  python3 excel_validator_cli.py 報告書.xlsx --skip attendance
+"""
+
+import sys
+from typing import Callable, NamedTuple, Tuple, Union
+
+from excel_validator_cli import REQUIRED_CELLS, SCORE_CELLS, SEVERITY_RANK, TEXT_SECTIONS
+
+ENTRY_POINT_GROUP = 'check_excel.checks'
+
+SCORE_INPUTS = tuple(SCORE_CELLS.values())
+TEXT_INPUTS = tuple((row, col) for row, col, _, _ in TEXT_SECTIONS.values())
+
+
+class CheckSpec(NamedTuple):
+    name: str                      # --skip で指定する名前
+    run: Union[str, Callable]      # StudentReportValidatorCLI のメソッド名、または (validator, sheet) を受け取る関数
+    cells: Tuple = ()              # 参照するセル ((行, 列), ...)
+    cost: float = 1.0              # 推定コスト（相対値）。安いものから実行する
+    max_severity: str = '警告'     # 出しうる最も重い重要度（しきい値に満たなければ実行しない）
+    heavy: bool = False            # CPU負荷が高いか（-j 指定時にプロセスプールで実行する）
+    skip_if_empty: bool = False    # 参照するセルがすべて空なら実行しない
+    message: str = ''              # 実行時の進捗表示
+    label: str = ''                # 一覧・GUI での表示名
+
+
+# 組み込みのチェック。名前は check_sheet の引数 check_<名前> と --no-* オプションに対応する
+BUILTIN_CHECKS = (
+    CheckSpec('scores', 'validate_test_scores', SCORE_INPUTS, cost=1, max_severity='エラー',
+              message="\nテストスコアを検証中...", label="テストスコアの妥当性"),
+    CheckSpec('text_length', 'validate_text_sections', TEXT_INPUTS, cost=1, max_severity='エラー',
+              message="文章の長さを検証中...", label="文章量の適切性"),
+    CheckSpec('spelling', 'check_spelling_errors', TEXT_INPUTS, cost=10, max_severity='警告', heavy=True,
+              skip_if_empty=True, message="誤字脱字をチェック中...", label="誤字脱字チェック"),
+    CheckSpec('content', 'validate_content_appropriateness', TEXT_INPUTS, cost=20, max_severity='警告',
+              heavy=True, skip_if_empty=True, message="内容の適切性を検証中...", label="内容の適切性"),
+)
+BUILTIN_NAMES = tuple(spec.name for spec in BUILTIN_CHECKS)
+
+_plugins = None
+
+
+def entry_points():
+    """
+    グループ check_excel.checks のエントリポイント。importlib.metadata は読み込みに数十ミリ秒かかるため、
+    チェックの一覧が初めて必要になった時に読み込む（Python 3.7 では importlib_metadata があれば使う）。
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            return []
+    points = metadata.entry_points()
+    # Python 3.10 より前は {グループ: [エントリポイント, ...]} を返す
+    if hasattr(points, 'select'):
+        return list(points.select(group=ENTRY_POINT_GROUP))
+    return list(points.get(ENTRY_POINT_GROUP, []))
+
+
+def entry_point_objects():
+    """エントリポイントに登録されたオブジェクトを (エントリポイント名, オブジェクト) で返す"""
+    for point in entry_points():
+        try:
+            obj = point.load()
+        except Exception as e:
+            print(f"警告: チェックを読み込めません: {point.name}: {e}", file=sys.stderr)
+            continue
+        yield point.name, obj
+
+
+def plugin_checks():
+    """エントリポイントで追加されたチェック（プロセス内で1度だけ読み込む）"""
+    global _plugins
+    if _plugins is None:
+        _plugins = []
+        names = set(BUILTIN_NAMES)
+        for point_name, obj in entry_point_objects():
+            if callable(obj) and not isinstance(obj, CheckSpec):
+                obj = obj()
+            for spec in ([obj] if isinstance(obj, CheckSpec) else obj):
+                if not isinstance(spec, CheckSpec) or spec.max_severity not in SEVERITY_RANK:
+                    print(f"警告: チェックの定義が不正です: {point_name}", file=sys.stderr)
+                elif spec.name in names:
+                    print(f"警告: チェック名が重複しています: {spec.name}（{point_name}）", file=sys.stderr)
+                else:
+                    names.add(spec.name)
+                    _plugins.append(spec)
+    return _plugins
+
+
+def all_checks():
+    return BUILTIN_CHECKS + tuple(plugin_checks())
+
+
+def get_check(name: str) -> CheckSpec:
+    for spec in all_checks():
+        if spec.name == name:
+            return spec
+    raise KeyError(name)
+
+
+def plan_checks(disabled=(), min_rank=0):
+    """実行するチェックをコストの安い順に返す（無効なものとしきい値に満たないものを除く）"""
+    checks = [spec for spec in all_checks()
+              if spec.name not in disabled and SEVERITY_RANK[spec.max_severity] >= min_rank]
+    return sorted(checks, key=lambda spec: spec.cost)
+
+
+def required_cells(checks):
+    """チェックが参照するセル（重複を除き、行・列の順）"""
+    return tuple(sorted({cell for spec in checks for cell in spec.cells}))
+
+
+def snapshot_cells():
+    """スナップショットに取り出すセル（組み込みのセルの後ろに、追加したチェックだけが参照するセルを並べる）"""
+    extra = [cell for cell in required_cells(plugin_checks()) if cell not in REQUIRED_CELLS]
+    return REQUIRED_CELLS + tuple(extra)
+
+
+def has_input(spec: CheckSpec, sheet) -> bool:
+    """参照するセルのいずれかに値があるか（skip_if_empty でないチェックは常に True）"""
+    if not spec.skip_if_empty:
+        return True
+    return any(sheet.cell(row=row, column=col).value not in (None, '') for row, col in spec.cells)
+
+
+def batch_checks(checks, workers: int):
+    """
+    チェックを最大 workers 個のまとまりに分ける（コストの大きいものから、合計の最も小さい
+    まとまりに入れる）。各まとまりは1回の受け渡しでワーカーに送る。
+    """
+    batches = [[] for _ in range(min(workers, len(checks)))]
+    totals = [0.0] * len(batches)
+    for spec in sorted(checks, key=lambda spec: -spec.cost):
+        index = totals.index(min(totals))
+        batches[index].append(spec)
+        totals[index] += spec.cost
+    return [batch for batch in batches if batch]
+
+
+def checks_main(argv=None):
+    import argparse
+    from excel_validator_cli import setup_console_encoding
+
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py checks',
+                                     description='登録されているチェックの一覧（実行順）')
+    parser.parse_args(argv)
+    setup_console_encoding()
+
+    plugins = {spec.name for spec in plugin_checks()}
+    for spec in plan_checks():
+        origin = '追加' if spec.name in plugins else '組み込み'
+        flags = ''.join([' 並行実行可' if spec.heavy else '', ' 空なら省略' if spec.skip_if_empty else ''])
+        print(f"{spec.name:<16} {spec.label or '-'}（{origin}）")
+        print(f"{'':<16} コスト {spec.cost:g} / 最大 {spec.max_severity} / セル {len(spec.cells)}個{flags}")
+    return 0
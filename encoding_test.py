@@ -3,12 +3,19 @@
 """
 文字化け診断スクリプト
 このスクリプトは文字化けの原因を特定するためのものです。
+
+doctor モードでは、大量の報告書を一括チェックする前に実行環境の性能を確認します。
+  python3 encoding_test.py doctor --path /mnt/share/報告書 --save doctor.json
+  python3 excel_validator_cli.py doctor --path /mnt/share/報告書 --save doctor.json
+保存した診断結果は一括チェックの --profile（または環境変数 CHECK_EXCEL_PROFILE）で
+読み込まれ、ワーカー数・メモリ上限・読み込み方式の既定値になります。
 """
 
 import sys
 import os
 import locale
 import platform
+import time
 
 def main():
     print("=" * 60)
@@ -73,5 +80,365 @@ def main():
     print("文字化けが発生している場合は、上記の設定を確認してください。")
     print("=" * 60)
 
+# 診断結果ファイルの形式
+PROFILE_VERSION = 1
+# ワーカー1つあたりに見込むメモリ（openpyxl で大きめの報告書を読み込んだ場合の目安）
+WORKER_MEMORY_MB = 512
+# ワーカーのメモリ上限（RLIMIT_AS は仮想メモリのため、インタプリタとライブラリの分を含む）
+MIN_MEMORY_LIMIT_MB = 512
+MAX_MEMORY_LIMIT_MB = 2048
+# これより1ファイルあたりの操作が遅いフォルダはネットワーク共有とみなし、
+# 読み込み待ちの間に他のワーカーが動けるようコア数より多くのワーカーを勧める
+SLOW_FILESYSTEM_MS = 5.0
+# 任意で利用できる高速化ライブラリ（インポート名, 用途）
+ACCELERATORS = [
+    ('lxml', 'openpyxl のXML解析の高速化'),
+    ('fugashi', '形態素解析（MeCab）'),
+    ('janome', '形態素解析（pure Python）'),
+    ('sudachipy', '形態素解析（Sudachi）'),
+]
+
+
+def read_first_line(path):
+    try:
+        with open(path, encoding='ascii') as f:
+            return f.readline().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def usable_cores():
+    """このプロセスが使えるコア数（CPUアフィニティとcgroupのCPU制限を考慮）"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    quota = read_first_line('/sys/fs/cgroup/cpu.max')
+    if quota and not quota.startswith('max'):
+        limit, period = (int(value) for value in quota.split()[:2])
+        cores = min(cores, max(1, -(-limit // period)))
+    return cores
+
+
+def available_memory_mb():
+    """空きメモリ（MB）。cgroupのメモリ制限がある場合はその残り"""
+    available = None
+    try:
+        with open('/proc/meminfo', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+
+    if available is None and platform.system() == 'Windows':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            available = status.ullAvailPhys // (1024 * 1024)
+
+    if available is None:
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+        except (AttributeError, ValueError, OSError):
+            pass
+
+    limit = read_first_line('/sys/fs/cgroup/memory.max')
+    usage = read_first_line('/sys/fs/cgroup/memory.current')
+    if limit and limit != 'max' and usage:
+        remaining = (int(limit) - int(usage)) // (1024 * 1024)
+        available = remaining if available is None else min(available, remaining)
+    return available
+
+
+def probe_filesystem(directory, size_mb=8, files=20):
+    """
+    フォルダに一時ファイルを作って、1ファイルあたりの操作時間（作成・stat・読み込み・削除）と
+    書き込み・読み込みの速度を測る。書き込めないフォルダは既存のエントリの stat だけを測る。
+    """
+    import tempfile
+    result = {'path': os.path.abspath(directory), 'writable': True}
+    try:
+        work = tempfile.mkdtemp(prefix='.check_excel_doctor-', dir=directory)
+    except OSError:
+        result['writable'] = False
+        names = os.listdir(directory)[:files]
+        start = time.perf_counter()
+        for name in names:
+            os.stat(os.path.join(directory, name))
+        result['metadata_ms'] = (time.perf_counter() - start) * 1000 / max(len(names), 1)
+        return result
+
+    try:
+        start = time.perf_counter()
+        for i in range(files):
+            path = os.path.join(work, f'{i}.tmp')
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            os.stat(path)
+            with open(path, 'rb') as f:
+                f.read()
+            os.remove(path)
+        result['metadata_ms'] = (time.perf_counter() - start) * 1000 / files
+
+        block = os.urandom(1024 * 1024)
+        path = os.path.join(work, 'throughput.tmp')
+        start = time.perf_counter()
+        with open(path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        result['write_mb_s'] = size_mb / max(time.perf_counter() - start, 1e-9)
+
+        # 直前に書いたファイルはキャッシュに載っていることが多いため、読み込み速度は上限の目安
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            while f.read(1024 * 1024):
+                pass
+        result['read_mb_s'] = size_mb / max(time.perf_counter() - start, 1e-9)
+        os.remove(path)
+    finally:
+        import shutil
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def probe_inotify(directory):
+    """
+    inotify でフォルダの変更を検知できるか確認する（Linuxのみ）。
+    WSL の /mnt/c やネットワーク共有では監視の登録に成功してもイベントが届かないことがあるため、
+    実際にファイルを作成してイベントを待つ。
+    戻り値: True/False（Linux以外は None）
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+    import select
+    import tempfile
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return False
+    if fd < 0:
+        return False
+    try:
+        IN_CREATE = 0x100
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.abspath(directory)), IN_CREATE) < 0:
+            return False
+        try:
+            probe, path = tempfile.mkstemp(prefix='.check_excel_doctor-', dir=directory)
+        except OSError:
+            return False
+        os.close(probe)
+        os.remove(path)
+        ready, _, _ = select.select([fd], [], [], 1.0)
+        return bool(ready)
+    finally:
+        os.close(fd)
+
+
+def probe_accelerators():
+    """任意のライブラリがインポートできるかと、そのバージョン（インポートできなければ None）"""
+    import importlib
+    found = {}
+    for name, _ in ACCELERATORS:
+        try:
+            module = importlib.import_module(name)
+        except Exception:
+            found[name] = None
+            continue
+        found[name] = getattr(module, '__version__', None) or getattr(module, 'VERSION', None) or '?'
+    return found
+
+
+def probe_readers(sample=None, repeat=5):
+    """
+    読み込み方式ごとに、報告書1件から必要なセルを取り出す時間（ミリ秒、最速値）を測る。
+    sample を指定しない場合は小さな報告書を作成して測る（openpyxl が必要）。
+    (時間, 利用できなかった方式ごとの理由) を返す。sample が壊れている・xlsx でない等で
+    開けない方式は時間を None にし、理由にエラーメッセージを入れる。
+    """
+    import tempfile
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from excel_validator_cli import REQUIRED_CELLS
+    from report_reader import READERS, CellSnapshot, open_report
+
+    timings = {}
+    errors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if sample is None:
+            try:
+                import openpyxl
+            except ImportError:
+                return {'stream': None}, {'stream': 'openpyxl が未インストール'}
+            sample = os.path.join(tmp, 'sample.xlsx')
+            wb = openpyxl.Workbook()
+            sheet = wb.active
+            for row, col in REQUIRED_CELLS:
+                sheet.cell(row=row, column=col, value='数学の関数の理解を深めるため毎週20問の演習を行います。' * 3)
+            wb.save(sample)
+
+        for reader in READERS:
+            best = None
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    report = open_report(sample, reader)
+                    try:
+                        CellSnapshot.capture(report, REQUIRED_CELLS)
+                    finally:
+                        report.close()
+                    elapsed = (time.perf_counter() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+            except ImportError as e:
+                best = None
+                errors[reader] = f"未インストール（{e.name}）" if e.name else str(e)
+            except Exception as e:
+                best = None
+                errors[reader] = f"{type(e).__name__}: {e}"
+            timings[reader] = best
+    return timings, errors
+
+
+def recommend(cores, memory_mb, filesystem, readers):
+    """測定結果から一括チェックの設定（ワーカー数・メモリ上限・読み込み方式）を決める"""
+    workers = cores
+    if filesystem.get('metadata_ms', 0) > SLOW_FILESYSTEM_MS:
+        workers = cores * 2
+    memory_limit = None
+    if memory_mb:
+        budget = memory_mb * 3 // 4
+        workers = max(1, min(workers, budget // WORKER_MEMORY_MB))
+        memory_limit = max(MIN_MEMORY_LIMIT_MB, min(MAX_MEMORY_LIMIT_MB, budget // workers))
+    measured = {reader: ms for reader, ms in readers.items() if ms is not None}
+    reader = min(measured, key=measured.get) if measured else 'stream'
+    return {'workers': workers, 'memory_limit_mb': memory_limit, 'reader': reader}
+
+
+def run_doctor(directory='.', sample=None, size_mb=8):
+    """環境を診断し、診断結果（保存・一括チェックへの適用に使う辞書）を返す"""
+    import socket
+    cores = usable_cores()
+    memory_mb = available_memory_mb()
+    filesystem = probe_filesystem(directory, size_mb=size_mb)
+    inotify = probe_inotify(directory) if filesystem['writable'] else None
+    readers, reader_errors = probe_readers(sample)
+    return {
+        'doctor': PROFILE_VERSION,
+        'host': socket.gethostname(),
+        'measured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'system': {'os': f"{platform.system()} {platform.release()}", 'python': platform.python_version(),
+                   'cores': cores, 'cpu_count': os.cpu_count(), 'available_memory_mb': memory_mb},
+        'filesystem': filesystem,
+        'inotify': inotify,
+        'accelerators': probe_accelerators(),
+        'readers_ms': readers,
+        'readers_errors': reader_errors,
+        'recommended': recommend(cores, memory_mb, filesystem, readers),
+    }
+
+
+def load_profile(path):
+    """保存した診断結果の推奨設定を読み込む（形式が違う場合は ValueError）"""
+    import json
+    with open(path, encoding='utf-8') as f:
+        profile = json.load(f)
+    if profile.get('doctor') != PROFILE_VERSION or 'recommended' not in profile:
+        raise ValueError(f"診断結果の形式が違います: {path}")
+    return profile['recommended']
+
+
+def print_doctor_report(profile):
+    system = profile['system']
+    filesystem = profile['filesystem']
+    print("=" * 60)
+    print("実行環境の診断")
+    print("=" * 60)
+    print(f"OS: {system['os']} / Python {system['python']}")
+    print(f"使用できるコア数: {system['cores']}（論理CPU {system['cpu_count']}）")
+    memory = system['available_memory_mb']
+    print(f"空きメモリ: {f'{memory}MB' if memory is not None else '不明'}")
+    print()
+    print(f"フォルダ: {filesystem['path']}")
+    print(f"  1ファイルあたりの操作: {filesystem['metadata_ms']:.2f} ms"
+          + ('（ネットワーク共有等の遅いフォルダ）' if filesystem['metadata_ms'] > SLOW_FILESYSTEM_MS else ''))
+    if filesystem['writable']:
+        print(f"  書き込み: {filesystem['write_mb_s']:.0f} MB/s（fsync込み）")
+        print(f"  読み込み: {filesystem['read_mb_s']:.0f} MB/s（キャッシュを含む上限の目安）")
+    else:
+        print("  書き込み不可のため、速度は測定していません")
+    inotify = profile['inotify']
+    print(f"  変更の監視（inotify）: {'利用可' if inotify else ('対象外' if inotify is None else '利用不可')}")
+    print()
+    print("高速化ライブラリ:")
+    for name, purpose in ACCELERATORS:
+        version = profile['accelerators'].get(name)
+        print(f"  {name}: {version if version else '未インストール'}（{purpose}）")
+    print()
+    print("読み込み方式（報告書1件）:")
+    reader_errors = profile.get('readers_errors', {})
+    for reader, ms in profile['readers_ms'].items():
+        if ms is not None:
+            print(f"  {reader}: {ms:.1f} ms")
+        else:
+            reason = reader_errors.get(reader)
+            print(f"  {reader}: 利用不可" + (f"（{reason}）" if reason else ''))
+    print()
+    recommended = profile['recommended']
+    print("推奨設定:")
+    print(f"  ワーカー数: {recommended['workers']}")
+    if recommended['memory_limit_mb']:
+        print(f"  メモリ上限: {recommended['memory_limit_mb']}MB / ワーカー")
+    print(f"  読み込み方式: {recommended['reader']}")
+    options = f"--workers {recommended['workers']} --reader {recommended['reader']}"
+    if recommended['memory_limit_mb']:
+        options += f" --memory-limit {recommended['memory_limit_mb']}"
+    print(f"  例: python3 excel_validator_cli.py 報告書フォルダ/ {options}")
+    print("=" * 60)
+
+
+def doctor_main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py doctor',
+                                     description='一括チェック前に実行環境の性能を診断し、推奨設定を表示')
+    parser.add_argument('--path', default='.',
+                        help='報告書を置くフォルダ（読み書きの速度を測る場所。既定: カレントフォルダ）')
+    parser.add_argument('--sample', help='読み込み方式の比較に使う報告書（既定: 小さな報告書を作成）')
+    parser.add_argument('--size-mb', type=int, default=8, help='読み書きの速度の測定に使うファイルの大きさ（MB）')
+    parser.add_argument('--save', metavar='PATH',
+                        help='診断結果をJSONで保存する（一括チェックの --profile で読み込める）')
+    args = parser.parse_args(argv)
+
+    if sys.stdout.encoding != 'utf-8':
+        sys.stdout.reconfigure(encoding='utf-8')
+    try:
+        profile = run_doctor(args.path, sample=args.sample, size_mb=args.size_mb)
+    except OSError as e:
+        print(f"エラー: {e}")
+        return 1
+    print_doctor_report(profile)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        print(f"診断結果を保存しました: {args.save}")
+    return 0
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['doctor']:
+        sys.exit(doctor_main(sys.argv[2:]))
     main()
\ No newline at end of file
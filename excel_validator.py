@@ -2,7 +2,6 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import openpyxl
 from pathlib import Path
 import re
 from datetime import datetime
@@ -10,6 +9,10 @@ import json
 from typing import Dict, List, Tuple, Optional
 import os
 import sys
+from contextlib import nullcontext
+
+from report_reader import open_report
+from memory_trace import trace_from_environment
 
 
 class StudentReportValidator:
@@ -34,6 +37,8 @@ class StudentReportValidator:
         
         self.current_file = None
         self.validation_results = []
+        # 環境変数 CHECK_EXCEL_TRACE_MEMORY を設定すると、ファイルごとのメモリ使用量を標準エラー出力に表示する
+        self.memory_trace = trace_from_environment()
         
         self.setup_ui()
         self.setup_drag_drop()
@@ -110,6 +115,13 @@ class StudentReportValidator:
         ttk.Checkbutton(settings_frame, text="誤字脱字チェック", variable=self.check_spelling).grid(row=1, column=0, sticky=tk.W)
         ttk.Checkbutton(settings_frame, text="内容の適切性", variable=self.check_content).grid(row=1, column=1, sticky=tk.W)
         
+        # エントリポイントで追加されたチェック（check_registry.py）
+        from check_registry import plugin_checks
+        self.plugin_checks = [(spec, tk.BooleanVar(value=True)) for spec in plugin_checks()]
+        for position, (spec, enabled) in enumerate(self.plugin_checks):
+            ttk.Checkbutton(settings_frame, text=spec.label or spec.name, variable=enabled).grid(
+                row=2 + position // 2, column=position % 2, sticky=tk.W)
+        
         # Results frame
         results_frame = ttk.LabelFrame(main_frame, text="チェック結果", padding="10")
         results_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -202,35 +214,49 @@ class StudentReportValidator:
             messagebox.showerror("エラー", "ファイルが見つかりません")
             return
             
+        self.clear_results()
+        tracking = self.memory_trace.track(file_path) if self.memory_trace is not None else nullcontext()
         try:
-            self.validation_results = []
-            self.results_tree.delete(*self.results_tree.get_children())
-            
-            # Load Excel file
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            sheet = wb.active
-            
-            # Perform validations
-            if self.check_scores.get():
-                self.validate_test_scores(sheet)
-                
-            if self.check_text_length.get():
-                self.validate_text_sections(sheet)
-                
-            if self.check_spelling.get():
-                self.check_spelling_errors(sheet)
-                
-            if self.check_content.get():
-                self.validate_content_appropriateness(sheet)
+            with tracking:
+                # Load Excel file（.xls は report_reader が BIFF8 形式として読み込む）
+                sheet = open_report(file_path)
+                # チェック中に例外が発生しても、開いたファイルは必ず閉じる
+                try:
+                    # Perform validations
+                    if self.check_scores.get():
+                        self.validate_test_scores(sheet)
+                        
+                    if self.check_text_length.get():
+                        self.validate_text_sections(sheet)
+                        
+                    if self.check_spelling.get():
+                        self.check_spelling_errors(sheet)
+                        
+                    if self.check_content.get():
+                        self.validate_content_appropriateness(sheet)
+                        
+                    for spec, enabled in self.plugin_checks:
+                        if enabled.get():
+                            spec.run(self, sheet)
+                finally:
+                    sheet.close()
                 
             # Update summary
             self.update_summary()
             
-            wb.close()
-            
         except Exception as e:
+            # 途中までの結果は残さない（次のファイルの結果と混ざらないようにする）
+            self.clear_results()
             messagebox.showerror("エラー", f"ファイルの読み込み中にエラーが発生しました:\n{str(e)}")
+        
+        if self.memory_trace is not None:
+            print(self.memory_trace.last_line(), file=sys.stderr)
             
+    def clear_results(self):
+        """前回のチェック結果（一覧の行と結果のリスト）を破棄する"""
+        self.validation_results = []
+        self.results_tree.delete(*self.results_tree.get_children())
+        
     def validate_test_scores(self, sheet):
         score_cells = {
             '国語_目標': (10, 3),
@@ -648,6 +674,8 @@ class StudentReportValidator:
                 
     def run(self):
         self.root.mainloop()
+        if self.memory_trace is not None:
+            self.memory_trace.report()
 
 
 if __name__ == "__main__":
@@ -1,54 +1,119 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import openpyxl
-from pathlib import Path
+# 起動時間を抑えるため、openpyxl・json・argparse 等の重いモジュールは
+# 実際に必要になる関数の中でインポートする（--help やシェルループからの
+# 呼び出しで openpyxl の読み込みコストを払わないようにするため）。
+# re は argparse が内部で読み込むため、ここで読み込んでも追加コストはない。
+import os
 import re
-from datetime import datetime
-import json
-from typing import Dict, List, Tuple, Optional
 import sys
-import argparse
-import os
+
+
+# チェック対象のセル位置: ラベル -> (行, 列)
+SCORE_CELLS = {
+    '国語_目標': (10, 3),
+    '社会_目標': (10, 4),
+    '数学_目標': (10, 5),
+    '理科_目標': (10, 6),
+    '英語_目標': (10, 7),
+    '合計_目標': (10, 8),
+    '国語_結果': (12, 3),
+    '社会_結果': (12, 4),
+    '数学_結果': (12, 5),
+    '理科_結果': (12, 6),
+    '英語_結果': (12, 7),
+    '合計_結果': (12, 8),
+    '順位': (12, 9),
+    '国語_平均': (14, 3),
+    '社会_平均': (14, 4),
+    '数学_平均': (14, 5),
+    '理科_平均': (14, 6),
+    '英語_平均': (14, 7),
+    '合計_平均': (14, 8)
+}
+
+# 文章項目: 項目名 -> (行, 列, 推奨最小文字数, 推奨最大文字数)
+TEXT_SECTIONS = {
+    '現在の学習課題': (17, 2, 100, 500),
+    '課題に対する進捗状況': (17, 10, 100, 500),
+    '今後の目標': (27, 2, 50, 300),
+    '目標に向けた指導計画': (27, 10, 100, 500),
+    '授業態度・意欲・遅刻等': (37, 2, 50, 400),
+    '宿題について': (37, 10, 50, 400),
+    '家庭学習アドバイス': (47, 2, 100, 500),
+    '夏期講習提案理由': (50, 2, 50, 300)
+}
+
+# 全チェックが参照するセル（スナップショット作成用）
+REQUIRED_CELLS = tuple(SCORE_CELLS.values()) + tuple((row, col) for row, col, _, _ in TEXT_SECTIONS.values())
+
+# 誤字脱字チェックの対象: 正しい表記 -> よくある誤り（--fix で自動修正する組み合わせは typo_fix.py）
+COMMON_TYPOS = {
+    'そして': ['そうして', 'そしして'],
+    'ということ': ['とゆうこと', 'とゆう事'],
+    '言う': ['ゆう'],
+    'いう': ['ゆう'],
+    'そういう': ['そうゆう'],
+    'どういう': ['どうゆう'],
+    '頑張': ['がんば'],
+    '一生懸命': ['いっしょうけんめい', 'いっしょけんめい'],
+    'できる': ['出来る'],
+    'わかる': ['分かる', '判る'],
+    'おこなう': ['行なう'],
+    'あらわす': ['表わす', '現わす'],
+}
+
+# 重要度の順位（数値が大きいほど重要）。英語名は --min-severity の別名として受け付ける
+SEVERITY_RANK = {'情報': 0, '警告': 1, 'エラー': 2}
+SEVERITY_ALIASES = {'info': '情報', 'warning': '警告', 'error': 'エラー'}
+
+# 各チェックの宣言（参照するセル・コスト・重要度等）は check_registry.py にあり、
+# 独自のチェックはエントリポイントで追加できる。
+
+
+class StopValidation(Exception):
+    """--fail-fast 指定時、しきい値以上の結果が見つかった時点でチェックを打ち切るための例外"""
+
+
+def run_checks_on_snapshot(names, snapshot, min_rank: int, vocabulary=None, phrase_model=None):
+    """プロセスプール用: スナップショットに対して複数のチェックを実行し、{チェック名: 結果のリスト} を返す"""
+    from check_registry import get_check
+    validator = StudentReportValidatorCLI(verbose=False)
+    validator.min_rank = min_rank
+    validator.vocabulary = vocabulary
+    validator.phrase_model = phrase_model
+    results = {}
+    for name in names:
+        validator.validation_results = []
+        validator.run_check(get_check(name), snapshot)
+        results[name] = validator.validation_results
+    return results
 
 
 class StudentReportValidatorCLI:
-    def __init__(self):
+    def __init__(self, verbose=True, jobs=1):
         self.validation_results = []
+        self.verbose = verbose
+        self.min_rank = 0
+        self.fail_fast = False
+        self.vocabulary = None
+        self.phrase_model = None
+        self.jobs = jobs
+        self._pool = None
+        
+    def log(self, message: str):
+        if self.verbose:
+            print(message)
         
     def validate_file(self, file_path: str, check_scores=True, check_text_length=True, 
-                     check_spelling=True, check_content=True):
-        if not Path(file_path).exists():
+                     check_spelling=True, check_content=True, **options):
+        if not os.path.exists(file_path):
             print(f"エラー: ファイルが見つかりません: {file_path}")
             return False
             
         try:
-            self.validation_results = []
-            
-            # Load Excel file
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            sheet = wb.active
-            
-            print(f"\nファイルを検証中: {file_path}")
-            print("=" * 80)
-            
-            # Perform validations
-            if check_scores:
-                print("\nテストスコアを検証中...")
-                self.validate_test_scores(sheet)
-                
-            if check_text_length:
-                print("文章の長さを検証中...")
-                self.validate_text_sections(sheet)
-                
-            if check_spelling:
-                print("誤字脱字をチェック中...")
-                self.check_spelling_errors(sheet)
-                
-            if check_content:
-                print("内容の適切性を検証中...")
-                self.validate_content_appropriateness(sheet)
-                
-            wb.close()
+            self.run_checks(file_path, check_scores, check_text_length,
+                            check_spelling, check_content, **options)
             
             # Display results
             self.display_results()
@@ -59,30 +124,134 @@ class StudentReportValidatorCLI:
             print(f"エラー: ファイルの読み込み中にエラーが発生しました:\n{str(e)}")
             return False
             
-    def validate_test_scores(self, sheet):
-        score_cells = {
-            '国語_目標': (10, 3),
-            '社会_目標': (10, 4),
-            '数学_目標': (10, 5),
-            '理科_目標': (10, 6),
-            '英語_目標': (10, 7),
-            '合計_目標': (10, 8),
-            '国語_結果': (12, 3),
-            '社会_結果': (12, 4),
-            '数学_結果': (12, 5),
-            '理科_結果': (12, 6),
-            '英語_結果': (12, 7),
-            '合計_結果': (12, 8),
-            '順位': (12, 9),
-            '国語_平均': (14, 3),
-            '社会_平均': (14, 4),
-            '数学_平均': (14, 5),
-            '理科_平均': (14, 6),
-            '英語_平均': (14, 7),
-            '合計_平均': (14, 8)
-        }
+    def run_checks(self, file_path: str, check_scores=True, check_text_length=True,
+                   check_spelling=True, check_content=True, min_severity=None,
+                   fail_fast=False, reader=None, vocabulary=None, phrase_model=None, skip=()):
+        """
+        ファイルを読み込んで各チェックを実行し、結果のリストを返す（表示は行わない）。
+        reader は読み込みバックエンド（None の場合、しきい値指定時は必要なセルだけを
+        読む stream、それ以外は openpyxl）。その他の引数は check_sheet を参照。
+        """
+        import metrics
+        from report_reader import open_report
+        
+        if reader is None:
+            reader = 'stream' if (min_severity or fail_fast) else 'openpyxl'
         
-        for label, (row, col) in score_cells.items():
+        with metrics.timed('check_excel_file_seconds'):
+            # Load Excel file
+            try:
+                with metrics.stage('read'):
+                    sheet = open_report(file_path, reader)
+            except Exception:
+                metrics.record_results([], failed=True)
+                raise
+            try:
+                self.log(f"\nファイルを検証中: {file_path}")
+                self.log("=" * 80)
+                
+                results = self.check_sheet(sheet, check_scores, check_text_length, check_spelling,
+                                           check_content, min_severity, fail_fast, vocabulary, phrase_model, skip)
+            finally:
+                sheet.close()
+        metrics.record_results(results)
+        return results
+            
+    def check_sheet(self, sheet, check_scores=True, check_text_length=True,
+                    check_spelling=True, check_content=True, min_severity=None,
+                    fail_fast=False, vocabulary=None, phrase_model=None, skip=()):
+        """
+        読み込み済みのシート（またはセルのスナップショット）に対して各チェックを実行する。
+        min_severity を指定するとそれ未満の結果は記録せず、fail_fast を指定すると
+        しきい値以上の結果が最初に見つかった時点で残りのチェックを打ち切る。
+        vocabulary は語彙の索引ファイル（typo_index.py）で、指定すると誤字脱字チェックで
+        語彙にない語を報告する。phrase_model は文章モデル（phrase_model.py）で、指定すると
+        不自然な表現と語句の繰り返しを報告する。skip は実行しないチェックの名前
+        （check_registry.py。追加したチェックも指定できる）。
+        チェックはコストの安い順に実行し、参照するセルがすべて空のチェックは省略する。
+        jobs が2以上の場合は、必要なセルの値をスナップショットとして一度だけ取り出し、
+        CPU負荷の高いチェックをプロセスプールで並行実行する。結果は逐次実行と同じ
+        順序に並べ直す（fail_fast 指定時は早期終了のため逐次実行）。
+        """
+        from check_registry import has_input, plan_checks, required_cells
+        from report_reader import CellSnapshot
+        
+        self.validation_results = []
+        self.min_rank = SEVERITY_RANK[min_severity] if min_severity else 0
+        self.fail_fast = fail_fast
+        self.vocabulary = vocabulary
+        self.phrase_model = phrase_model
+        disabled = set(skip)
+        for name, enabled in (('scores', check_scores), ('text_length', check_text_length),
+                              ('spelling', check_spelling), ('content', check_content)):
+            if not enabled:
+                disabled.add(name)
+        checks = plan_checks(disabled, self.min_rank)
+        
+        try:
+            if self.jobs > 1 and not fail_fast:
+                if not isinstance(sheet, CellSnapshot):
+                    sheet = CellSnapshot.capture(sheet, required_cells(checks))
+                self.run_checks_parallel(sheet, [spec for spec in checks if has_input(spec, sheet)])
+            else:
+                # Perform validations
+                for spec in checks:
+                    if has_input(spec, sheet):
+                        self.log(spec.message)
+                        self.run_check(spec, sheet)
+        except StopValidation:
+            self.log("しきい値以上の結果が見つかったため、残りのチェックを省略しました")
+            
+        return self.validation_results
+        
+    def run_check(self, spec, sheet):
+        """1つのチェックを実行する（組み込みはメソッド名、追加したチェックは関数）"""
+        import metrics
+        with metrics.stage(spec.name):
+            if isinstance(spec.run, str):
+                getattr(self, spec.run)(sheet)
+            else:
+                spec.run(self, sheet)
+        
+    def run_checks_parallel(self, snapshot, checks):
+        """
+        CPU負荷の高いチェックをコストが均等になるよう jobs 個までにまとめてプロセスプールに投入し、
+        残りはこのプロセスで実行する。各まとまりには参照するセルの値だけを渡す。
+        """
+        from check_registry import batch_checks, required_cells
+        from report_reader import CellSnapshot
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.jobs)
+        
+        futures = {}
+        for batch in batch_checks([spec for spec in checks if spec.heavy], self.jobs):
+            cells = {cell: snapshot.cell(row=cell[0], column=cell[1]).value for cell in required_cells(batch)}
+            future = self._pool.submit(run_checks_on_snapshot, [spec.name for spec in batch],
+                                       CellSnapshot(cells, snapshot.title), self.min_rank,
+                                       self.vocabulary, self.phrase_model)
+            for spec in batch:
+                futures[spec.name] = future
+        
+        results = []
+        for spec in checks:
+            self.log(spec.message)
+            if spec.heavy:
+                results.extend(futures[spec.name].result()[spec.name])
+            else:
+                self.validation_results = []
+                self.run_check(spec, snapshot)
+                results.extend(self.validation_results)
+        self.validation_results = results
+        
+    def shutdown(self):
+        """並行実行用のプロセスプールを終了する"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            
+    def validate_test_scores(self, sheet):
+        for label, (row, col) in SCORE_CELLS.items():
             value = sheet.cell(row=row, column=col).value
             
             if value is None:
@@ -137,18 +306,7 @@ class StudentReportValidatorCLI:
                 )
                 
     def validate_text_sections(self, sheet):
-        text_sections = {
-            '現在の学習課題': (17, 2, 100, 500),
-            '課題に対する進捗状況': (17, 10, 100, 500),
-            '今後の目標': (27, 2, 50, 300),
-            '目標に向けた指導計画': (27, 10, 100, 500),
-            '授業態度・意欲・遅刻等': (37, 2, 50, 400),
-            '宿題について': (37, 10, 50, 400),
-            '家庭学習アドバイス': (47, 2, 100, 500),
-            '夏期講習提案理由': (50, 2, 50, 300)
-        }
-        
-        for section_name, (row, col, min_length, max_length) in text_sections.items():
+        for section_name, (row, col, min_length, max_length) in TEXT_SECTIONS.items():
             content = sheet.cell(row=row, column=col).value
             
             if not content:
@@ -178,30 +336,21 @@ class StudentReportValidatorCLI:
                     )
                     
     def check_spelling_errors(self, sheet):
-        common_typos = {
-            'そして': ['そうして', 'そしして'],
-            'ということ': ['とゆうこと', 'とゆう事'],
-            '言う': ['ゆう'],
-            'いう': ['ゆう'],
-            'そういう': ['そうゆう'],
-            'どういう': ['どうゆう'],
-            '頑張': ['がんば'],
-            '一生懸命': ['いっしょうけんめい', 'いっしょけんめい'],
-            'できる': ['出来る'],
-            'わかる': ['分かる', '判る'],
-            'おこなう': ['行なう'],
-            'あらわす': ['表わす', '現わす'],
-        }
-        
-        text_cells = [(17, 2), (17, 10), (27, 2), (27, 10), (37, 2), (37, 10), (47, 2), (50, 2)]
-        
-        for row, col in text_cells:
+        index = None
+        if self.vocabulary:
+            from typo_index import load_index
+            index = load_index(self.vocabulary)
+        model = None
+        if self.phrase_model:
+            from phrase_model import load_model
+            model = load_model(self.phrase_model)
+        for row, col, _, _ in TEXT_SECTIONS.values():
             content = sheet.cell(row=row, column=col).value
             if content:
                 content_str = str(content)
                 
                 # Check for common typos
-                for correct, typos in common_typos.items():
+                for correct, typos in COMMON_TYPOS.items():
                     for typo in typos:
                         if typo in content_str:
                             self.add_validation_result(
@@ -210,6 +359,26 @@ class StudentReportValidatorCLI:
                                 "警告",
                                 f"'{typo}' → '{correct}' の可能性があります"
                             )
+                
+                # Check for words not in the vocabulary
+                if index is not None:
+                    for word, candidates in index.check_text(content_str):
+                        self.add_validation_result(
+                            f"誤字脱字 - セル({row}, {col})",
+                            "語彙にない語",
+                            "警告",
+                            f"'{word}' → '{', '.join(candidates)}' の可能性があります"
+                        )
+                
+                # Check for unnatural phrases and repeated phrases
+                if model is not None:
+                    for finding_type, severity, detail in model.check_text(content_str):
+                        self.add_validation_result(
+                            f"誤字脱字 - セル({row}, {col})",
+                            finding_type,
+                            severity,
+                            detail
+                        )
                             
                 # Check for repeated characters
                 repeated_chars = re.findall(r'(.)\1{3,}', content_str)
@@ -277,19 +446,9 @@ class StudentReportValidatorCLI:
             }
         }
         
-        row_col_map = {
-            '現在の学習課題': (17, 2),
-            '課題に対する進捗状況': (17, 10),
-            '今後の目標': (27, 2),
-            '目標に向けた指導計画': (27, 10),
-            '授業態度・意欲・遅刻等': (37, 2),
-            '宿題について': (37, 10),
-            '家庭学習アドバイス': (47, 2)
-        }
-        
         for section_name, rules in section_rules.items():
-            if section_name in row_col_map:
-                row, col = row_col_map[section_name]
+            if section_name in TEXT_SECTIONS:
+                row, col, _, _ = TEXT_SECTIONS[section_name]
                 content = sheet.cell(row=row, column=col).value
                 
                 if content:
@@ -342,6 +501,8 @@ class StudentReportValidatorCLI:
                         )
                         
     def add_validation_result(self, item: str, type: str, severity: str, detail: str):
+        if SEVERITY_RANK.get(severity, 0) < self.min_rank:
+            return
         result = {
             'item': item,
             'type': type,
@@ -349,6 +510,8 @@ class StudentReportValidatorCLI:
             'detail': detail
         }
         self.validation_results.append(result)
+        if self.fail_fast:
+            raise StopValidation()
         
     def display_results(self):
         if not self.validation_results:
@@ -405,15 +568,19 @@ class StudentReportValidatorCLI:
             
         try:
             if output_file.endswith('.json'):
+                import json
                 with open(output_file, 'w', encoding='utf-8') as f:
                     json.dump(self.validation_results, f, ensure_ascii=False, indent=2)
             else:
+                from datetime import datetime
                 with open(output_file, 'w', encoding='utf-8') as f:
                     f.write(f"生徒現状報告書チェック結果\n")
                     f.write(f"チェック日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}\n")
                     f.write("=" * 80 + "\n\n")
                     
                     for result in self.validation_results:
+                        if 'file' in result:
+                            f.write(f"ファイル: {result['file']}\n")
                         f.write(f"項目: {result['item']}\n")
                         f.write(f"種類: {result['type']}\n")
                         f.write(f"重要度: {result['severity']}\n")
@@ -425,7 +592,7 @@ class StudentReportValidatorCLI:
             print(f"保存中にエラーが発生しました: {str(e)}")
 
 
-def main():
+def setup_console_encoding():
     # 標準出力のエンコーディングを確実にUTF-8に設定
     if sys.stdout.encoding != 'utf-8':
         sys.stdout.reconfigure(encoding='utf-8')
@@ -438,7 +605,6 @@ def main():
     # ロケール設定の確認と警告
     import locale
     try:
-        current_locale = locale.getlocale()
         preferred_encoding = locale.getpreferredencoding()
         if preferred_encoding.lower() not in ['utf-8', 'utf8']:
             print(f"警告: システムのエンコーディング設定が{preferred_encoding}です。")
@@ -449,32 +615,381 @@ def main():
             print("=" * 60)
     except Exception as e:
         print(f"ロケール確認中にエラー: {e}")
-    
-    parser = argparse.ArgumentParser(description='生徒現状報告書チェッカー（コマンドライン版）')
-    parser.add_argument('file', help='チェックするExcelファイルのパス')
-    parser.add_argument('-o', '--output', help='結果を保存するファイル名（.txt or .json）')
+
+
+# サブコマンド名 -> (モジュール名, 関数名)。通常のファイルチェックより前に判定し、
+# 該当モジュールは呼び出された時だけインポートする。
+SUBCOMMANDS = {
+    'serve': ('validator_server', 'serve_main'),
+    'inspect': ('analyze_excel', 'main'),
+    'enqueue': ('lease_queue', 'enqueue_main'),
+    'worker': ('lease_queue', 'worker_main'),
+    'collect': ('lease_queue', 'collect_main'),
+    'doctor': ('encoding_test', 'doctor_main'),
+    'history': ('history_index', 'history_main'),
+    'typo-index': ('typo_index', 'typo_index_main'),
+    'phrase-model': ('phrase_model', 'phrase_model_main'),
+    'checks': ('check_registry', 'checks_main'),
+    'diff': ('result_diff', 'diff_main'),
+}
+
+
+# report_reader.READERS と同じ（--help のために report_reader を読み込まないよう複製）
+READERS = ('openpyxl', 'stream')
+
+
+def parse_severity(value: str) -> str:
+    severity = SEVERITY_ALIASES.get(value.lower(), value)
+    if severity not in SEVERITY_RANK:
+        import argparse
+        raise argparse.ArgumentTypeError(f"重要度は エラー/警告/情報 のいずれかを指定してください: {value}")
+    return severity
+
+
+def parse_pipeline(value: str):
+    try:
+        readers, analyzers = (int(part) for part in value.split(':'))
+        if readers < 1 or analyzers < 1:
+            raise ValueError
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError(f"読み込み:解析 のプロセス数を 1:3 のように指定してください: {value}")
+    return readers, analyzers
+
+
+def parse_metrics_address(value: str):
+    host, _, port = value.rpartition(':')
+    try:
+        port = int(port)
+        if not 0 < port < 65536:
+            raise ValueError
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError(f"ポート番号を 9464 または 0.0.0.0:9464 のように指定してください: {value}")
+    return host or '127.0.0.1', port
+
+
+def add_metrics_arguments(parser):
+    """動作状況のメトリクスの出力先に関する引数（一括チェック・serve・worker で共通。metrics.py）"""
+    parser.add_argument('--metrics-file', default=os.environ.get('CHECK_EXCEL_METRICS_FILE'), metavar='PATH',
+                        help='処理件数・所要時間等のメトリクスを Prometheus のテキスト形式で定期的に書き出すファイル'
+                             '（環境変数 CHECK_EXCEL_METRICS_FILE でも指定可）')
+    parser.add_argument('--metrics-port', type=parse_metrics_address,
+                        default=os.environ.get('CHECK_EXCEL_METRICS_PORT'), metavar='[HOST:]PORT',
+                        help='メトリクスを HTTP の /metrics で公開する（既定のホスト: 127.0.0.1。'
+                             '環境変数 CHECK_EXCEL_METRICS_PORT でも指定可）')
+    parser.add_argument('--metrics-interval', type=float, default=15, metavar='SECONDS',
+                        help='--metrics-file を書き出す間隔（既定: 15秒。終了時にも書き出す）')
+
+
+def add_check_arguments(parser):
+    """チェック内容に関する引数（通常のチェック・一括チェック・分散実行で共通）"""
     parser.add_argument('--no-scores', action='store_true', help='テストスコアのチェックをスキップ')
     parser.add_argument('--no-text', action='store_true', help='文章長のチェックをスキップ')
     parser.add_argument('--no-spelling', action='store_true', help='誤字脱字チェックをスキップ')
     parser.add_argument('--no-content', action='store_true', help='内容チェックをスキップ')
-    
-    args = parser.parse_args()
-    
-    validator = StudentReportValidatorCLI()
-    
-    success = validator.validate_file(
-        args.file,
+    parser.add_argument('--skip', action='append', default=[], metavar='CHECK',
+                        help='指定したチェックを実行しない（名前は checks サブコマンドで確認。複数指定可）')
+    parser.add_argument('--min-severity', type=parse_severity, metavar='{エラー,警告,情報}',
+                        help='指定した重要度以上の結果だけを報告する（error/warning/info も可）。'
+                             '該当する結果がある場合は終了コード2を返す')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='しきい値以上の結果が最初に見つかった時点でチェックを打ち切る'
+                             '（アップロード可否の判定向け。終了コードは --min-severity と同じ）')
+    parser.add_argument('--reader', choices=READERS,
+                        help='読み込み方式（既定: しきい値指定時は stream、それ以外は openpyxl）')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='一括チェック時、報告書間でほぼ同じ文章（コピー＆ペースト）を検出する')
+    parser.add_argument('--similarity', type=float, default=0.8,
+                        help='--near-duplicates で同じ文章とみなす類似度（0-1、既定: 0.8）')
+    parser.add_argument('--max-uncompressed-mb', type=int, default=256, metavar='MB',
+                        help='解析前に確認する展開後サイズの上限（既定: 256MB）')
+    parser.add_argument('--max-ratio', type=int, default=200,
+                        help='解析前に確認する圧縮率の上限（既定: 200倍）')
+    parser.add_argument('--vocabulary', default=os.environ.get('CHECK_EXCEL_VOCABULARY'), metavar='PATH',
+                        help='語彙の索引（typo-index build で作成）にない語を誤字の候補として報告する'
+                             '（環境変数 CHECK_EXCEL_VOCABULARY でも指定可）')
+    parser.add_argument('--phrase-model', default=os.environ.get('CHECK_EXCEL_PHRASE_MODEL'), metavar='PATH',
+                        help='文章モデル（phrase-model build で作成）で不自然な表現と語句の繰り返しを報告する'
+                             '（環境変数 CHECK_EXCEL_PHRASE_MODEL でも指定可）')
+    parser.add_argument('--history', metavar='DIR',
+                        help='生徒ごとの過去の報告書の索引（history build で作成）と比較し、'
+                             '前の期と同じ文章や前の期の目標に届いていない科目を報告する')
+
+
+def check_options(args):
+    """引数から check_sheet に渡すチェックオプションを作る"""
+    options = dict(
         check_scores=not args.no_scores,
         check_text_length=not args.no_text,
         check_spelling=not args.no_spelling,
-        check_content=not args.no_content
+        check_content=not args.no_content,
+        min_severity=args.min_severity,
+        fail_fast=args.fail_fast
     )
+    # 指定しない場合はキーを含めない（既存のジャーナル・キュー・差分の状態の設定と一致させるため）
+    if args.vocabulary:
+        options['vocabulary'] = os.path.abspath(args.vocabulary)
+    if args.phrase_model:
+        options['phrase_model'] = os.path.abspath(args.phrase_model)
+    if args.skip:
+        options['skip'] = sorted(set(args.skip))
+    return options
+
+
+def batch_settings(args):
+    """引数から BatchValidator の設定（ワーカーや分散実行にもそのまま渡せる形）を作る"""
+    settings = {
+        'options': check_options(args),
+        'reader': args.reader,
+        'near_duplicates': {'threshold': args.similarity} if args.near_duplicates else None,
+        'zip_limits': {'max_uncompressed_mb': args.max_uncompressed_mb, 'max_ratio': args.max_ratio},
+    }
+    # 指定しない場合はキーを含めない（既存のジャーナル・キューの設定と一致させるため）
+    if args.history:
+        settings['history'] = args.history
+    return settings
+
+
+def build_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='生徒現状報告書チェッカー（コマンドライン版）',
+        epilog='サブコマンド: ' + ', '.join(SUBCOMMANDS) + '（各サブコマンドの --help を参照）'
+    )
+    parser.add_argument('files', nargs='+', metavar='file',
+                        help='チェックするExcelファイルのパス（複数のファイル・フォルダ・zipアーカイブを指定すると一括チェック）')
+    parser.add_argument('-o', '--output', help='結果を保存するファイル名（.txt or .json）')
+    add_check_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='CPU負荷の高いチェック（誤字脱字・内容）を並行実行するプロセス数（既定: 1）')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='一括チェック時、完了したファイルの結果を追記していく再開用ジャーナル')
+    parser.add_argument('--resume', action='store_true',
+                        help='--journal に記録済みのファイルを省略して続きからチェックする')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='一括チェックを別プロセスのワーカーで実行する数（既定: 0 = このプロセスで実行）')
+    parser.add_argument('--timeout', type=float,
+                        help='1ファイルあたりの制限時間（秒）。超えたファイルはタイムアウトとして報告')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='ワーカー1つあたりの仮想メモリ上限（MB、Unixのみ）')
+    parser.add_argument('--recycle', type=int, default=100, metavar='N',
+                        help='ワーカーを N件ごとに新しいプロセスに入れ替える（既定: 100）')
+    parser.add_argument('--pipeline', type=parse_pipeline, metavar='READERS:ANALYZERS',
+                        help='一括チェックを読み込みと解析の2段のプロセス群で実行する（例: 1:3）。'
+                             '--workers/--timeout/--memory-limit とは併用できない')
+    parser.add_argument('--schedule', choices=('input', 'cost', 'recent'),
+                        help='一括チェックの処理順: input=指定順, cost=処理コストの大きい順, '
+                             'recent=更新日時の新しい順（既定: ワーカー使用時は cost、それ以外は input）')
+    parser.add_argument('--summary', metavar='PATH.xlsx',
+                        help='一括チェック時、報告書1件を1行（件数・文字数・スコア）にまとめた'
+                             'クラスごとの集計ブックを保存する')
+    parser.add_argument('--profile', default=os.environ.get('CHECK_EXCEL_PROFILE'),
+                        help='doctor で保存した診断結果。一括チェック時、指定しなかった '
+                             '--workers/--memory-limit/--reader に推奨値を使う'
+                             '（環境変数 CHECK_EXCEL_PROFILE でも指定可）')
+    parser.add_argument('--state', default=os.environ.get('CHECK_EXCEL_STATE'), metavar='DIR',
+                        help='1ファイルのチェック時、前回のセルの値と結果をこのフォルダに保存し、'
+                             '値が変わった項目だけを再チェックして前回からの変化を表示する'
+                             '（環境変数 CHECK_EXCEL_STATE でも指定可）')
+    parser.add_argument('--fix', action='store_true',
+                        help='チェックの代わりに、直し方が1通りに決まる誤字（とゆうこと→ということ 等）を'
+                             'ファイル内で直接修正する（フォルダ指定可）')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='--fix で修正内容を表示するだけで、ファイルは書き換えない')
+    parser.add_argument('--annotate', metavar='PATH',
+                        help='1ファイルのチェック時、指摘のあったセルに色とコメントを付けたコピーを保存する'
+                             '（チェックしたファイルと同じパスを指定すると上書き）')
+    parser.add_argument('--trace-memory', action='store_true',
+                        default=os.environ.get('CHECK_EXCEL_TRACE_MEMORY', '') not in ('', '0'),
+                        help='tracemalloc でファイルごとの最大割り当て量・割り当ての多い箇所・常駐メモリの推移を'
+                             '記録し、終了時に標準エラー出力へ表示する（チェックは遅くなる。'
+                             '環境変数 CHECK_EXCEL_TRACE_MEMORY でも指定可）')
+    add_metrics_arguments(parser)
+    parser.add_argument('--socket', default=os.environ.get('CHECK_EXCEL_SOCKET'),
+                        help='常駐サーバー（serve）のソケットパス。'
+                             '接続できない場合はこのプロセス内でチェックする'
+                             '（環境変数 CHECK_EXCEL_SOCKET でも指定可）')
+    return parser
+
+
+def apply_profile(args):
+    """診断結果の推奨設定を、コマンドラインで指定されていない項目にだけ適用する"""
+    from encoding_test import load_profile
+    recommended = load_profile(args.profile)
+    applied = []
+    if not args.pipeline and not args.workers and recommended.get('workers'):
+        args.workers = recommended['workers']
+        applied.append(f"ワーカー {args.workers}")
+    if args.memory_limit is None and recommended.get('memory_limit_mb') and not args.pipeline:
+        args.memory_limit = recommended['memory_limit_mb']
+        applied.append(f"メモリ上限 {args.memory_limit}MB")
+    if args.reader is None and recommended.get('reader'):
+        args.reader = recommended['reader']
+        applied.append(f"読み込み方式 {args.reader}")
+    if applied:
+        print(f"診断結果を適用しました（{args.profile}）: {', '.join(applied)}")
+
+
+def run_batch(validator, args, memory_trace=None, exporter=None):
+    from batch import BatchValidator, BatchJournal
+    
+    # ファイルごとの進捗表示は一括チェックでは1行の要約に置き換える
+    validator.verbose = False
+    if args.profile:
+        try:
+            apply_profile(args)
+        except (OSError, ValueError) as e:
+            print(f"エラー: 診断結果を読み込めません: {e}")
+            return 1
+    settings = batch_settings(args)
+    
+    journal = None
+    if args.journal:
+        try:
+            journal = BatchJournal(args.journal, settings, resume=args.resume)
+        except ValueError as e:
+            print(f"エラー: {e}")
+            return 1
+    
+    summary = None
+    if args.summary:
+        from batch_summary import SummaryWorkbook
+        summary = SummaryWorkbook(args.summary)
+    
+    batch = BatchValidator(validator, journal=journal, schedule=args.schedule, summary=summary,
+                           memory_trace=memory_trace, **settings)
+    if args.pipeline:
+        from batch_pipeline import PipelinePool
+        readers, analyzers = args.pipeline
+        batch.pool = PipelinePool(batch.worker_settings(), readers=readers, analyzers=analyzers)
+    elif args.workers or args.timeout or args.memory_limit:
+        # 制限時間・メモリ上限はワーカープロセス単位でしか適用できないため、ワーカーを使う
+        from batch_workers import IsolatedWorkerPool
+        batch.pool = IsolatedWorkerPool(batch.worker_settings(), workers=args.workers or 1,
+                                        timeout=args.timeout, memory_mb=args.memory_limit,
+                                        max_tasks=args.recycle)
+    try:
+        validator.validation_results = batch.run(args.files)
+    finally:
+        validator.shutdown()
+        if summary is not None:
+            # 中断した場合も、それまでに完了したファイルの行は保存する
+            summary.close()
+            print(f"集計ブックを保存しました: {args.summary}")
+        if memory_trace is not None:
+            memory_trace.report()
+        if exporter is not None:
+            exporter.close()
+    
+    if args.output:
+        validator.save_report(args.output)
+    
+    if batch.failed_count:
+        return 1
+    if (args.min_severity or args.fail_fast) and validator.validation_results:
+        return 2
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in SUBCOMMANDS:
+        import importlib
+        module_name, func_name = SUBCOMMANDS[argv[0]]
+        return getattr(importlib.import_module(module_name), func_name)(argv[1:])
+    
+    # 引数の解析を先に行い、--help や引数エラーではロケール確認等を行わない
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.pipeline and (args.workers or args.timeout or args.memory_limit):
+        parser.error('--pipeline は --workers/--timeout/--memory-limit と併用できません')
+    
+    if args.dry_run and not args.fix:
+        parser.error('--dry-run は --fix と組み合わせて指定してください')
+    if args.vocabulary and not os.path.isfile(args.vocabulary):
+        parser.error(f'語彙の索引が見つかりません: {args.vocabulary}')
+    if args.phrase_model and not os.path.isfile(args.phrase_model):
+        parser.error(f'文章モデルが見つかりません: {args.phrase_model}')
+    if args.skip:
+        from check_registry import all_checks
+        unknown = set(args.skip) - {spec.name for spec in all_checks()}
+        if unknown:
+            parser.error(f"不明なチェック名です: {', '.join(sorted(unknown))}（checks サブコマンドで一覧を表示）")
+    
+    setup_console_encoding()
+    
+    if args.fix:
+        from typo_fix import fix_reports
+        return fix_reports(args.files, dry_run=args.dry_run)
+    
+    validator = StudentReportValidatorCLI(jobs=args.jobs)
+    
+    memory_trace = None
+    if args.trace_memory:
+        from memory_trace import MemoryTrace
+        memory_trace = MemoryTrace()
+    
+    exporter = None
+    if args.metrics_file or args.metrics_port:
+        from metrics import start_export
+        try:
+            exporter = start_export(args)
+        except OSError as e:
+            print(f"エラー: メトリクスの出力を開始できません: {e}")
+            return 1
+    
+    if (len(args.files) > 1 or os.path.isdir(args.files[0]) or args.files[0].lower().endswith('.zip')
+            or args.near_duplicates or args.journal or args.summary or args.history):
+        return run_batch(validator, args, memory_trace, exporter)
+    
+    options = dict(check_options(args), reader=args.reader)
+    
+    from contextlib import nullcontext
+    success = None
+    with memory_trace.track(args.files[0]) if memory_trace is not None else nullcontext():
+        if args.state and not args.fail_fast:
+            # 前回からの差分だけを再チェックする（早期終了とは両立しないため、その場合は通常どおり）
+            from incremental import IncrementalChecker
+            try:
+                success = IncrementalChecker(validator, args.state).validate_file(args.files[0], **options)
+            finally:
+                validator.shutdown()
+        elif args.socket and memory_trace is None:
+            # 常駐サーバーが起動していればチェックを委譲する（openpyxl を読み込まずに済む）
+            from validator_server import check_via_server
+            success = check_via_server(validator, args.socket, args.files[0], options)
+        if success is None:
+            try:
+                success = validator.validate_file(args.files[0], **options)
+            finally:
+                validator.shutdown()
+    if memory_trace is not None:
+        memory_trace.report()
+    if exporter is not None:
+        exporter.close()
     
     if success and args.output:
         validator.save_report(args.output)
+    
+    if success and args.annotate:
+        from annotate import annotate_report
+        try:
+            count = annotate_report(args.files[0], args.annotate, validator.validation_results)
+        except Exception as e:
+            print(f"エラー: チェック結果を書き込めません: {e}")
+            return 1
+        print(f"チェック結果を書き込みました: {args.annotate}（{count}セル）")
         
-    return 0 if success else 1
+    if not success:
+        return 1
+    if (args.min_severity or args.fail_fast) and validator.validation_results:
+        return 2
+    return 0
 
 
 if __name__ == "__main__":
+    # 他のモジュールの import excel_validator_cli で、このファイルを別のモジュールとして読み込み直さない
+    sys.modules.setdefault('excel_validator_cli', sys.modules[__name__])
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+生徒ごとの過去の報告書の索引（期をまたいだ比較用）
+報告書のシート名（例: 2022夏期）とファイル名から期と生徒を判定し、テストスコアと
+文章項目の特徴（文字数・正規化した文章のハッシュ）を生徒ごとのファイルに保存します。
+一括チェックで --history を指定すると、前の期の記録と比較するチェックを追加します。
+
+- 前の期と同じ文章（コピーしたまま更新していない項目）: 警告
+- 前の期に立てた目標に今回の結果が届いていない科目:      情報
+
+索引のフォルダ:
+  manifest.jsonl        登録済みの報告書（1行1件、追記のたびに fsync）
+  students/<hash>.json  生徒ごとの期別の記録（生徒名のハッシュで直接開くため、件数に関わらず1回の読み込み）
+
+索引の作成はファイルのサイズと更新日時で登録済みかを判定するため、何年分のフォルダを
+指定しても追加・変更された報告書だけを読み込み、途中で中断しても続きから再開できます。
+
+  python3 excel_validator_cli.py history build 索引フォルダ 2019年度/ 2020年度/ ...
+  python3 excel_validator_cli.py history show 索引フォルダ 佐藤
+  python3 excel_validator_cli.py 報告書フォルダ/ --history 索引フォルダ
+"""
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+from excel_validator_cli import SCORE_CELLS, TEXT_SECTIONS
+
+INDEX_VERSION = 1
+
+# 期の表記: 年（西暦）と講習・学期。年のみの場合は同じ年の中で最も前の期として扱う
+TERM_PATTERN = re.compile(r'((?:19|20)\d{2})\s*年?度?\s*(春期|夏期|冬期|前期|後期|[123]学期)?')
+TERM_ORDER = {'春期': 1, '1学期': 1, '前期': 1, '夏期': 2, '2学期': 3, '後期': 3, '冬期': 4, '3学期': 4}
+# 生徒名を取り出す際の区切り: ファイル名のうち期や「報告書」より前を生徒名とする
+# （例: 宮下綾介2023夏期現状報告書-前川.xlsx の「-前川」は担当講師名）
+REPORT_WORD = re.compile(r'(?:生徒)?(?:現状)?報告書')
+NAME_NOISE = re.compile(r'[_\-\s・()（）\[\]【】]+')
+
+# 前の期の目標と比較する科目: 今回の結果のラベル -> 前の期の目標のラベル
+GOAL_PAIRS = {label: label.replace('_結果', '_目標') for label in SCORE_CELLS
+              if label.endswith('_結果') and label.replace('_結果', '_目標') in SCORE_CELLS}
+
+
+def parse_term(text):
+    """文字列から期を探し、(表示名, 並び順のキー) を返す（見つからない場合は None）"""
+    if not text:
+        return None
+    match = TERM_PATTERN.search(unicodedata.normalize('NFKC', text))
+    if match is None:
+        return None
+    year, season = match.group(1), match.group(2) or ''
+    return f"{year}{season}", [int(year), TERM_ORDER.get(season, 0)]
+
+
+def identify(key: str, title):
+    """
+    報告書のキー（パス、zip内なら アーカイブ!メンバー）とシート名から (生徒名, 期) を返す。
+    期はシート名・ファイル名・パス（フォルダ名）の順に探す。判定できなければ None。
+    """
+    path = key.replace('\\', '/')
+    filename = path.rpartition('!')[2].rpartition('/')[2]
+    term = parse_term(title) or parse_term(filename) or parse_term(path)
+    stem = unicodedata.normalize('NFKC', os.path.splitext(filename)[0])
+    head = REPORT_WORD.split(TERM_PATTERN.split(stem, 1)[0], 1)[0]
+    # 期や「報告書」がファイル名の先頭にある場合は、それらを除いた残りを生徒名とする
+    student = (NAME_NOISE.sub('', head)
+               or NAME_NOISE.sub('', REPORT_WORD.sub('', TERM_PATTERN.sub('', stem))))
+    if term is None or not student:
+        return None
+    return student, term
+
+
+def text_digest(text):
+    """空白の違いを無視して文章を比較するためのハッシュ"""
+    normalized = re.sub(r'\s+', '', unicodedata.normalize('NFKC', str(text)))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16] if normalized else None
+
+
+def term_record(key: str, term, snapshot) -> dict:
+    """索引に保存する1期分の記録（スコアと文章項目の特徴）"""
+    label, order = term
+    scores = {}
+    for score_label, (row, col) in SCORE_CELLS.items():
+        value = snapshot.cell(row=row, column=col).value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            scores[score_label] = value
+    texts = {}
+    for section_name, (row, col, _, _) in TEXT_SECTIONS.items():
+        content = snapshot.cell(row=row, column=col).value
+        if content:
+            texts[section_name] = {'length': len(str(content)), 'digest': text_digest(content)}
+    return {'source': key, 'term': label, 'order': order, 'scores': scores, 'texts': texts}
+
+
+class HistoryIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.students_dir = os.path.join(directory, 'students')
+        self.manifest_path = os.path.join(directory, 'manifest.jsonl')
+
+    def student_path(self, student: str) -> str:
+        digest = hashlib.sha1(student.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.students_dir, f"{digest}.json")
+
+    def lookup(self, student: str) -> dict:
+        """生徒の期別の記録 {期: 記録} を返す（未登録なら空）"""
+        try:
+            with open(self.student_path(student), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION or data.get('student') != student:
+            return {}
+        return data['terms']
+
+    def previous(self, student: str, order):
+        """指定した期より前で最も新しい期の記録を返す（なければ None）"""
+        earlier = [record for record in self.lookup(student).values() if record['order'] < order]
+        return max(earlier, key=lambda record: record['order']) if earlier else None
+
+    def add(self, student: str, record: dict):
+        """期の記録を生徒のファイルに追加する（同じ期の記録は置き換える）"""
+        os.makedirs(self.students_dir, exist_ok=True)
+        terms = self.lookup(student)
+        terms[record['term']] = record
+        path = self.student_path(student)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'student': student, 'terms': terms}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def load_manifest(self) -> dict:
+        """登録済みの報告書 {キー: [サイズ, 更新日時]}（書き込み途中で終わった最後の行は切り捨てる）"""
+        indexed = {}
+        if not os.path.exists(self.manifest_path):
+            return indexed
+        valid_size = 0
+        with open(self.manifest_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                indexed[record['source']] = record['stamp']
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.manifest_path):
+            with open(self.manifest_path, 'r+b') as f:
+                f.truncate(valid_size)
+        return indexed
+
+    def check(self, key: str, snapshot):
+        """前の期の記録と比較した結果のリストを返す（前の期の記録がなければ空）"""
+        identity = identify(key, snapshot.title)
+        if identity is None:
+            return []
+        student, (label, order) = identity
+        previous = self.previous(student, order)
+        if previous is None:
+            return []
+
+        results = []
+        current = term_record(key, (label, order), snapshot)
+        for section_name, features in current['texts'].items():
+            before = previous['texts'].get(section_name)
+            if before and features['digest'] == before['digest']:
+                results.append({
+                    'item': f"履歴 - {section_name}",
+                    'type': '前回と同じ文章',
+                    'severity': '警告',
+                    'detail': f"前回（{previous['term']}）の{section_name}と同じ文章です。今回の内容に更新してください"
+                })
+        for result_label, goal_label in GOAL_PAIRS.items():
+            result = current['scores'].get(result_label)
+            goal = previous['scores'].get(goal_label)
+            if result is not None and goal is not None and result < goal:
+                results.append({
+                    'item': f"履歴 - {result_label}",
+                    'type': '前回目標との比較',
+                    'severity': '情報',
+                    'detail': f"前回（{previous['term']}）の目標 {goal}点に対し、今回の結果は {result}点です"
+                })
+        return results
+
+
+def source_stamps(sources):
+    """報告書ごとの (サイズ, 更新日時)。zip内のメンバーはアーカイブに記録された値を使う"""
+    import zipfile
+    archives = {}
+    for source in sources:
+        try:
+            if source.member is None:
+                stat = os.stat(source.path)
+                yield source, [stat.st_size, int(stat.st_mtime)]
+                continue
+            if source.path not in archives:
+                with zipfile.ZipFile(source.path) as archive:
+                    archives = {source.path: {info.filename: [info.file_size, list(info.date_time)]
+                                              for info in archive.infolist()}}
+            yield source, archives[source.path][source.member]
+        except (OSError, KeyError, zipfile.BadZipFile):
+            yield source, None
+
+
+def build_index(directory: str, paths, reader='stream') -> int:
+    """報告書を索引に登録する（登録済みで変更のないものは読み込まない）。終了コードを返す"""
+    from batch import BatchValidator, iter_report_sources
+
+    index = HistoryIndex(directory)
+    os.makedirs(directory, exist_ok=True)
+    indexed = index.load_manifest()
+    batch = BatchValidator(None, options={}, reader=reader)
+    added = skipped = unknown = failed = 0
+    try:
+        with open(index.manifest_path, 'a', encoding='utf-8') as manifest:
+            for source, stamp in source_stamps(iter_report_sources(paths)):
+                if stamp is not None and indexed.get(source.key) == stamp:
+                    skipped += 1
+                    continue
+                try:
+                    snapshot = batch.read_snapshot(source)
+                except Exception as e:
+                    print(f"エラー: {source.key}: {e}")
+                    failed += 1
+                    continue
+                identity = identify(source.key, snapshot.title)
+                if identity is None:
+                    print(f"スキップ: {source.key}（生徒名または期を判定できません）")
+                    unknown += 1
+                else:
+                    student, term = identity
+                    index.add(student, term_record(source.key, term, snapshot))
+                    added += 1
+                # 生徒のファイルを更新してから記録するため、中断しても登録漏れは起きない
+                manifest.write(json.dumps({'source': source.key, 'stamp': stamp}, ensure_ascii=False) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+                if (added + unknown) % 500 == 0:
+                    print(f"  {added + unknown}件 処理済み...")
+    finally:
+        batch.archives.close()
+    print(f"\n索引を更新しました: 追加 {added}件 / 登録済み {skipped}件 / 判定不可 {unknown}件 / エラー {failed}件")
+    return 1 if failed else 0
+
+
+def show_student(directory: str, student: str) -> int:
+    terms = HistoryIndex(directory).lookup(unicodedata.normalize('NFKC', student))
+    if not terms:
+        print(f"索引に記録がありません: {student}")
+        return 1
+    for record in sorted(terms.values(), key=lambda record: record['order']):
+        scores = record['scores']
+        goals = ', '.join(f"{label[:-3]} {scores[label]}→{scores.get(result_label, '-')}"
+                          for result_label, label in GOAL_PAIRS.items() if label in scores)
+        print(f"{record['term']}: {record['source']}")
+        print(f"  目標→結果: {goals or '-'}")
+        lengths = ', '.join(f"{name} {features['length']}" for name, features in record['texts'].items())
+        print(f"  文字数: {lengths or '-'}")
+    return 0
+
+
+def history_main(argv=None):
+    import argparse
+    from excel_validator_cli import READERS, setup_console_encoding
+
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py history',
+                                     description='生徒ごとの過去の報告書の索引（期をまたいだ比較用）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='報告書を索引に登録する（追加・変更されたものだけ読み込む）')
+    build.add_argument('index', help='索引のフォルダ')
+    build.add_argument('files', nargs='+', help='報告書のファイル・フォルダ・zipアーカイブ')
+    build.add_argument('--reader', choices=READERS, default='stream', help='読み込み方式（既定: stream）')
+    show = subparsers.add_parser('show', help='生徒の期別の記録を表示する')
+    show.add_argument('index', help='索引のフォルダ')
+    show.add_argument('student', help='生徒名（ファイル名から判定したもの）')
+    args = parser.parse_args(argv)
+
+    setup_console_encoding()
+    if args.command == 'build':
+        try:
+            return build_index(args.index, args.files, reader=args.reader)
+        except KeyboardInterrupt:
+            print("\n中断しました（次回は続きから登録します）")
+            return 130
+    return show_student(args.index, args.student)
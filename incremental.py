@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+差分による再チェック
+前回チェックした時のセルの値と結果をファイルごとに保存しておき、次回は値が変わった
+セルに関係するチェックだけを実行し直します。変わっていないセルの結果は前回の結果を
+そのまま引き継ぎ、前回からの変化（新規・解消・変化なし）を表示します。
+
+各チェックの結果は「テストスコア」全体か、文章項目1つの値だけで決まるため、
+結果の項目名からどの単位（スコア欄 / 各文章項目）の結果かを判定して入れ替えます。
+
+  python3 excel_validator_cli.py 報告書.xlsx --state .check_excel_state
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import metrics
+from excel_validator_cli import SCORE_CELLS, TEXT_SECTIONS
+
+STATE_VERSION = 1
+
+# チェックの単位: スコア欄全体と、文章項目ごと
+SCORES_UNIT = 'テストスコア'
+UNITS = {SCORES_UNIT: tuple(SCORE_CELLS.values())}
+UNITS.update({name: ((row, col),) for name, (row, col, _, _) in TEXT_SECTIONS.items()})
+UNIT_ORDER = {unit: position for position, unit in enumerate(UNITS)}
+SECTION_BY_CELL = {(row, col): name for name, (row, col, _, _) in TEXT_SECTIONS.items()}
+
+# 結果の項目名の接頭辞 -> 組み込みチェックの実行順（check_registry のコストの安い順）
+CHECK_ORDER = {'テストスコア': 0, '文章内容': 1, '誤字脱字': 2, '内容確認': 3}
+CELL_ITEM = re.compile(r'セル\((\d+), (\d+)\)')
+
+# 差分の判定に関係しない（結果が変わらない）オプション
+IGNORED_OPTIONS = ('reader', 'fail_fast')
+# ファイルを参照するオプション。同じパスのまま作り直されると結果が変わるため、更新時刻とサイズも保存する
+FILE_OPTIONS = ('vocabulary', 'phrase_model')
+
+
+def result_unit(result):
+    """結果がどの単位のセルから出たものかを返す（判定できない場合は None）"""
+    prefix, _, rest = result['item'].partition(' - ')
+    if prefix not in CHECK_ORDER:
+        return None
+    if prefix == 'テストスコア':
+        return SCORES_UNIT
+    match = CELL_ITEM.fullmatch(rest)
+    if match:
+        return SECTION_BY_CELL.get((int(match.group(1)), int(match.group(2))))
+    return rest if rest in TEXT_SECTIONS else None
+
+
+def result_order(result):
+    return CHECK_ORDER[result['item'].partition(' - ')[0]], UNIT_ORDER[result_unit(result)]
+
+
+def fingerprint(value) -> str:
+    """セルの値の比較用の文字列（JSONで保存できない値は文字列にする）"""
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def state_settings(settings: dict) -> dict:
+    """前回の状態を使えるかの判定に使う設定（参照するファイルの更新時刻とサイズを加える）"""
+    stamps = {}
+    for option in FILE_OPTIONS:
+        if settings.get(option):
+            info = os.stat(settings[option])
+            stamps[option] = [info.st_mtime_ns, info.st_size]
+    return dict(settings, file_stamps=stamps) if stamps else settings
+
+
+def finding_key(result):
+    return result['item'], result['type'], result['severity'], result['detail']
+
+
+def compare_findings(previous, current):
+    """前回と今回の結果を比べ、(新規, 解消, 変化なし) のリストを返す（同じ結果の重複も数える）"""
+    remaining = {}
+    for position, result in enumerate(previous):
+        remaining.setdefault(finding_key(result), []).append(position)
+    new, unchanged = [], []
+    for result in current:
+        positions = remaining.get(finding_key(result))
+        if positions:
+            positions.pop(0)
+            unchanged.append(result)
+        else:
+            new.append(result)
+    resolved = [previous[position]
+                for position in sorted(p for positions in remaining.values() for p in positions)]
+    return new, resolved, unchanged
+
+
+class IncrementalChecker:
+    def __init__(self, validator, state_dir: str):
+        """
+        validator: StudentReportValidatorCLI
+        state_dir: ファイルごとの前回の値と結果を保存するフォルダ
+        """
+        self.validator = validator
+        self.state_dir = state_dir
+        self.changed_units = []
+        self.delta = None
+
+    def state_path(self, file_path: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.state_dir, f"{digest}.json")
+
+    def load_state(self, file_path: str, settings: dict):
+        try:
+            with open(self.state_path(file_path), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('version') != STATE_VERSION or state.get('settings') != settings:
+            return None
+        return state
+
+    def save_state(self, file_path: str, state: dict):
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self.state_path(file_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def run_checks(self, file_path: str, reader=None, **options):
+        """
+        前回から値が変わった単位のチェックだけを実行し、全体の結果を返す。
+        options は check_sheet の引数（fail_fast は差分と両立しないため無視する）。
+        """
+        from check_registry import snapshot_cells
+        from report_reader import open_report, CellSnapshot
+
+        options.pop('fail_fast', None)
+        settings = {key: value for key, value in options.items() if key not in IGNORED_OPTIONS}
+        with metrics.stage('read'):
+            sheet = open_report(file_path, reader or 'stream')
+            try:
+                snapshot = CellSnapshot.capture(sheet, snapshot_cells())
+            finally:
+                sheet.close()
+
+        values = {unit: [fingerprint(snapshot.cell(row=row, column=col).value) for row, col in cells]
+                  for unit, cells in UNITS.items()}
+        saved_settings = state_settings(settings)
+        state = self.load_state(file_path, saved_settings)
+        previous = state['results'] if state else None
+        # 前回に単位を判定できない結果があった場合は、そのチェックが参照するセルの変化を
+        # 追えないため毎回全体をチェックする（前回との比較には使う）
+        unknown = previous is not None and any(result_unit(result) is None for result in previous)
+
+        if previous is None or unknown:
+            changed = list(UNITS)
+        else:
+            changed = [unit for unit in UNITS if state['values'].get(unit) != values[unit]]
+
+        if changed:
+            # 変わった単位のセルだけを入れたスナップショットでチェックし、その単位の結果だけを採用する
+            cells = {cell: snapshot.cell(row=cell[0], column=cell[1]).value
+                     for unit in changed for cell in UNITS[unit]}
+            self.validator.log(f"\n再チェックする項目: {', '.join(changed)}")
+            fresh = None if unknown else self.validator.check_sheet(CellSnapshot(cells), **settings)
+            if fresh is None or any(result_unit(result) is None for result in fresh):
+                # 単位を判定できない結果（追加したチェックの結果など）がある場合は全体をチェックし直し、
+                # 結果をすべて採用する
+                changed = list(UNITS)
+                results = list(self.validator.check_sheet(snapshot, **settings))
+            else:
+                results = [result for result in fresh if result_unit(result) in changed]
+                if previous is not None:
+                    results += [result for result in previous if result_unit(result) not in changed]
+                results.sort(key=result_order)
+        else:
+            self.validator.log("\n前回から変更されたセルはありません")
+            results = list(previous)
+
+        self.changed_units = changed
+        # 前回の結果を使い回した単位をキャッシュの利用として数える
+        metrics.inc('check_excel_cache_requests_total', len(UNITS) - len(changed), cache='incremental', result='hit')
+        metrics.inc('check_excel_cache_requests_total', len(changed), cache='incremental', result='miss')
+        metrics.record_results(results)
+        self.delta = compare_findings(previous or [], results) if previous is not None else None
+        self.save_state(file_path, {'version': STATE_VERSION, 'file': os.path.abspath(file_path),
+                                    'settings': saved_settings, 'values': values, 'results': results})
+        self.validator.validation_results = results
+        return results
+
+    def validate_file(self, file_path: str, **options) -> bool:
+        """validate_file と同じく結果を表示し、前回からの変化も表示する"""
+        if not os.path.exists(file_path):
+            print(f"エラー: ファイルが見つかりません: {file_path}")
+            return False
+        try:
+            self.validator.log(f"\nファイルを検証中: {file_path}")
+            self.validator.log("=" * 80)
+            self.run_checks(file_path, **options)
+        except Exception as e:
+            print(f"エラー: ファイルの読み込み中にエラーが発生しました:\n{str(e)}")
+            return False
+        self.validator.display_results()
+        self.display_delta()
+        return True
+
+    def display_delta(self):
+        if self.delta is None:
+            print("\n（初回のチェックのため、前回との比較はありません）")
+            return
+        new, resolved, unchanged = self.delta
+        print(f"\n前回からの変化: 新規 {len(new)}件 / 解消 {len(resolved)}件 / 変化なし {len(unchanged)}件")
+        for label, results in (('新規', new), ('解消', resolved)):
+            for result in results:
+                print(f"  [{label}] {result['item']}: {result['detail']}")
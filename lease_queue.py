@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共有フォルダを使った分散一括チェック
+複数のマシン（または同じマシンの複数プロセス）のワーカーが、共有フォルダ上のキューから
+ファイルを1件ずつ取り出してチェックし、結果をキューの隣に書き出します。
+最後に collect で結果を入力順にまとめ、通常の一括チェックと同じ形で出力します。
+
+  python3 excel_validator_cli.py enqueue キュー 報告書フォルダ/ [チェック条件]
+  python3 excel_validator_cli.py worker キュー      （各マシンで必要な数だけ起動）
+  python3 excel_validator_cli.py collect キュー -o 結果.json
+
+キューの構成:
+  settings.json            チェック条件（BatchValidator の設定）
+  pending/00000000.json    未処理のタスク
+  leased/00000000.json@ホスト名-PID   処理中のタスク（リース）
+  results/00000000.json    完了したタスクのエントリ
+
+タスクの取得は pending/ から leased/ への os.rename で行い、同じタスクを取得できるのは
+1つのワーカーだけです。処理中はリースの更新時刻を定期的に更新し、一定時間更新されない
+リース（ワーカーの停止・マシンの故障）は他のワーカーが pending/ に戻して処理し直します。
+そのため1つのタスクが2回処理されることはありえますが、結果は同じ内容で上書きされます。
+リースの期限は共有フォルダ上の更新時刻で判定するため、各マシンの時計は合わせておいてください。
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import metrics
+from excel_validator_cli import add_check_arguments, add_metrics_arguments, batch_settings
+
+QUEUE_VERSION = 1
+SETTINGS_FILE = 'settings.json'
+PENDING_DIR = 'pending'
+LEASED_DIR = 'leased'
+RESULTS_DIR = 'results'
+LEASE_SEPARATOR = '@'
+
+# リースの既定の有効期間（秒）。処理中はこの1/3ごとに更新する
+DEFAULT_LEASE_SECONDS = 300
+
+
+def write_json_atomic(path: str, data: dict):
+    """一時ファイルに書いてから置き換え、他のプロセスが書きかけの内容を読まないようにする"""
+    temp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_json(path: str):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class LeaseQueue:
+    def __init__(self, path: str):
+        self.path = path
+        self.pending_dir = os.path.join(path, PENDING_DIR)
+        self.leased_dir = os.path.join(path, LEASED_DIR)
+        self.results_dir = os.path.join(path, RESULTS_DIR)
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+
+    def settings_path(self):
+        return os.path.join(self.path, SETTINGS_FILE)
+
+    def load_settings(self) -> dict:
+        try:
+            record = read_json(self.settings_path())
+        except FileNotFoundError:
+            raise ValueError(f"キューが見つかりません: {self.path}（先に enqueue を実行してください）")
+        if record.get('queue') != QUEUE_VERSION:
+            raise ValueError(f"キューの形式が違います: {self.path}")
+        return record
+
+    def create(self, settings: dict, sources) -> int:
+        """タスクを書き出してからチェック条件を置き、ワーカーが途中の状態を見ないようにする"""
+        if os.path.exists(self.settings_path()):
+            raise ValueError(f"キューが既に存在します: {self.path}")
+        for directory in (self.pending_dir, self.leased_dir, self.results_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        count = 0
+        for index, source in enumerate(sources):
+            write_json_atomic(os.path.join(self.pending_dir, f"{index:08d}.json"), {
+                'index': index,
+                'key': source.key,
+                # 他のマシンからも同じパスで参照できるよう絶対パスにしておく
+                'path': os.path.abspath(source.path),
+                'member': source.member,
+            })
+            count += 1
+        write_json_atomic(self.settings_path(), {'queue': QUEUE_VERSION, 'settings': settings,
+                                                 'tasks': count})
+        return count
+
+    def lease_path(self, name: str) -> str:
+        return os.path.join(self.leased_dir, f"{name}{LEASE_SEPARATOR}{self.owner}")
+
+    def claim(self):
+        """未処理のタスクを1件取得する。取得できたら (タスク名, リースのパス) を返す"""
+        for name in sorted(os.listdir(self.pending_dir)):
+            if not name.endswith('.json'):
+                continue
+            lease_path = self.lease_path(name)
+            try:
+                os.rename(os.path.join(self.pending_dir, name), lease_path)
+            except FileNotFoundError:
+                # 他のワーカーが先に取得した
+                continue
+            # 取得した時点を更新時刻にする（rename では更新時刻が変わらない）
+            os.utime(lease_path)
+            return name, lease_path
+        return None
+
+    def release(self, name: str, lease_path: str):
+        """処理を中断したタスクを pending/ に戻す"""
+        try:
+            os.rename(lease_path, os.path.join(self.pending_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, name: str, lease_path: str, entry: dict):
+        write_json_atomic(os.path.join(self.results_dir, name), entry)
+        try:
+            os.remove(lease_path)
+        except FileNotFoundError:
+            # 期限切れで他のワーカーに回収された（そちらも同じ結果を書く）
+            pass
+
+    def reclaim_expired(self, lease_seconds: float) -> int:
+        """期限切れのリースを pending/ に戻す（結果が既にあるものはリースだけ消す）"""
+        reclaimed = 0
+        now = time.time()
+        for lease_name in os.listdir(self.leased_dir):
+            name, separator, _ = lease_name.partition(LEASE_SEPARATOR)
+            if not separator:
+                continue
+            lease_path = os.path.join(self.leased_dir, lease_name)
+            try:
+                if now - os.stat(lease_path).st_mtime < lease_seconds:
+                    continue
+                if os.path.exists(os.path.join(self.results_dir, name)):
+                    os.remove(lease_path)
+                else:
+                    os.rename(lease_path, os.path.join(self.pending_dir, name))
+                    reclaimed += 1
+            except FileNotFoundError:
+                continue
+        return reclaimed
+
+    def has_leases(self) -> bool:
+        return any(LEASE_SEPARATOR in name for name in os.listdir(self.leased_dir))
+
+    def status(self):
+        """(未処理, 処理中, 完了) の件数"""
+        def count(directory):
+            return sum(1 for name in os.listdir(directory) if not name.endswith('.tmp'))
+        return count(self.pending_dir), count(self.leased_dir), count(self.results_dir)
+
+    def iter_results(self):
+        """完了したタスクを (番号, エントリ) として番号順に返す"""
+        for name in sorted(os.listdir(self.results_dir)):
+            if name.endswith('.json'):
+                yield int(name[:-len('.json')]), read_json(os.path.join(self.results_dir, name))
+
+
+class LeaseHeartbeat:
+    """処理中のリースの更新時刻を定期的に更新するスレッド"""
+
+    def __init__(self, lease_path: str, interval: float):
+        self.lease_path = lease_path
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.lease_path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_worker(queue: LeaseQueue, lease_seconds=DEFAULT_LEASE_SECONDS, poll=2.0,
+               timeout=None, memory_mb=None):
+    """
+    キューが空になり、他のワーカーの処理中のタスクもなくなるまでタスクを処理する。
+    他のワーカーのリースが期限切れになった場合はそのタスクも引き取る。
+    制限時間・メモリ上限を指定した場合は、ワーカープロセスを1つ起動してリースしたタスクを
+    順に渡す（ファイルごとに新しいプロセスは起動しない）。
+    戻り値: 処理した件数
+    """
+    from excel_validator_cli import StudentReportValidatorCLI
+    from batch import BatchValidator, ReportSource, error_entry
+
+    settings = queue.load_settings()['settings']
+    batch = BatchValidator(StudentReportValidatorCLI(verbose=False), **settings)
+    # チェック中のタスク: タスク名 -> (リースのパス, LeaseHeartbeat)
+    leases = {}
+
+    def leased_tasks():
+        while True:
+            claimed = queue.claim()
+            if claimed is None:
+                if queue.reclaim_expired(lease_seconds):
+                    continue
+                if not queue.has_leases():
+                    return
+                time.sleep(poll)
+                continue
+
+            name, lease_path = claimed
+            if metrics.enabled:
+                # 共有フォルダの一覧を取るため、メトリクスの出力先を指定した場合のみ数える
+                metrics.set_gauge('check_excel_queue_depth', queue.status()[0], queue='lease')
+            try:
+                task = read_json(lease_path)
+            except BaseException:
+                queue.release(name, lease_path)
+                raise
+            heartbeat = LeaseHeartbeat(lease_path, lease_seconds / 3)
+            heartbeat.start()
+            leases[name] = (lease_path, heartbeat)
+            yield name, ReportSource(task['key'], task['path'], task['member'])
+
+    def check_in_process(tasks):
+        for name, source in tasks:
+            try:
+                entry = batch.validate_one(source)
+            except MemoryError:
+                entry = error_entry(source.key, 'メモリ不足', "メモリ不足のためチェックを中止しました")
+            yield name, entry
+
+    if timeout or memory_mb:
+        from batch_workers import IsolatedWorkerPool
+        pool = IsolatedWorkerPool(batch.worker_settings(), timeout=timeout, memory_mb=memory_mb)
+        results = pool.run(leased_tasks())
+    else:
+        results = check_in_process(leased_tasks())
+
+    processed = 0
+    try:
+        for name, entry in results:
+            lease_path, heartbeat = leases.pop(name)
+            heartbeat.stop()
+            completed = False
+            try:
+                queue.complete(name, lease_path, entry)
+                completed = True
+                metrics.record_entry(entry)
+            finally:
+                if not completed:
+                    queue.release(name, lease_path)
+            processed += 1
+            note = '（リース期限切れ後に完了）' if heartbeat.lost else ''
+            print(f"[{queue.owner}] {entry['file']}{note}", flush=True)
+    finally:
+        # 中断した場合はワーカープロセスを止め、チェック中だったタスクを pending/ に戻す
+        results.close()
+        for name, (lease_path, heartbeat) in leases.items():
+            heartbeat.stop()
+            queue.release(name, lease_path)
+        batch.archives.close()
+        batch.validator.shutdown()
+    return processed
+
+
+def enqueue_main(argv=None):
+    import argparse
+    from batch import iter_report_sources
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py enqueue',
+                                     description='分散一括チェックのキューを作成')
+    parser.add_argument('queue', help='キューを作成するフォルダ（全ワーカーから同じパスで参照できる共有フォルダ）')
+    parser.add_argument('files', nargs='+', metavar='file', help='チェックするファイル・フォルダ・zipアーカイブ')
+    add_check_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from excel_validator_cli import setup_console_encoding
+    setup_console_encoding()
+    queue = LeaseQueue(args.queue)
+    try:
+        count = queue.create(batch_settings(args), iter_report_sources(args.files))
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}")
+        return 1
+    print(f"{count}件のタスクをキューに登録しました: {args.queue}")
+    return 0
+
+
+def worker_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py worker',
+                                     description='キューのタスクを処理するワーカーを起動')
+    parser.add_argument('queue', help='enqueue で作成したキューのフォルダ')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, metavar='SECONDS',
+                        help=f'更新が途絶えたリースを他のワーカーが引き取るまでの秒数（既定: {DEFAULT_LEASE_SECONDS}）')
+    parser.add_argument('--poll', type=float, default=2.0, metavar='SECONDS',
+                        help='他のワーカーの処理中タスクを待つ間の確認間隔（既定: 2秒）')
+    parser.add_argument('--timeout', type=float,
+                        help='1ファイルあたりの制限時間（秒）。指定すると別プロセスでチェックする')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='チェックするプロセスの仮想メモリ上限（MB、Unixのみ）')
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from excel_validator_cli import setup_console_encoding
+    setup_console_encoding()
+
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # SIGTERM でも処理中のタスクを pending/ に戻してから終了する
+    signal.signal(signal.SIGTERM, stop)
+
+    queue = LeaseQueue(args.queue)
+    try:
+        exporter = metrics.start_export(args)
+    except OSError as e:
+        print(f"エラー: メトリクスの出力を開始できません: {e}")
+        return 1
+    try:
+        processed = run_worker(queue, lease_seconds=args.lease, poll=args.poll,
+                               timeout=args.timeout, memory_mb=args.memory_limit)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        return 1
+    except KeyboardInterrupt:
+        print(f"[{queue.owner}] 中断しました")
+        return 130
+    finally:
+        if exporter is not None:
+            exporter.close()
+    print(f"[{queue.owner}] {processed}件を処理しました")
+    return 0
+
+
+def collect_main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py collect',
+                                     description='キューの結果をまとめて一括チェックの結果を出力')
+    parser.add_argument('queue', help='enqueue で作成したキューのフォルダ')
+    parser.add_argument('-o', '--output', help='結果を保存するファイル名（.txt or .json）')
+    parser.add_argument('--summary', metavar='PATH.xlsx', help='クラスごとの集計ブックを保存する')
+    args = parser.parse_args(argv)
+
+    from excel_validator_cli import StudentReportValidatorCLI, setup_console_encoding
+    from batch import BatchValidator
+
+    setup_console_encoding()
+    queue = LeaseQueue(args.queue)
+    try:
+        record = queue.load_settings()
+    except ValueError as e:
+        print(f"エラー: {e}")
+        return 1
+    settings = record['settings']
+
+    summary = None
+    if args.summary:
+        from batch_summary import SummaryWorkbook
+        summary = SummaryWorkbook(args.summary)
+
+    validator = StudentReportValidatorCLI(verbose=False)
+    batch = BatchValidator(validator, summary=summary, **settings)
+    for index, entry in queue.iter_results():
+        batch.record(index, entry)
+    if summary is not None:
+        summary.close()
+        print(f"集計ブックを保存しました: {args.summary}")
+    batch.finish()
+    batch.display_summary()
+    validator.validation_results = batch.results
+
+    pending, leased, done = queue.status()
+    incomplete = record['tasks'] - done
+    if incomplete:
+        print(f"警告: 未完了のタスクが {incomplete}件あります（未処理 {pending}件, 処理中 {leased}件）")
+
+    if args.output:
+        validator.save_report(args.output)
+
+    if batch.failed_count or incomplete:
+        return 1
+    options = settings['options']
+    if (options.get('min_severity') or options.get('fail_fast')) and batch.results:
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    commands = {'enqueue': enqueue_main, 'worker': worker_main, 'collect': collect_main}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(f"使い方: {sys.argv[0]} {{{','.join(commands)}}} ...")
+        sys.exit(1)
+    sys.exit(commands[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+メモリ使用量の計測（--trace-memory / 環境変数 CHECK_EXCEL_TRACE_MEMORY）
+tracemalloc でファイルごとのチェック中の最大割り当て量と、チェック後に残った割り当て量を記録し、
+あわせて常駐メモリ（RSS）の推移を記録します。終了時（常駐サーバーは要求ごとにも）に、
+割り当ての多い箇所（計測開始時からの増加）とともに表示します。
+
+常駐サーバーや GUI のように長時間動かす場合でも記録が増え続けないよう、
+ファイルごとの値は件数・合計・最大と、RSS の回帰直線の和だけを保持します。
+最初のファイルの値には、初回のチェック時に読み込むモジュール（openpyxl 等）の分が含まれます。
+tracemalloc を有効にするとチェックが2〜3倍遅くなるため、調査時のみ使ってください。
+
+  python3 excel_validator_cli.py 報告書フォルダ/ --trace-memory
+  python3 excel_validator_cli.py serve --trace-memory
+  CHECK_EXCEL_TRACE_MEMORY=1 python excel_validator.py
+  python3 benchmark.py soak --files 10000        # 同じ報告書を繰り返しチェックし、メモリの増加を確認
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from contextlib import contextmanager
+
+# 割り当ての多い箇所として表示する件数
+TOP_SITES = 10
+# 割り当ての多い箇所から除くファイル（計測自体と import の割り当て）
+IGNORED_SITES = (tracemalloc.__file__, '<frozen importlib._bootstrap>',
+                 '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+def current_rss():
+    """現在の常駐メモリ（バイト）。取得できない環境（macOS 等）では None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def format_bytes(size) -> str:
+    sign = '-' if size < 0 else ''
+    size = abs(size)
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{sign}{size:.0f}{unit}" if unit == 'B' else f"{sign}{size:.1f}{unit}"
+        size /= 1024
+    return f"{sign}{size:.2f}GB"
+
+
+class MemoryTrace:
+    def __init__(self, top=TOP_SITES, frames=1):
+        """
+        top:    割り当ての多い箇所として表示する件数
+        frames: 割り当て箇所として記録する呼び出し元の段数（tracemalloc.start の引数）
+        """
+        self.top = top
+        # 既に tracemalloc が動いている場合（python -X tracemalloc 等）はそのまま使い、止めない
+        self.owner = not tracemalloc.is_tracing()
+        if self.owner:
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+        self.count = 0
+        self.peak_total = 0
+        self.max_peak = None          # (割り当て量, ファイル)
+        self.retained_total = 0
+        self.max_retained = None
+        # RSS の推移: 最初・最後・最大と、(件数, RSS) の最小二乗法の和
+        self.first_rss = self.last_rss = current_rss()
+        self.max_rss = self.first_rss or 0
+        self.sums = [0, 0.0, 0.0, 0.0, 0.0]    # n, Σx, Σy, Σxy, Σxx
+        self.last = None
+
+    @contextmanager
+    def track(self, label: str):
+        """with ブロック内（1ファイルのチェック）の最大割り当て量と、終了後に残った割り当て量を記録する"""
+        before, _ = tracemalloc.get_traced_memory()
+        # reset_peak は Python 3.9 以降。それ以前は計測開始からの最大値になる
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            # 循環参照のごみを回収してから、残った割り当てを測る
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            self.add(label, peak - before, current - before)
+
+    def add(self, label: str, peak: int, retained: int):
+        self.count += 1
+        self.peak_total += peak
+        if self.max_peak is None or peak > self.max_peak[0]:
+            self.max_peak = (peak, label)
+        self.retained_total += retained
+        if self.max_retained is None or retained > self.max_retained[0]:
+            self.max_retained = (retained, label)
+        rss = current_rss()
+        if rss is not None:
+            self.last_rss = rss
+            self.max_rss = max(self.max_rss, rss)
+            for position, value in enumerate((1, self.count, rss, self.count * rss, self.count ** 2)):
+                self.sums[position] += value
+        self.last = (label, peak, retained, rss)
+
+    def rss_slope(self):
+        """RSS の回帰直線の傾き（バイト/ファイル）。記録が2件未満なら None"""
+        n, sx, sy, sxy, sxx = self.sums
+        denominator = n * sxx - sx * sx
+        if n < 2 or not denominator:
+            return None
+        return (n * sxy - sx * sy) / denominator
+
+    def last_line(self) -> str:
+        """直前に記録したファイルの1行表示"""
+        label, peak, retained, rss = self.last
+        line = f"メモリ: 最大割り当て {format_bytes(peak)} / 残った割り当て {format_bytes(retained)}"
+        if rss is not None:
+            line += f" / 常駐 {format_bytes(rss)}"
+        return f"{line}（{label}）"
+
+    def top_sites(self):
+        """計測開始時から割り当てが増えた箇所（増加量の多い順）"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in IGNORED_SITES])
+        baseline = self.baseline.filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in IGNORED_SITES])
+        stats = snapshot.compare_to(baseline, 'lineno')
+        return [stat for stat in stats if stat.size_diff > 0][:self.top]
+
+    def report_lines(self):
+        lines = [f"メモリ計測（tracemalloc）: {self.count}ファイル"]
+        if self.count:
+            peak, label = self.max_peak
+            lines.append(f"  チェック中の最大割り当て: 平均 {format_bytes(self.peak_total / self.count)}"
+                         f" / 最大 {format_bytes(peak)}（{label}）")
+            retained, label = self.max_retained
+            lines.append(f"  チェック後に残った割り当て: 平均 {format_bytes(self.retained_total / self.count)}"
+                         f" / 最大 {format_bytes(retained)}（{label}）")
+        if self.first_rss is not None:
+            line = (f"  常駐メモリ（RSS）: 開始 {format_bytes(self.first_rss)} → 現在 {format_bytes(self.last_rss)}"
+                    f"（最大 {format_bytes(self.max_rss)}）")
+            slope = self.rss_slope()
+            if slope is not None:
+                line += f" / 傾向 1000ファイルあたり {format_bytes(slope * 1000)}"
+            lines.append(line)
+        current, _ = tracemalloc.get_traced_memory()
+        lines.append(f"  割り当て中のメモリ: {format_bytes(current)}")
+        sites = self.top_sites()
+        if sites:
+            lines.append("  計測開始時から割り当てが増えた箇所:")
+            for stat in sites:
+                frame = stat.traceback[0]
+                lines.append(f"    {format_bytes(stat.size_diff):>9}  {stat.count_diff:+7d}個"
+                             f"  {os.path.basename(frame.filename)}:{frame.lineno}")
+        return lines
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        for line in self.report_lines():
+            print(line, file=stream)
+        stream.flush()
+
+    def close(self):
+        if self.owner and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def trace_from_environment():
+    """環境変数 CHECK_EXCEL_TRACE_MEMORY が設定されていれば MemoryTrace を返す（GUI 用）"""
+    if os.environ.get('CHECK_EXCEL_TRACE_MEMORY', '') not in ('', '0'):
+        return MemoryTrace()
+    return None
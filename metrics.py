@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+動作状況のメトリクス（--metrics-file / --metrics-port）
+常駐サーバー（serve）・分散ワーカー（worker）・一括チェックで、処理件数・重要度と項目ごとの指摘件数・
+処理段階ごとの所要時間・キャッシュの参照・ワーカーの入れ替え・処理待ちの件数を集計し、
+Prometheus のテキスト形式で公開します。
+
+  python3 excel_validator_cli.py serve --metrics-port 9464              # http://127.0.0.1:9464/metrics
+  python3 excel_validator_cli.py worker キュー --metrics-file /var/lib/node_exporter/check_excel.prom
+  python3 excel_validator_cli.py 報告書フォルダ/ --metrics-file metrics.prom --metrics-interval 5
+
+--metrics-file は一定間隔と終了時に一時ファイル経由で置き換えるため、node_exporter の
+textfile collector から途中まで書かれたファイルが読まれることはありません。
+出力先を指定しない場合は集計自体を行わず、計測の呼び出しはすぐに戻ります。
+集計はこのプロセス内の分だけです（-j・--workers・--pipeline のワーカー内の処理段階の所要時間は
+含まれません。ファイル数・指摘件数・1ファイルの所要時間はワーカーから受け取った結果で集計します）。
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from operator import itemgetter
+
+# 出力先が指定されたときだけ有効にする
+enabled = False
+
+# 所要時間のヒストグラムの境界（秒）
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 名前 -> (種類, 説明)。出力はこの順
+METRICS = {
+    'check_excel_files_total': (
+        'counter', 'チェックしたファイル数（status: ok=チェック完了 / failed=読み込み失敗・タイムアウト等）'),
+    'check_excel_findings_total': (
+        'counter', '指摘の件数（severity: 重要度 / check: 項目名の接頭辞）'),
+    'check_excel_file_seconds': (
+        'histogram', '1ファイルの読み込みとチェックにかかった時間（秒）'),
+    'check_excel_stage_seconds': (
+        'histogram', '処理段階ごとの所要時間（秒。stage: read=読み込み / チェック名 / history=前の期との比較）'),
+    'check_excel_cache_requests_total': (
+        'counter', 'キャッシュの参照回数（cache: vocabulary / phrase_model / incremental=差分の単位, result: hit / miss）'),
+    'check_excel_worker_restarts_total': (
+        'counter', 'ワーカープロセスの入れ替え回数（reason: recycle / memory / crash / timeout）'),
+    'check_excel_queue_depth': (
+        'gauge', '処理待ちの件数（queue: batch=一括チェックの残り / lease=共有キューの未処理 / server=処理中の要求）'),
+    'check_excel_start_time_seconds': (
+        'gauge', 'プロセスの開始時刻（UNIX時間）'),
+}
+
+_lock = threading.Lock()
+# (名前, ラベルの組) -> 値。ヒストグラムは [各バケットの件数（最後は +Inf）..., 合計]
+_values = {}
+
+
+def metric_key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount=1, **labels):
+    """カウンター（またはゲージ）に加算する"""
+    if not enabled:
+        return
+    key = metric_key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name: str, value, **labels):
+    if not enabled:
+        return
+    key = metric_key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    """ヒストグラムに所要時間を1件加える"""
+    if enabled:
+        observe_key(metric_key(name, labels), seconds)
+
+
+def observe_key(key, seconds: float):
+    with _lock:
+        buckets = _values.get(key)
+        if buckets is None:
+            buckets = _values[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+        buckets[bisect_left(DURATION_BUCKETS, seconds)] += 1
+        buckets[-1] += seconds
+
+
+class Timer:
+    """with ブロックの所要時間をヒストグラムに加える（ファイルごとに何度も使うため関数呼び出しを減らしている）"""
+    __slots__ = ('key', 'start')
+
+    def __init__(self, key):
+        self.key = key
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            observe_key(self.key, time.perf_counter() - self.start)
+            self.start = None
+
+
+def timed(name: str, **labels) -> Timer:
+    return Timer(metric_key(name, labels))
+
+
+# 処理段階の名前 -> ヒストグラムのキー（ファイルごとにラベルを並べ替えないようにする）
+_stage_keys = {}
+
+
+def stage(name: str) -> Timer:
+    key = _stage_keys.get(name)
+    if key is None:
+        key = _stage_keys[name] = metric_key('check_excel_stage_seconds', {'stage': name})
+    return Timer(key)
+
+
+# 項目名 -> 接頭辞（「誤字脱字 - セル(17, 2)」 -> 「誤字脱字」）。項目名はセル位置を含むため件数に上限を設ける
+_check_names = {}
+_CHECK_NAMES_LIMIT = 4096
+_item_severity = itemgetter('item', 'severity')
+
+
+def record_results(results, failed=False):
+    """1ファイル分の結果を、ファイル数と指摘件数に加える（ロックは1回だけ取る）"""
+    if not enabled:
+        return
+    # 指摘の多いファイルでも1件あたりの処理を最小限にするため、(項目名の接頭辞, 重要度) で数えてから加える
+    counts = {}
+    for item, severity in map(_item_severity, results):
+        check = _check_names.get(item)
+        if check is None:
+            if len(_check_names) >= _CHECK_NAMES_LIMIT:
+                _check_names.clear()
+            check = _check_names[item] = item.partition(' - ')[0]
+        key = (check, severity)
+        counts[key] = counts.get(key, 0) + 1
+    files_key = ('check_excel_files_total', (('status', 'failed' if failed else 'ok'),))
+    with _lock:
+        _values[files_key] = _values.get(files_key, 0) + 1
+        for (check, severity), count in counts.items():
+            key = ('check_excel_findings_total', (('check', check), ('severity', severity)))
+            _values[key] = _values.get(key, 0) + count
+
+
+def record_entry(entry: dict):
+    """一括チェックのエントリ（BatchValidator.validate_one の戻り値）を集計に加える"""
+    record_results(entry['results'], failed=entry['failed'])
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render() -> str:
+    """Prometheus のテキスト形式（version 0.0.4）"""
+    with _lock:
+        values = {key: list(value) if isinstance(value, list) else value for key, value in _values.items()}
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), value):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(path: str):
+    """一時ファイルに書き出してから置き換える"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    def __init__(self, path=None, address=None, interval=15.0):
+        """
+        path:     一定間隔と終了時に書き出すファイル
+        address:  (ホスト, ポート)。指定すると HTTP の /metrics で公開する
+        interval: path に書き出す間隔（秒）
+        """
+        self.path = path
+        self.address = address
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+
+    def start(self):
+        global enabled
+        enabled = True
+        set_gauge('check_excel_start_time_seconds', round(time.time(), 3))
+        if self.path:
+            write_file(self.path)
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+        if self.address:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    # 取得のたびにアクセスログを出さない
+                    pass
+
+            self.server = ThreadingHTTPServer(self.address, MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                write_file(self.path)
+            except OSError:
+                # 書き出し先が一時的に使えない場合は次の間隔で再試行する
+                pass
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            write_file(self.path)
+
+
+def start_export(args):
+    """--metrics-file / --metrics-port が指定されていれば集計を有効にして公開を始める"""
+    if not args.metrics_file and not args.metrics_port:
+        return None
+    return MetricsExporter(args.metrics_file, args.metrics_port, args.metrics_interval).start()
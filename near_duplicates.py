@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+報告書間の類似文章（コピー＆ペースト）検出
+各文章セルを文字n-gramに分割してMinHash署名を作り、LSH（署名の帯ごとのバケット）で
+候補だけを比較します。全ペアを比較しないため、文章数に対してほぼ線形で動作します。
+
+MinHash は1回のハッシュで全成分を埋める One Permutation Hashing（空の成分は隣の
+成分から補完）を使い、文字n-gramあたりのハッシュ計算を1回に抑えています。
+"""
+
+import re
+import unicodedata
+import zlib
+from array import array
+
+# 類似判定から除外する空白・句読点
+IGNORED_CHARS = re.compile(r'[\s、。，．,.！？!?「」『』（）()・]+')
+
+
+def normalize_text(text: str) -> str:
+    """全角/半角の揺れと空白・句読点の差を無視するための正規化"""
+    return IGNORED_CHARS.sub('', unicodedata.normalize('NFKC', text))
+
+
+class NearDuplicateIndex:
+    """
+    文章を追加していき、最後に類似文章のクラスタを取り出す。
+
+    num_perm:     MinHash署名の長さ
+    bands:        LSHの帯の数（num_perm を割り切れること）。帯が多いほど低い類似度も候補になる
+    shingle_size: 文字n-gramの長さ
+    threshold:    類似とみなす推定Jaccard係数
+    min_length:   これより短い文章（正規化後）は対象外
+    """
+
+    def __init__(self, num_perm=128, bands=16, shingle_size=5, threshold=0.8, min_length=30):
+        if num_perm % bands:
+            raise ValueError("num_perm は bands で割り切れる必要があります")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.min_length = min_length
+        self.keys = []
+        self.signatures = []
+        self.buckets = {}
+
+    def signature(self, text: str):
+        """正規化済みの文章から MinHash 署名（array('I')）を作る"""
+        k = self.num_perm
+        # UTF-32 にしておくと、n-gram を文字単位のスライスとしてそのままハッシュできる
+        data = memoryview(text.encode('utf-32-le'))
+        width = self.shingle_size * 4
+        empty = 0xFFFFFFFF
+        mins = [empty] * k
+        for start in range(0, len(data) - width + 4, 4):
+            h = zlib.crc32(data[start:start + width])
+            # crc32 は下位ビットの偏りがあるため、乗算で混ぜてから成分と値に分ける
+            h = (h * 0x9E3779B1) & 0xFFFFFFFF
+            slot = h % k
+            value = h // k
+            if value < mins[slot]:
+                mins[slot] = value
+
+        # 空の成分は右隣の空でない成分の値で補完する（densification）
+        if empty in mins:
+            filled = [i for i, value in enumerate(mins) if value != empty]
+            if not filled:
+                return None
+            for i in range(k):
+                if mins[i] == empty:
+                    for offset in range(1, k):
+                        j = (i + offset) % k
+                        if mins[j] != empty:
+                            mins[i] = (mins[j] + offset * 0x9E37) & 0xFFFFFFFF
+                            break
+        return array('I', mins)
+
+    def add(self, key, text: str) -> bool:
+        """文章を追加する。短すぎて対象外の場合は False を返す"""
+        normalized = normalize_text(text)
+        if len(normalized) < max(self.min_length, self.shingle_size):
+            return False
+        signature = self.signature(normalized)
+        if signature is None:
+            return False
+
+        index = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        rows = self.rows
+        for band in range(self.bands):
+            band_key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            self.buckets.setdefault(band_key, []).append(index)
+        return True
+
+    def similarity(self, a: int, b: int) -> float:
+        """署名の一致率（Jaccard係数の推定値）"""
+        sig_a = self.signatures[a]
+        sig_b = self.signatures[b]
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / self.num_perm
+
+    def clusters(self):
+        """
+        類似文章のクラスタを返す: [[(キー, 先頭の文章との類似度), ...], ...]
+        バケット内は先頭の文章とだけ比較して併合するため、同じ文章が大量に
+        コピーされていても比較回数はバケットの大きさに比例する。
+        """
+        parent = list(range(len(self.keys)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for members in self.buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            for other in members[1:]:
+                if find(first) != find(other) and self.similarity(first, other) >= self.threshold:
+                    parent[find(other)] = find(first)
+
+        groups = {}
+        for i in range(len(self.keys)):
+            groups.setdefault(find(i), []).append(i)
+
+        clusters = []
+        for members in groups.values():
+            if len(members) > 1:
+                first = members[0]
+                clusters.append([(self.keys[i], self.similarity(first, i)) for i in members])
+        return clusters
+
+
+def find_near_duplicates(texts, **options):
+    """
+    texts: [((ファイル, 項目名), 文章), ...]
+    戻り値: 2つ以上の異なるファイルにまたがる類似文章のクラスタのリスト
+    """
+    index = NearDuplicateIndex(**options)
+    for key, text in texts:
+        index.add(key, text)
+    return [cluster for cluster in index.clusters()
+            if len({file for (file, _), _ in cluster}) > 1]
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+文字 n-gram による不自然な表現の検出（--phrase-model）
+承認済みの報告書の文章から文字 n-gram（既定は3文字）の出現回数を学習しておき、チェック時に
+各文字の出現確率を求めて、確率の低い文字が続く箇所（変換ミス・文字化け等）と、
+続けて繰り返された語句（「提出しました提出しました」等）を報告します。
+
+モデルの形式: ヘッダーと、n-gram のハッシュを添字とする uint8 の配列（出現回数を対数で量子化）。
+異なる n-gram が同じ添字に入った場合は回数が合算されるため、確率は高めに（報告されにくい側に）
+ずれます。読み込みはファイルを mmap するだけで、解析は行いません。
+
+報告のしきい値は作成時に決めます。承認済みの報告書の一部（10件に1件）を学習から外して
+各文字の情報量を求め、その上位 0.5% にあたる値をしきい値として保存します（保存するモデルには
+外した報告書も含めます）。
+
+  python3 excel_validator_cli.py phrase-model build 文章.model 承認済み/
+  python3 excel_validator_cli.py phrase-model score 文章.model "今日は機械があれば練習します。"
+  python3 excel_validator_cli.py 報告書フォルダ/ --phrase-model 文章.model
+"""
+
+import math
+import os
+import re
+import struct
+import unicodedata
+import zlib
+from collections import Counter
+
+MODEL_MAGIC = b'CXLM'
+MODEL_VERSION = 1
+HEADER = struct.Struct('<4sHBBQd')
+
+DEFAULT_ORDER = 3
+DEFAULT_BITS = 22
+# 出現回数の量子化: q = round(log2(回数 + 1) * QUANT_SCALE)（uint8 に収まるよう 255 で打ち切り）
+QUANT_SCALE = 8
+LOG_COUNTS = [None] + [math.log2(2 ** (q / QUANT_SCALE) - 1) for q in range(1, 256)]
+# 低次の n-gram に戻る際の減点（stupid backoff、log2(0.4)）
+BACKOFF = math.log2(0.4)
+# しきい値: 学習から外した文章の各文字の情報量の上位 0.5%
+THRESHOLD_QUANTILE = 0.995
+HOLDOUT_EVERY = 10
+# 不自然な表現として報告する、しきい値を超えた文字の最小連続数
+MIN_SPAN = 2
+MAX_FINDINGS_PER_TEXT = 3
+SNIPPET_CONTEXT = 6
+
+BOS = '\x02'
+DIGIT = re.compile(r'\d')
+SENTENCE = re.compile(r'[^。！？!?\n]+[。！？!?]?')
+# 続けて繰り返された2〜10文字の語句（同じ1文字の繰り返しは従来のチェックで報告する）
+REPEAT_PATTERN = re.compile(r'(.{2,10}?)\1+')
+
+
+def sentences(text: str):
+    """全角・半角を揃えた文章を1文ずつに分ける（数字の違いはモデルの参照時に無視する）"""
+    return SENTENCE.findall(unicodedata.normalize('NFKC', str(text)))
+
+
+def ngram_hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def count_ngrams(counter: Counter, text: str, order: int):
+    for sentence in sentences(text):
+        padded = BOS * (order - 1) + DIGIT.sub('0', sentence)
+        for end in range(order - 1, len(padded)):
+            for size in range(1, order + 1):
+                counter[padded[end - size + 1:end + 1]] += 1
+        # 文頭の文脈（BOS の並び）の回数
+        for size in range(1, order):
+            counter[BOS * size] += 1
+
+
+def quantize(count: int) -> int:
+    return min(255, round(math.log2(count + 1) * QUANT_SCALE))
+
+
+def build_table(counter: Counter, bits: int) -> bytearray:
+    from array import array
+    mask = (1 << bits) - 1
+    totals = array('Q', bytes(8 << bits))
+    for ngram, count in counter.items():
+        totals[ngram_hash(ngram) & mask] += count
+    return bytearray(quantize(count) if count else 0 for count in totals)
+
+
+class PhraseModel:
+    """量子化した文字 n-gram の回数表（mmap、または作成中はメモリ上の bytearray）"""
+
+    def __init__(self, table, order: int, bits: int, total: int, threshold: float):
+        self.table = table
+        self.order = order
+        self.mask = (1 << bits) - 1
+        self.total = total
+        self.log_total = math.log2(max(total, 1))
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path: str):
+        import mmap
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, order, bits, total, threshold = HEADER.unpack_from(data)
+        if magic != MODEL_MAGIC or version != MODEL_VERSION:
+            raise ValueError(f"文章モデルではないか、形式が異なります: {path}")
+        if len(data) != HEADER.size + (1 << bits):
+            raise ValueError(f"文章モデルのファイルが壊れています: {path}")
+        return cls(memoryview(data)[HEADER.size:], order, bits, total, threshold)
+
+    def save(self, path: str):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MODEL_MAGIC, MODEL_VERSION, self.order, self.mask.bit_length(),
+                                self.total, self.threshold))
+            f.write(self.table)
+        os.replace(temp_path, path)
+
+    def surprisals(self, sentence: str):
+        """1文（sentences() で分けたもの）の各文字の情報量（ビット）。学習データにない文字は 0 とする"""
+        order, table, mask, crc32 = self.order, self.table, self.mask, zlib.crc32
+        padded = BOS * (order - 1) + DIGIT.sub('0', sentence)
+        result = []
+        for i in range(order - 1, len(padded)):
+            # 高次の n-gram から順に参照し、見つかった時点で打ち切る（大半の文字は最初の2回の参照で済む）
+            for size in range(order, 1, -1):
+                count = table[crc32(padded[i - size + 1:i + 1].encode('utf-8')) & mask]
+                if count:
+                    context = table[crc32(padded[i - size + 1:i].encode('utf-8')) & mask]
+                    if context:
+                        log_probability = BACKOFF * (order - size) + LOG_COUNTS[count] - LOG_COUNTS[context]
+                        break
+            else:
+                count = table[crc32(padded[i].encode('utf-8')) & mask]
+                if not count:
+                    result.append(0.0)
+                    continue
+                log_probability = BACKOFF * (order - 1) + LOG_COUNTS[count] - self.log_total
+            result.append(max(0.0, -log_probability))
+        return result
+
+    def check_text(self, text: str):
+        """文章中の不自然な表現と語句の繰り返しを [(種類, 重要度, 詳細), ...] で返す"""
+        findings = []
+        for sentence in sentences(text):
+            scores = self.surprisals(sentence)
+            for match in REPEAT_PATTERN.finditer(sentence):
+                unit = match.group(1)
+                if len(set(unit)) == 1 or not any(char.isalpha() for char in unit):
+                    continue
+                # 承認済みの報告書でも使われる繰り返し（ひとりひとり等）は、繰り返しの継ぎ目の
+                # 確率が高いため除く
+                if scores[match.start() + len(unit)] > self.threshold / 2:
+                    findings.append(('語句の繰り返し', '警告',
+                                     f"'{match.group(0)}' で同じ語句が続いています"))
+            start = None
+            for i, score in enumerate(scores + [0.0]):
+                if score > self.threshold:
+                    if start is None:
+                        start = i
+                    continue
+                if start is not None and i - start >= MIN_SPAN:
+                    left = max(0, start - SNIPPET_CONTEXT)
+                    right = min(len(sentence), i + SNIPPET_CONTEXT)
+                    snippet = (('…' if left else '') + sentence[left:start] + '【' + sentence[start:i] + '】'
+                               + sentence[i:right] + ('…' if right < len(sentence) else ''))
+                    findings.append(('不自然な表現', '情報',
+                                     f"{snippet} の表現は承認済みの報告書にほとんど見られません"
+                                     "（変換ミス等がないか確認してください）"))
+                start = None
+            if len(findings) >= MAX_FINDINGS_PER_TEXT:
+                break
+        return findings[:MAX_FINDINGS_PER_TEXT]
+
+
+# パス -> ((inode, 更新時刻, サイズ), 開いたモデル)
+_loaded = {}
+
+
+def load_model(path: str) -> PhraseModel:
+    """
+    モデルをプロセス内で1度だけ開く（チェックのたびに開き直さない）。
+    phrase-model build でファイルが置き換えられた場合（inode・更新時刻・サイズが変わった場合）は開き直すため、
+    常駐サーバーやワーカーを再起動する必要はない。古いモデルの mmap は、使用中のチェックが終わって
+    参照がなくなった時点で閉じられる（並行して処理中の要求があるため、ここでは閉じない）。
+    """
+    import metrics
+    info = os.stat(path)
+    stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+    loaded = _loaded.get(path)
+    hit = loaded is not None and loaded[0] == stamp
+    metrics.inc('check_excel_cache_requests_total', cache='phrase_model', result='hit' if hit else 'miss')
+    if not hit:
+        loaded = _loaded[path] = (stamp, PhraseModel.load(path))
+    return loaded[1]
+
+
+def calibrate_threshold(model: PhraseModel, texts) -> float:
+    scores = sorted(score for text in texts for sentence in sentences(text)
+                    for score in model.surprisals(sentence) if score > 0)
+    if not scores:
+        return 20.0
+    return scores[min(len(scores) - 1, int(len(scores) * THRESHOLD_QUANTILE))]
+
+
+def build_model(output: str, paths, order=DEFAULT_ORDER, bits=DEFAULT_BITS, reader='stream') -> int:
+    """承認済みの報告書からモデルを作る。終了コードを返す"""
+    from batch import BatchValidator, iter_report_sources
+    from excel_validator_cli import TEXT_SECTIONS
+
+    training = Counter()
+    holdout = []
+    batch = BatchValidator(None, options={}, reader=reader)
+    files = failed = 0
+    try:
+        for source in iter_report_sources(paths):
+            try:
+                snapshot = batch.read_snapshot(source)
+            except Exception as e:
+                print(f"エラー: {source.key}: {e}")
+                failed += 1
+                continue
+            texts = [str(content) for content in (snapshot.cell(row=row, column=col).value
+                                                  for row, col, _, _ in TEXT_SECTIONS.values()) if content]
+            files += 1
+            if files % HOLDOUT_EVERY == 0:
+                holdout.extend(texts)
+            else:
+                for text in texts:
+                    count_ngrams(training, text, order)
+    finally:
+        batch.archives.close()
+    if not training:
+        print("エラー: 学習に使える文章がありません")
+        return 1
+
+    # 学習から外した文章でしきい値を決め、その後で外した文章も加えたモデルを保存する
+    total = sum(count for ngram, count in training.items() if len(ngram) == 1)
+    model = PhraseModel(build_table(training, bits), order, bits, total, 0.0)
+    threshold = calibrate_threshold(model, holdout) if holdout else 20.0
+    for text in holdout:
+        count_ngrams(training, text, order)
+    total = sum(count for ngram, count in training.items() if len(ngram) == 1)
+    PhraseModel(build_table(training, bits), order, bits, total, threshold).save(output)
+
+    print(f"文章モデルを作成しました: {output}")
+    print(f"  報告書 {files}件（エラー {failed}件）/ n-gram {len(training)}種類 / 文字数 {total}"
+          f" / しきい値 {threshold:.1f}ビット" + ('' if holdout else '（報告書が少ないため既定値）'))
+    return 1 if failed else 0
+
+
+def phrase_model_main(argv=None):
+    import argparse
+    from excel_validator_cli import READERS, setup_console_encoding
+
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py phrase-model',
+                                     description='文字 n-gram による不自然な表現の検出モデル（--phrase-model）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='承認済みの報告書からモデルを作る')
+    build.add_argument('model', help='作成するモデルファイル')
+    build.add_argument('files', nargs='+', help='承認済みの報告書のファイル・フォルダ・zipアーカイブ')
+    build.add_argument('--order', type=int, default=DEFAULT_ORDER, choices=range(2, 6), metavar='N',
+                       help=f'n-gram の文字数（既定: {DEFAULT_ORDER}）')
+    build.add_argument('--bits', type=int, default=DEFAULT_BITS, choices=range(16, 29), metavar='BITS',
+                       help=f'回数表の大きさ（2^BITS バイト、既定: {DEFAULT_BITS}）')
+    build.add_argument('--reader', choices=READERS, default='stream', help='読み込み方式（既定: stream）')
+    score = subparsers.add_parser('score', help='文章の各文字の情報量と報告される箇所を表示する')
+    score.add_argument('model', help='モデルファイル')
+    score.add_argument('text', help='文章')
+    args = parser.parse_args(argv)
+
+    setup_console_encoding()
+    if args.command == 'build':
+        return build_model(args.model, args.files, args.order, args.bits, args.reader)
+
+    model = PhraseModel.load(args.model)
+    print(f"しきい値: {model.threshold:.1f}ビット")
+    for sentence in sentences(args.text):
+        print(sentence)
+        for char, value in zip(sentence, model.surprisals(sentence)):
+            mark = ' *' if value > model.threshold else ''
+            print(f"  {char} {value:5.1f} {'#' * min(40, round(value))}{mark}")
+    for finding_type, severity, detail in model.check_text(args.text):
+        print(f"[{severity}] {finding_type}: {detail}")
+    return 0
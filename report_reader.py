@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+報告書の読み込みバックエンド
+チェック処理は sheet.cell(row=..., column=...).value でセル値を参照するため、
+各バックエンドは openpyxl のワークシートと同じ形の cell() と close()、
+シート名の title を提供します。
+
+- openpyxl: openpyxl.load_workbook でブック全体を読み込む（従来どおり）
+- stream:   zip内のシートXMLを必要な行まで逐次解析し、共有文字列も
+            参照されたインデックスまでしか読まない（openpyxl を読み込まない）
+
+旧形式の .xls（OLE2 / BIFF8）は openpyxl では読めないため、指定した方式に関わらず
+xls_reader.XlsReport で読み込みます（ファイルの先頭のシグネチャで判定）。
+"""
+
+import zipfile
+import xml.etree.ElementTree as ET
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+READERS = ('openpyxl', 'stream')
+
+# 解析前に確認する展開後サイズの既定上限（zip爆弾・異常に大きいブック対策）
+MAX_UNCOMPRESSED_MB = 256
+MAX_COMPRESSION_RATIO = 200
+MAX_MEMBERS = 10000
+# 圧縮率は、これより小さいメンバーでは判定しない（小さなXMLは圧縮率が高くなりやすいため）
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+
+class ReportTooLarge(ValueError):
+    """展開後のサイズや圧縮率が上限を超えているため、解析せずに拒否したことを表す例外"""
+
+
+def check_zip_limits(source, max_uncompressed_mb=MAX_UNCOMPRESSED_MB,
+                     max_ratio=MAX_COMPRESSION_RATIO, max_members=MAX_MEMBERS):
+    """
+    zipの中央ディレクトリだけを読み、展開後の合計サイズ・メンバーごとの圧縮率・
+    メンバー数が上限以内か確認する（上限を超えていれば ReportTooLarge）。
+    source がファイルオブジェクトの場合は読み込み位置を先頭に戻す。
+    """
+    with zipfile.ZipFile(source) as archive:
+        infos = archive.infolist()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    if len(infos) > max_members:
+        raise ReportTooLarge(f"zip内のファイル数が多すぎます（{len(infos)}件、上限 {max_members}件）")
+
+    total = 0
+    for info in infos:
+        total += info.file_size
+        if info.file_size >= RATIO_CHECK_MIN_BYTES:
+            ratio = info.file_size / max(info.compress_size, 1)
+            if ratio > max_ratio:
+                raise ReportTooLarge(
+                    f"{info.filename} の圧縮率が異常です（{ratio:.0f}倍、上限 {max_ratio}倍）")
+    if total > max_uncompressed_mb * 1024 * 1024:
+        raise ReportTooLarge(
+            f"展開後のサイズが大きすぎます（{total / 1024 / 1024:.0f}MB、上限 {max_uncompressed_mb}MB）")
+
+
+def column_index(letters: str) -> int:
+    """列記号（例: 'AB'）を1始まりの列番号に変換する"""
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index
+
+
+def split_cell_ref(cell_ref: str):
+    """セル参照（例: 'B17'）を (行, 列) に変換する"""
+    pos = 0
+    while pos < len(cell_ref) and cell_ref[pos].isalpha():
+        pos += 1
+    return int(cell_ref[pos:]), column_index(cell_ref[:pos])
+
+
+def cast_number(text: str):
+    # openpyxl と同じ規則で数値文字列を int / float に変換する
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def string_item_text(element) -> str:
+    """<si> / <is> 要素の文字列を返す（リッチテキストは連結し、ふりがな<rPh>は除く）"""
+    parts = []
+    for child in element:
+        if child.tag == NS + 't':
+            parts.append(child.text or '')
+        elif child.tag == NS + 'r':
+            parts.append(child.findtext(NS + 't') or '')
+    return ''.join(parts).replace('x005F_', '')
+
+
+def resolve_target(base_dir: str, target: str) -> str:
+    """リレーションシップのTargetをzip内のパスに変換する"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    parts = base_dir.split('/') if base_dir else []
+    for part in target.split('/'):
+        if part == '..':
+            if parts:
+                parts.pop()
+        elif part and part != '.':
+            parts.append(part)
+    return '/'.join(parts)
+
+
+def workbook_sheets(archive: zipfile.ZipFile):
+    """
+    ブック内のシート一覧を返す。
+    戻り値: ([(シート名, zip内のパス), ...], アクティブシートの位置)
+    """
+    with archive.open('xl/workbook.xml') as f:
+        workbook = ET.parse(f).getroot()
+    with archive.open('xl/_rels/workbook.xml.rels') as f:
+        rels = ET.parse(f).getroot()
+
+    targets = {rel.get('Id'): resolve_target('xl', rel.get('Target', ''))
+               for rel in rels.iter(PKG_REL_NS + 'Relationship')}
+
+    sheets = []
+    for sheet in workbook.iter(NS + 'sheet'):
+        sheets.append((sheet.get('name'), targets.get(sheet.get(REL_NS + 'id'))))
+
+    active = 0
+    view = workbook.find(f'{NS}bookViews/{NS}workbookView')
+    if view is not None:
+        active = int(view.get('activeTab', 0))
+    if not 0 <= active < len(sheets):
+        active = 0
+    return sheets, active
+
+
+def iter_sheet_rows(stream):
+    """
+    シートXMLを逐次解析し、文書順に (行番号, [(列番号, 型, 生の値), ...]) を返す。
+    処理済みの要素は都度破棄するため、シートの大きさに関わらずメモリ使用量は一定。
+    生の値は <v> の文字列（インライン文字列の場合は本文）で、型は c要素の t 属性。
+    """
+    sheet_data = None
+    row_number = 0
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == NS + 'sheetData':
+                sheet_data = element
+            continue
+        if element.tag != NS + 'row':
+            continue
+
+        row_number = int(element.get('r', row_number + 1))
+        cells = []
+        column = 0
+        for cell in element.iter(NS + 'c'):
+            ref = cell.get('r')
+            column = split_cell_ref(ref)[1] if ref else column + 1
+            cell_type = cell.get('t', 'n')
+            if cell_type == 'inlineStr':
+                inline = cell.find(NS + 'is')
+                raw = string_item_text(inline) if inline is not None else None
+            else:
+                raw = cell.findtext(NS + 'v') or None
+            cells.append((column, cell_type, raw))
+        yield row_number, cells
+
+        element.clear()
+        if sheet_data is not None:
+            sheet_data.clear()
+
+
+class SharedStrings:
+    """共有文字列テーブル。参照されたインデックスまでだけ逐次読み込む"""
+
+    def __init__(self, archive: zipfile.ZipFile, path='xl/sharedStrings.xml'):
+        self.strings = []
+        self._stream = None
+        self._events = None
+        if path in archive.namelist():
+            self._stream = archive.open(path)
+            self._events = ET.iterparse(self._stream, events=('start', 'end'))
+        self._root = None
+
+    def __getitem__(self, index: int) -> str:
+        while index >= len(self.strings) and self._events is not None:
+            self._read_next()
+        return self.strings[index]
+
+    def _read_next(self):
+        for event, element in self._events:
+            if event == 'start':
+                if self._root is None:
+                    self._root = element
+                continue
+            if element.tag == NS + 'si':
+                self.strings.append(string_item_text(element))
+                self._root.clear()
+                return
+        self.close()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        self._stream = None
+        self._events = None
+
+
+class ReportCell:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CellSnapshot:
+    """
+    必要なセルの値だけを取り出した読み取り専用のスナップショット。
+    ブックを閉じた後もチェックを実行でき、pickle できるためプロセス間で受け渡せる。
+    """
+    __slots__ = ('_values', 'title')
+
+    def __init__(self, values: dict, title=None):
+        self._values = dict(values)
+        self.title = title
+
+    @classmethod
+    def capture(cls, sheet, coordinates):
+        return cls({(row, column): sheet.cell(row=row, column=column).value
+                    for row, column in coordinates}, getattr(sheet, 'title', None))
+
+    def __getstate__(self):
+        return self._values, self.title
+
+    def __setstate__(self, state):
+        self._values, self.title = state
+
+    def cell(self, row: int, column: int):
+        return ReportCell(self._values.get((row, column)))
+
+    def close(self):
+        pass
+
+
+class OpenpyxlReport:
+    """openpyxl でブック全体を読み込むバックエンド"""
+
+    def __init__(self, source):
+        import openpyxl
+        self.workbook = openpyxl.load_workbook(source, data_only=True)
+        self.sheet = self.workbook.active
+        self.title = self.sheet.title
+
+    def cell(self, row: int, column: int):
+        return self.sheet.cell(row=row, column=column)
+
+    def close(self):
+        self.workbook.close()
+
+
+class StreamingReport:
+    """
+    アクティブシートを必要な行まで逐次読み込むバックエンド。
+    cell() で要求された行を読み終えた時点で解析を止めるため、後半の行や
+    参照されない共有文字列はデコードされない。
+    """
+
+    def __init__(self, source):
+        self.archive = zipfile.ZipFile(source)
+        try:
+            sheets, active = workbook_sheets(self.archive)
+            self.title = sheets[active][0]
+            self._sheet_stream = self.archive.open(sheets[active][1])
+        except Exception:
+            self.archive.close()
+            raise
+        self._rows = iter_sheet_rows(self._sheet_stream)
+        self._cells = {}
+        self._last_row = 0
+        self._shared_strings = None
+
+    def _read_until(self, row: int):
+        while self._rows is not None and self._last_row < row:
+            try:
+                row_number, cells = next(self._rows)
+            except StopIteration:
+                self._rows = None
+                return
+            self._last_row = row_number
+            for column, cell_type, raw in cells:
+                self._cells[(row_number, column)] = (cell_type, raw)
+
+    def _decode(self, cell_type: str, raw):
+        if raw is None:
+            return None
+        if cell_type == 's':
+            if self._shared_strings is None:
+                self._shared_strings = SharedStrings(self.archive)
+            return self._shared_strings[int(raw)]
+        if cell_type == 'n':
+            return cast_number(raw)
+        if cell_type == 'b':
+            return bool(int(raw))
+        # str（数式の文字列結果）, inlineStr, e（エラー値）, d（ISO日付）は文字列のまま返す
+        return raw
+
+    def cell(self, row: int, column: int):
+        self._read_until(row)
+        entry = self._cells.get((row, column))
+        return ReportCell(self._decode(*entry) if entry else None)
+
+    def close(self):
+        if self._shared_strings is not None:
+            self._shared_strings.close()
+        self._sheet_stream.close()
+        self.archive.close()
+
+
+def open_report(source, reader: str = 'openpyxl'):
+    """報告書を指定したバックエンドで開く（source はパスまたはファイルオブジェクト）"""
+    from xls_reader import is_xls, XlsReport
+    if is_xls(source):
+        return XlsReport(source)
+    if reader == 'stream':
+        return StreamingReport(source)
+    return OpenpyxlReport(source)
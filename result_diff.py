@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+チェック結果の比較（diff）
+修正前と修正後など2回分のチェック結果を比べ、解消した指摘と新しく出た指摘だけを表示します。
+
+  python3 excel_validator_cli.py diff 前回.json 今回.json
+  python3 excel_validator_cli.py diff 前回ジャーナル.ndjson キュー/ -o 差分.json
+  python3 excel_validator_cli.py diff 前回.txt 今回.txt --counts      # ファイルごとの件数だけ
+
+読み込める結果:
+- -o で保存した .json（結果の配列）と .txt
+- 1行1JSON（--journal のジャーナル、結果またはエントリを1行ずつ書いたもの）
+- フォルダ（enqueue で作成したキュー、--state の保存フォルダ）
+
+指摘は (ファイル, セル, チェックの種類, 正規化した詳細) のキーで照合します。詳細は全角/半角と
+空白の差を無視し、数字を同一視するため「文字数が不足しています（45文字）」が「（80文字）」に
+なっても、同じ指摘が残っているとみなします。
+
+結果は全体を読み込まず、ファイル名のハッシュで分割しながら一時ファイルに書き出し、分割ごとに
+前回の側のハッシュ索引（キー -> 指摘）を作って今回の側と照合します。メモリ使用量は分割1つ分に
+収まり、同じファイルの指摘は同じ分割に入るため、ファイルごとにまとめて表示できます。
+"""
+
+import gc
+import json
+import os
+import pickle
+import re
+import sys
+import tempfile
+import unicodedata
+import zlib
+from functools import lru_cache
+from operator import itemgetter
+
+# 分割1つあたりの入力の大きさの目安（バイト）。入力の合計がこれを超えると一時ファイルに分割する
+PARTITION_BYTES = 32 * 1024 * 1024
+# 一時ファイルに書き出すまでに溜める指摘の件数
+SPILL_BATCH = 4096
+# JSON の配列を読む単位（文字数）
+CHUNK_SIZE = 1 << 20
+
+# save_report の .txt の見出し -> 結果のキー
+TEXT_FIELDS = {'ファイル': 'file', '項目': 'item', '種類': 'type', '重要度': 'severity', '詳細': 'detail'}
+TEXT_SEPARATOR = '-' * 40
+
+ARRAY_SEPARATORS = re.compile(r'[\s,]*')
+DIGITS = re.compile(r'\d+')
+SPACES = re.compile(r'\s+')
+
+CHANGES = ('解消', '新規')
+
+# 照合中は結果を (項目, 種類, 重要度, 詳細, その他のキー) のタプルで持つ（一時ファイルへの書き出しを軽くする）
+PACKED_FIELDS = ('item', 'type', 'severity', 'detail')
+STANDARD_KEYS = frozenset(PACKED_FIELDS + ('file',))
+PACKED_GETTER = itemgetter(*PACKED_FIELDS)
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """JSON の配列の要素を1つずつ返す（ファイル全体を読み込まない）"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("JSON の配列ではありません")
+    position = 1
+    while True:
+        position = ARRAY_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # 要素が読み込んだ範囲の境目にかかっている場合は続きを読む
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError("JSON の配列が途中で終わっています") from None
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+        position = end
+
+
+def iter_ndjson(f):
+    """1行1JSON の各行を返す。1行目から読めない場合は、ファイル全体を1つの JSON として読む"""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if number == 1:
+                f.seek(0)
+                yield json.load(f)
+                return
+            # 書き込み途中で終了したジャーナルの最後の行は読み飛ばす
+            if not line.endswith('\n'):
+                return
+            raise ValueError(f"{number}行目を JSON として読めません") from None
+        yield record
+
+
+def iter_text_report(f):
+    """save_report の .txt から結果を読む（詳細が複数行の場合は続く行も詳細に含める）"""
+    result = {}
+    for line in f:
+        line = line.rstrip('\n')
+        if line == TEXT_SEPARATOR:
+            if 'item' in result:
+                yield result
+            result = {}
+            continue
+        label, separator, value = line.partition(': ')
+        field = TEXT_FIELDS.get(label) if separator else None
+        if field:
+            result[field] = value
+        elif 'detail' in result:
+            result['detail'] += '\n' + line
+
+
+def record_entries(record):
+    """
+    結果、またはファイルごとのエントリ（ジャーナル・キュー・--state）を (ファイル, 指摘のリスト) で返す。
+    ジャーナルの1行目（チェック条件）は読み飛ばす。
+    """
+    if isinstance(record, dict):
+        if 'results' in record:
+            return record.get('file', ''), record['results']
+        if 'item' in record:
+            return record.get('file', ''), [record]
+        if 'journal' in record:
+            return None
+    raise ValueError("チェック結果の形式ではありません")
+
+
+def results_directory(path: str) -> str:
+    """enqueue で作成したキューは results/ の下、--state の保存フォルダは直下に結果がある"""
+    directory = os.path.join(path, 'results')
+    return directory if os.path.isdir(directory) else path
+
+
+def read_records(path: str):
+    if os.path.isdir(path):
+        directory = results_directory(path)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    yield json.load(f)
+        return
+
+    with open(path, encoding='utf-8-sig') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from iter_json_array(f)
+        elif first == '{':
+            yield from iter_ndjson(f)
+        else:
+            yield from iter_text_report(f)
+
+
+def pack_result(result: dict) -> tuple:
+    # ほとんどの結果は標準のキー（と file）だけを持つため、その場合は取り出すだけにする
+    try:
+        values = PACKED_GETTER(result)
+    except KeyError:
+        values = None
+    if values is not None and len(result) - ('file' in result) == 4 and isinstance(values[3], str):
+        return values + (None,)
+    extra = None
+    if not result.keys() <= STANDARD_KEYS:
+        extra = {key: value for key, value in result.items() if key not in STANDARD_KEYS}
+    return (result.get('item', ''), result.get('type', ''), result.get('severity', ''),
+            str(result.get('detail', '')), extra)
+
+
+def unpack_result(packed: tuple, file: str) -> dict:
+    result = {'file': file}
+    result.update(zip(PACKED_FIELDS, packed))
+    if packed[4]:
+        result.update(packed[4])
+    return result
+
+
+def input_size(path: str) -> int:
+    """結果のファイル・フォルダの大きさ（バイト。分割数の見積もりに使う）"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    with os.scandir(results_directory(path)) as entries:
+        return sum(entry.stat().st_size for entry in entries if entry.name.endswith('.json'))
+
+
+def read_entries(path: str, name_only=False):
+    """
+    結果のファイル・フォルダから (照合用のファイル名, 指摘のリスト) を返す（指摘は pack_result のタプル）。
+    1件ずつの結果（.json / .txt）は、続けて同じファイルの結果をまとめて返す。
+    """
+    file, results = None, []
+    for record in read_records(path):
+        entry = record_entries(record)
+        if entry is None:
+            continue
+        if entry[0] != file or len(entry[1]) != 1:
+            if results:
+                yield normalize_file(file, name_only), results
+            file, results = entry[0], []
+        results.extend(map(pack_result, entry[1]))
+    if results:
+        yield normalize_file(file, name_only), results
+
+
+@lru_cache(maxsize=65536)
+def normalize_detail(detail: str) -> str:
+    """照合用の詳細（全角/半角・空白の差を無視し、数字を同一視する）"""
+    text = DIGITS.sub('#', unicodedata.normalize('NFKC', detail))
+    return SPACES.sub(' ', text).strip()
+
+
+@lru_cache(maxsize=65536)
+def item_key(item: str):
+    """項目名から (対象セル, チェックの種類) を返す。セルを判定できない項目は項目名の後半をセルの代わりに使う"""
+    from annotate import cell_ref, finding_cell
+    check, _, rest = item.partition(' - ')
+    cell = finding_cell({'item': item})
+    return (cell_ref(*cell) if cell is not None else rest), check
+
+
+def normalize_file(file, name_only=False) -> str:
+    file = str(file or '').replace('\\', '/')
+    return file.rpartition('/')[2] if name_only else file
+
+
+def finding_key(packed: tuple, file: str):
+    """(ファイル, セル, チェックの種類, 種類, 正規化した詳細)"""
+    item, kind, _, detail, _ = packed
+    return (file, *item_key(item), kind, normalize_detail(detail))
+
+
+class PartitionWriter:
+    """ファイルごとの指摘をファイル名のハッシュで分割し、分割ごとの一時ファイルに書き出す"""
+
+    def __init__(self, directory: str, side: str, partitions: int):
+        self.paths = [os.path.join(directory, f"{side}-{number}.pickle") for number in range(partitions)]
+        self.files = [open(path, 'wb') for path in self.paths]
+        self.buffers = [[] for _ in self.paths]
+        self.sizes = [0] * partitions
+
+    def add(self, file: str, results):
+        partition = zlib.crc32(file.encode('utf-8')) % len(self.paths)
+        self.buffers[partition].append((file, results))
+        self.sizes[partition] += len(results)
+        if self.sizes[partition] >= SPILL_BATCH:
+            self.spill(partition)
+
+    def spill(self, partition: int):
+        pickle.dump(self.buffers[partition], self.files[partition], pickle.HIGHEST_PROTOCOL)
+        self.buffers[partition] = []
+        self.sizes[partition] = 0
+
+    def close(self):
+        for partition, f in enumerate(self.files):
+            if self.buffers[partition]:
+                self.spill(partition)
+            f.close()
+
+
+def read_partition(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+class ResultDiff:
+    def __init__(self, partitions=None, name_only=False):
+        """
+        partitions: 分割数（None なら入力の大きさから決める。1 なら一時ファイルを使わない）
+        name_only:  ファイルをパスではなくファイル名で照合する
+        """
+        self.partitions = partitions
+        self.name_only = name_only
+        self.counts = {'前回': 0, '今回': 0, '解消': 0, '新規': 0, '継続': 0}
+
+    def compare(self, old_path: str, new_path: str):
+        """
+        ファイルごとに (ファイル, 解消した指摘のリスト, 新しく出た指摘のリスト) を返す。
+        変化のないファイルは返さない。
+        """
+        partitions = self.partitions
+        if partitions is None:
+            size = input_size(old_path) + input_size(new_path)
+            partitions = max(1, -(-size // PARTITION_BYTES))
+        if partitions == 1:
+            yield from self.compare_partition(read_entries(old_path, self.name_only),
+                                              read_entries(new_path, self.name_only))
+            return
+
+        with tempfile.TemporaryDirectory(prefix='check_excel_diff-') as directory:
+            paths = []
+            for side, path in (('old', old_path), ('new', new_path)):
+                writer = PartitionWriter(directory, side, partitions)
+                try:
+                    for file, results in read_entries(path, self.name_only):
+                        writer.add(file, results)
+                finally:
+                    writer.close()
+                paths.append(writer.paths)
+            for old_partition, new_partition in zip(*paths):
+                yield from self.compare_partition(read_partition(old_partition), read_partition(new_partition))
+
+    def compare_partition(self, old_entries, new_entries):
+        # 前回の側の索引: キー -> 指摘のリスト（同じ指摘が複数ある場合は件数分を照合する）
+        index = {}
+        for file, results in old_entries:
+            self.counts['前回'] += len(results)
+            for result in results:
+                index.setdefault(finding_key(result, file), []).append(result)
+        changes = {}
+        unchanged = 0
+        for file, results in new_entries:
+            self.counts['今回'] += len(results)
+            for result in results:
+                previous = index.get(finding_key(result, file))
+                if previous:
+                    previous.pop()
+                    unchanged += 1
+                else:
+                    changes.setdefault(file, ([], []))[1].append(result)
+        self.counts['継続'] += unchanged
+        for key, remaining in index.items():
+            if remaining:
+                changes.setdefault(key[0], ([], []))[0].extend(remaining)
+        for file in sorted(changes):
+            resolved, new = changes[file]
+            self.counts['解消'] += len(resolved)
+            self.counts['新規'] += len(new)
+            yield file, [unpack_result(r, file) for r in resolved], [unpack_result(r, file) for r in new]
+
+
+class DiffOutput:
+    """変化した指摘を .json（配列）または 1行1JSON（.ndjson / .jsonl）で書き出す"""
+
+    def __init__(self, path: str):
+        self.array = path.endswith('.json')
+        self.file = open(path, 'w', encoding='utf-8')
+        self.count = 0
+        if self.array:
+            self.file.write('[')
+
+    def write(self, change: str, result: dict):
+        line = json.dumps(dict(result, change=change), ensure_ascii=False)
+        if self.array:
+            line = ('\n  ' if not self.count else ',\n  ') + line
+        else:
+            line += '\n'
+        self.file.write(line)
+        self.count += 1
+
+    def close(self):
+        if self.array:
+            self.file.write('\n]\n' if self.count else ']\n')
+        self.file.close()
+
+
+def diff_main(argv=None):
+    import argparse
+    from excel_validator_cli import setup_console_encoding
+
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py diff',
+                                     description='2回分のチェック結果を比べ、解消した指摘と新しく出た指摘を表示')
+    parser.add_argument('old', help='前回の結果（.json / .txt / ジャーナル / キューや --state のフォルダ）')
+    parser.add_argument('new', help='今回の結果')
+    parser.add_argument('-o', '--output', help='変化した指摘を保存するファイル名（.json or .ndjson）')
+    parser.add_argument('--counts', action='store_true', help='指摘を1件ずつ表示せず、ファイルごとの件数だけを表示する')
+    parser.add_argument('--name-only', action='store_true',
+                        help='ファイルをパスではなくファイル名で照合する（フォルダを移動した場合など）')
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='一時ファイルへの分割数（既定: 入力の大きさから決める。1 で分割しない）')
+    args = parser.parse_args(argv)
+    if args.output and not args.output.endswith(('.json', '.ndjson', '.jsonl')):
+        parser.error('-o には .json / .ndjson / .jsonl のファイル名を指定してください')
+    if args.partitions is not None and args.partitions < 1:
+        parser.error('--partitions には1以上を指定してください')
+
+    setup_console_encoding()
+    for path in (args.old, args.new):
+        if not os.path.exists(path):
+            print(f"エラー: ファイルが見つかりません: {path}")
+            return 1
+
+    diff = ResultDiff(args.partitions, args.name_only)
+    output = DiffOutput(args.output) if args.output else None
+    changed_files = 0
+    # 照合中に作る大量のタプル・リストは循環参照を持たないため、GC の走査を止めて速くする
+    gc.disable()
+    try:
+        for file, resolved, new in diff.compare(args.old, args.new):
+            changed_files += 1
+            print(f"\nファイル: {file or '（ファイル名なし）'}（解消 {len(resolved)}件 / 新規 {len(new)}件）")
+            for change, results in zip(CHANGES, (resolved, new)):
+                for result in results:
+                    if not args.counts:
+                        print(f"  [{change}] {result.get('item', '')}: {result.get('detail', '')}")
+                    if output is not None:
+                        output.write(change, result)
+    except (OSError, ValueError, pickle.UnpicklingError) as e:
+        print(f"エラー: 結果を読み込めません: {e}")
+        return 1
+    finally:
+        gc.enable()
+        if output is not None:
+            output.close()
+
+    counts = diff.counts
+    print("\n\n比較結果:")
+    print("=" * 80)
+    print(f"前回: {counts['前回']}件 / 今回: {counts['今回']}件（変化のあったファイル: {changed_files}件）")
+    print(f"解消: {counts['解消']}件 / 新規: {counts['新規']}件 / 継続: {counts['継続']}件")
+    print("=" * 80)
+    if output is not None:
+        print(f"変化した指摘を保存しました: {args.output}")
+    sys.stdout.flush()
+    # 新しく出た指摘がある場合は、--min-severity と同じく終了コード 2 を返す
+    return 2 if counts['新規'] else 0
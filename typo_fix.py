@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+誤字の自動修正（--fix）
+誤字脱字チェックで見つかる誤りのうち、直し方が1通りに決まるものだけを、
+ブックを openpyxl で読み込まずに共有文字列（xl/sharedStrings.xml）と
+シート内のインライン文字列を逐次書き換えて修正します。
+
+- 各パートは展開しながら書き換え、そのまま圧縮し直す（全体をメモリに展開しない）
+- 誤りを含まないパートは展開前のバイト列をそのままコピーし、修正箇所のないファイルは書き込まない
+- ふりがな（<rPh>）は書き換えず、ふりがな付きの文字列では文字数の変わる修正を行わない
+  （ふりがなは元の文字列の文字位置を参照しているため）
+- 書式の異なる部分（リッチテキストの run）にまたがる誤りは修正しない（チェックでは報告される）
+
+  python3 excel_validator_cli.py 報告書フォルダ/ --fix --dry-run   # 修正内容の確認のみ
+  python3 excel_validator_cli.py 報告書フォルダ/ --fix
+"""
+
+import codecs
+import io
+import re
+import zipfile
+from xml.sax.saxutils import unescape
+
+from excel_validator_cli import COMMON_TYPOS
+from report_reader import workbook_sheets
+from zip_patch import save_patched_zip
+
+# 自動修正する誤り。「ゆう」（夕・ゆうべ等）や「そうして」（正しい語）のように文脈によっては
+# 誤りでないもの、「出来る」「分かる」のような表記の好みは、報告のみで修正しない
+SAFE_TYPOS = ('そしして', 'とゆうこと', 'とゆう事', 'そうゆう', 'どうゆう',
+              'いっしょうけんめい', 'いっしょけんめい')
+SAFE_FIXES = {typo: correct for correct, typos in COMMON_TYPOS.items()
+              for typo in typos if typo in SAFE_TYPOS}
+
+SHARED_STRINGS = 'xl/sharedStrings.xml'
+CHUNK_SIZE = 64 * 1024
+SNIPPET_CONTEXT = 15
+
+TAG_NAME = re.compile(r'<(/?)(?:\w+:)?(\w+)')
+UNIT_TOKEN = re.compile(r'<[^>]*>|[^<]+')
+
+
+def fix_pattern(typos):
+    # 長いものから照合する（「とゆうこと」を「とゆう事」等より優先）
+    typos = sorted(typos, key=len, reverse=True)
+    return re.compile('|'.join(map(re.escape, typos))) if typos else None
+
+
+FIX_PATTERN = fix_pattern(SAFE_FIXES)
+# ふりがな付きの文字列で使う、文字数の変わらない修正だけのパターン
+SAME_LENGTH_PATTERN = fix_pattern(typo for typo, correct in SAFE_FIXES.items() if len(typo) == len(correct))
+# 展開したXMLのバイト列から修正候補の有無を調べるためのパターン
+BYTES_PATTERN = re.compile(b'|'.join(re.escape(typo.encode('utf-8')) for typo in SAFE_FIXES))
+MAX_TYPO_BYTES = max(len(typo.encode('utf-8')) for typo in SAFE_FIXES)
+
+
+def apply_fixes(text: str, pattern=FIX_PATTERN) -> str:
+    if pattern is None:
+        return text
+    return pattern.sub(lambda match: SAFE_FIXES[match.group(0)], text)
+
+
+class StringRewriter:
+    """
+    XMLを少しずつ受け取り、書き換えたXMLを返す。修正候補を含む unit 要素（共有文字列の si /
+    シートのセル c）だけを解析して、その中の t 要素の文字列に修正を適用し、修正内容を
+    changes に記録する。候補を含まない部分は解析せずにそのまま返す。
+    """
+
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.unit_start = re.compile(rf'<(?:\w+:)?{unit}[\s/>]')
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.pending = ''
+        # unit 要素の開始タグ・終了タグの文字列（最初の unit 要素で接頭辞を判定する）
+        self.open_tags = None
+        self.close_tag = None
+        self.count = 0
+        # [(位置, 修正前, 修正後), ...]。位置は si の番号、またはセル参照
+        self.changes = []
+
+    def feed(self, data: bytes) -> bytes:
+        text = self.pending + self.decoder.decode(data)
+        if self.open_tags is None:
+            match = self.unit_start.search(text)
+            if match is None:
+                # 末尾の '<' 以降は unit 要素の開始タグの途中かもしれないため次回に回す
+                cut = text.rfind('<')
+                cut = len(text) if cut < 0 else cut
+                self.pending = text[cut:]
+                return text[:cut].encode('utf-8')
+            opening = match.group(0)[:-1]
+            self.open_tags = (opening + ' ', opening + '>')
+            self.close_tag = '</' + opening[1:] + '>'
+        # 最後の unit 要素は途中までしか届いていない可能性があるため次回に回す
+        boundary = max(text.rfind(tag) for tag in self.open_tags)
+        if boundary <= 0:
+            self.pending = text
+            return b''
+        self.pending = text[boundary:]
+        return self._process(text[:boundary]).encode('utf-8')
+
+    def close(self) -> bytes:
+        text = self.pending + self.decoder.decode(b'', final=True)
+        self.pending = ''
+        if self.open_tags is None:
+            return text.encode('utf-8')
+        return self._process(text).encode('utf-8')
+
+    def _count_units(self, text: str, start: int, end: int) -> int:
+        return sum(text.count(tag, start, end) for tag in self.open_tags)
+
+    def _process(self, text: str) -> str:
+        """unit 要素の区切りで終わる text について、修正候補を含む unit 要素だけを書き換える"""
+        out = []
+        done = 0
+        for match in FIX_PATTERN.finditer(text):
+            if match.start() < done:
+                continue
+            start = max(text.rfind(tag, done, match.start()) for tag in self.open_tags)
+            if start < 0:
+                continue
+            end = text.find(self.close_tag, start)
+            if end < 0 or end < match.start() or text[text.find('>', start) - 1] == '/':
+                # unit 要素の外側（シートのヘッダー等）の文字列は修正しない
+                continue
+            end += len(self.close_tag)
+            self.count += self._count_units(text, done, start)
+            out.append(text[done:start])
+            out.append(self._rewrite_unit(text[start:end]))
+            self.count += 1
+            done = end
+        self.count += self._count_units(text, done, len(text))
+        out.append(text[done:])
+        return ''.join(out)
+
+    def _rewrite_unit(self, xml: str) -> str:
+        """1つの unit 要素の t 要素の文字列を修正する（ふりがなは書き換えない）"""
+        tokens = UNIT_TOKEN.findall(xml)
+        has_phonetic = any(TAG_NAME.match(token) and TAG_NAME.match(token).group(2) == 'rPh'
+                           for token in tokens)
+        pattern = SAME_LENGTH_PATTERN if has_phonetic else FIX_PATTERN
+        in_text = in_phonetic = False
+        parts, before, after = [], [], []
+        for token in tokens:
+            if token.startswith('<'):
+                closing, name = TAG_NAME.match(token).groups()
+                opening = not closing and not token.endswith('/>')
+                if name == 't':
+                    in_text = opening
+                elif name == 'rPh':
+                    in_phonetic = opening
+            elif in_text and not in_phonetic:
+                fixed = apply_fixes(token, pattern)
+                before.append(token)
+                after.append(fixed)
+                token = fixed
+            parts.append(token)
+        if before != after:
+            location = self.count if self.unit == 'si' else get_cell_ref(tokens[0])
+            self.changes.append((location, unescape(''.join(before)), unescape(''.join(after))))
+        return ''.join(parts)
+
+
+def get_cell_ref(tag: str):
+    match = re.search(r'\sr="([^"]*)"', tag)
+    return match.group(1) if match else None
+
+
+def has_typo_candidates(archive: zipfile.ZipFile, name: str) -> bool:
+    """パートを展開しながら、修正候補の文字列が含まれるかだけを調べる"""
+    tail = b''
+    with archive.open(name) as stream:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return False
+            if BYTES_PATTERN.search(tail + chunk):
+                return True
+            tail = chunk[-(MAX_TYPO_BYTES - 1):]
+
+
+def rewrite_chunks(archive: zipfile.ZipFile, name: str, rewriter: StringRewriter):
+    """パートを展開しながら書き換え、書き換えたバイト列を順に返す"""
+    with archive.open(name) as stream:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = rewriter.feed(chunk)
+            if data:
+                yield data
+    data = rewriter.close()
+    if data:
+        yield data
+
+
+def fix_report(path: str, dry_run=False):
+    """
+    報告書の誤字を修正する（dry_run なら修正内容を調べるだけで書き込まない）。
+    戻り値: [(パート名, 位置の表示, 修正前, 修正後), ...]
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    names = set(archive.namelist())
+    sheets, _ = workbook_sheets(archive)
+
+    targets = [(SHARED_STRINGS, 'si', '共有文字列 {}')] if SHARED_STRINGS in names else []
+    targets += [(sheet_path, 'c', f"{sheet_name}!{{}}") for sheet_name, sheet_path in sheets
+                if sheet_path in names]
+
+    changes = []
+    replacements = {}
+    for name, unit, label in targets:
+        if not has_typo_candidates(archive, name):
+            continue
+        rewriter = StringRewriter(unit)
+        for _ in rewrite_chunks(archive, name, rewriter):
+            pass
+        if rewriter.changes:
+            changes += [(name, label.format(location), before, after)
+                        for location, before, after in rewriter.changes]
+            replacements[name] = (lambda name=name, unit=unit:
+                                  rewrite_chunks(archive, name, StringRewriter(unit)))
+
+    if replacements and not dry_run:
+        save_patched_zip(data, replacements, path)
+    return changes
+
+
+def diff_snippet(before: str, after: str):
+    """修正前後の文字列から、変わった部分の前後だけを切り出す"""
+    start = 0
+    while start < min(len(before), len(after)) and before[start] == after[start]:
+        start += 1
+    end = 0
+    while (end < min(len(before), len(after)) - start
+           and before[len(before) - 1 - end] == after[len(after) - 1 - end]):
+        end += 1
+
+    def snippet(text):
+        left = max(0, start - SNIPPET_CONTEXT)
+        right = min(len(text), len(text) - end + SNIPPET_CONTEXT)
+        body = text[left:right].replace('\n', '↵')
+        return ('…' if left else '') + body + ('…' if right < len(text) else '')
+    return snippet(before), snippet(after)
+
+
+def fix_reports(paths, dry_run=False) -> int:
+    """ファイル・フォルダの報告書の誤字を修正し、終了コードを返す"""
+    from batch import iter_report_sources
+    from xls_reader import is_xls
+
+    fixed_files = fixed_count = failed = 0
+    for source in iter_report_sources(paths):
+        if source.member is not None:
+            print(f"スキップ: {source.key}（zip内の報告書は修正できません）")
+            continue
+        try:
+            if is_xls(source.path):
+                print(f"スキップ: {source.key}（旧形式（.xls）の報告書は修正できません）")
+                continue
+            changes = fix_report(source.path, dry_run=dry_run)
+        except Exception as e:
+            print(f"エラー: {source.key}: {e}")
+            failed += 1
+            continue
+        if not changes:
+            continue
+        fixed_files += 1
+        fixed_count += len(changes)
+        print(source.key)
+        for name, location, before, after in changes:
+            old, new = diff_snippet(before, after)
+            print(f"  {location}")
+            print(f"    - {old}")
+            print(f"    + {new}")
+
+    if dry_run:
+        print(f"\n修正予定: {fixed_files}ファイル / {fixed_count}箇所（--dry-run のため変更していません）")
+    else:
+        print(f"\n修正しました: {fixed_files}ファイル / {fixed_count}箇所")
+    return 1 if failed else 0
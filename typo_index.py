@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+語彙による誤字の検出（SymSpell 方式の索引、--vocabulary）
+提出済みの報告書と辞書（1行1語のテキスト）から語彙の索引を作っておき、チェック時に
+語彙にない語を、編集距離の近い語彙の候補とともに報告します。
+
+対象はカタカナ語（4文字以上）と英単語です。日本語は分かち書きされないため、
+文字種の切れ目で語を取り出していますが、漢字の並びは複数の語が連結されることが多く
+（例: 数学定期）未知語の判定が当てにならないため対象外としています。
+ひらがなの誤り（「ゆう」等）は従来どおり COMMON_TYPOS で検出します。
+
+索引の形式（リトルエンディアンの uint32 配列を並べたファイル）:
+  ヘッダー / 語の出現回数 / 語の開始位置 / 削除形のハッシュ（昇順）/ 候補リストの開始位置 /
+  候補リスト（語の番号）/ 語（UTF-8）
+語彙の各語から最大編集距離までの文字の削除形を作り、削除形のハッシュから語を引けるように
+しておきます（symmetric delete）。検索時は入力の削除形のハッシュを二分探索し、候補の語との
+編集距離を確認します。ハッシュの衝突は編集距離の確認で除かれるため、削除形の文字列自体は
+保存しません。読み込みはファイルを mmap するだけで、解析は行いません。
+
+  python3 excel_validator_cli.py typo-index build 語彙.idx 提出済み/ --dictionary 辞書.txt
+  python3 excel_validator_cli.py typo-index lookup 語彙.idx コミニケーション
+  python3 excel_validator_cli.py 報告書フォルダ/ --vocabulary 語彙.idx
+"""
+
+import bisect
+import os
+import re
+import struct
+import sys
+import unicodedata
+import zlib
+from collections import Counter
+
+INDEX_MAGIC = b'CXVI'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sHHIIII')
+
+# 語の取り出し: カタカナ語（長音を含む）と英単語
+TOKEN_PATTERN = re.compile(r'[ァ-ヺー]{3,}|[A-Za-z]{3,}')
+# 未知語として報告する語の最小文字数（短い語は別の正しい語と1文字違いになりやすい）
+MIN_LOOKUP_LENGTH = 4
+MAX_DISTANCE = 2
+# 語彙に含める最小出現回数（提出済みの報告書にも誤字は含まれるため、1回だけの語は除く）
+DEFAULT_MIN_COUNT = 2
+MAX_SUGGESTIONS = 3
+
+# 辞書を指定しなくても語彙に含める、報告書でよく使う語
+BASE_WORDS = (
+    'テスト', 'テキスト', 'プリント', 'ノート', 'ワーク', 'スケジュール', 'ペース', 'レベル',
+    'ポイント', 'チェック', 'ミス', 'ケアレスミス', 'アドバイス', 'サポート', 'フォロー',
+    'モチベーション', 'コミュニケーション', 'シミュレーション', 'トレーニング', 'スピード',
+    'リスニング', 'スペル', 'グラフ', 'パターン', 'イメージ', 'ステップ', 'スタート', 'クラス',
+    'プラン', 'カリキュラム', 'オンライン', 'タブレット', 'スマートフォン', 'ゲーム', 'クラブ',
+    'コツコツ', 'ペア', 'メモ', 'ルール', 'リズム', 'バランス', 'マスター', 'アップ', 'ダウン',
+)
+
+
+def tokens(text: str):
+    """文章から索引の対象となる語を取り出す"""
+    return TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', str(text)))
+
+
+def lookup_distance(word: str) -> int:
+    """語の長さに応じた許容編集距離（長い語ほど多くの誤りを許す）"""
+    return 1 if len(word) < 8 else MAX_DISTANCE
+
+
+def deletes(word: str, distance: int) -> set:
+    """word から distance 文字までを削除した文字列の集合（word 自身を含む、空文字列は除く）"""
+    result = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {candidate[:i] + candidate[i + 1:]
+                    for candidate in frontier if len(candidate) > 1
+                    for i in range(len(candidate))}
+        result |= frontier
+    return result
+
+
+def string_hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """隣接文字の入れ替えを1回と数える編集距離（limit を超えた時点で limit + 1 を返す）"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def write_index(path: str, counts: dict):
+    """語彙 {語: 出現回数} から索引ファイルを書き出す"""
+    from array import array
+
+    words = sorted(counts, key=lambda word: (-counts[word], word))
+    postings = {}
+    for word_id, word in enumerate(words):
+        for candidate in deletes(word, MAX_DISTANCE):
+            postings.setdefault(string_hash(candidate), set()).add(word_id)
+
+    word_counts = array('I', (min(counts[word], 0xFFFFFFFF) for word in words))
+    word_offsets = array('I', [0])
+    blob = bytearray()
+    for word in words:
+        blob += word.encode('utf-8')
+        word_offsets.append(len(blob))
+    hashes = array('I', sorted(postings))
+    posting_offsets = array('I', [0])
+    posting_ids = array('I')
+    for value in hashes:
+        posting_ids.extend(sorted(postings[value]))
+        posting_offsets.append(len(posting_ids))
+    if sys.byteorder != 'little':
+        for values in (word_counts, word_offsets, hashes, posting_offsets, posting_ids):
+            values.byteswap()
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, MAX_DISTANCE, len(words), len(hashes),
+                            len(posting_ids), len(blob)))
+        for values in (word_counts, word_offsets, hashes, posting_offsets, posting_ids):
+            values.tofile(f)
+        f.write(blob)
+    os.replace(temp_path, path)
+
+
+class TypoIndex:
+    """mmap した索引ファイルに対する検索（読み込み時に解析しない）"""
+
+    def __init__(self, path: str):
+        import mmap
+        if sys.byteorder != 'little':
+            raise ValueError("語彙の索引はリトルエンディアンの環境でのみ読み込めます")
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_distance, word_count, hash_count, posting_count, blob_size = \
+            HEADER.unpack_from(self.mmap)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"語彙の索引ではないか、形式が異なります: {path}")
+        view = memoryview(self.mmap)
+        position = HEADER.size
+
+        def section(count):
+            nonlocal position
+            start, position = position, position + count * 4
+            return view[start:position].cast('I')
+
+        self.counts = section(word_count)
+        self.word_offsets = section(word_count + 1)
+        self.hashes = section(hash_count)
+        self.posting_offsets = section(hash_count + 1)
+        self.postings = section(posting_count)
+        self.blob = view[position:position + blob_size]
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def word(self, word_id: int) -> str:
+        return str(self.blob[self.word_offsets[word_id]:self.word_offsets[word_id + 1]], 'utf-8')
+
+    def candidates(self, text: str):
+        """削除形 text のハッシュに対応する語の番号"""
+        value = string_hash(text)
+        position = bisect.bisect_left(self.hashes, value)
+        if position == len(self.hashes) or self.hashes[position] != value:
+            return ()
+        return self.postings[self.posting_offsets[position]:self.posting_offsets[position + 1]]
+
+    def __contains__(self, word: str) -> bool:
+        return any(self.word(word_id) == word for word_id in self.candidates(word))
+
+    def suggest(self, word: str, limit=MAX_SUGGESTIONS):
+        """
+        語彙にない語の候補を [(候補, 編集距離, 出現回数), ...]（距離の近い順、同じ距離は出現回数の多い順）
+        で返す。語彙にある語は空のリストを返す。
+        """
+        if word in self.cache:
+            return self.cache[word]
+        suggestions = []
+        # 報告書の語の大半は語彙にあるため、削除形を作る前に語自体のハッシュだけで確認する
+        if word not in self:
+            distance = min(lookup_distance(word), self.max_distance)
+            found = {}
+            for candidate in deletes(word, distance):
+                for word_id in self.candidates(candidate):
+                    if word_id not in found:
+                        found[word_id] = edit_distance(word, self.word(word_id), distance)
+            suggestions = sorted(((self.word(word_id), value, self.counts[word_id])
+                                  for word_id, value in found.items() if value <= distance),
+                                 key=lambda item: (item[1], -item[2]))[:limit]
+        if len(self.cache) < 100000:
+            self.cache[word] = suggestions
+        return suggestions
+
+    def check_text(self, text: str):
+        """文章中の語彙にない語と候補を [(語, [候補, ...]), ...] で返す（候補のない語は含めない）"""
+        reported = []
+        seen = set()
+        for word in tokens(text):
+            if len(word) < MIN_LOOKUP_LENGTH or word in seen:
+                continue
+            seen.add(word)
+            suggestions = self.suggest(word)
+            if suggestions:
+                reported.append((word, [suggestion for suggestion, _, _ in suggestions]))
+        return reported
+
+
+# パス -> ((inode, 更新時刻, サイズ), 開いた索引)
+_loaded = {}
+
+
+def load_index(path: str) -> TypoIndex:
+    """
+    索引をプロセス内で1度だけ開く（チェックのたびに開き直さない）。
+    typo-index build でファイルが置き換えられた場合（inode・更新時刻・サイズが変わった場合）は開き直すため、
+    常駐サーバーやワーカーを再起動する必要はない。古い索引の mmap は、使用中のチェックが終わって
+    参照がなくなった時点で閉じられる（並行して処理中の要求があるため、ここでは閉じない）。
+    """
+    import metrics
+    info = os.stat(path)
+    stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+    loaded = _loaded.get(path)
+    hit = loaded is not None and loaded[0] == stamp
+    metrics.inc('check_excel_cache_requests_total', cache='vocabulary', result='hit' if hit else 'miss')
+    if not hit:
+        loaded = _loaded[path] = (stamp, TypoIndex(path))
+    return loaded[1]
+
+
+def read_dictionary(path: str):
+    """辞書ファイル（1行1語。タブの後に出現回数を書いてもよい。# 以降はコメント）の語を返す"""
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            word, _, count = line.partition('\t')
+            yield unicodedata.normalize('NFKC', word.strip()), int(count) if count.strip() else None
+
+
+def build_index(output: str, paths, dictionaries=(), min_count=DEFAULT_MIN_COUNT, reader='stream') -> int:
+    """提出済みの報告書と辞書から索引を作る。終了コードを返す"""
+    from batch import BatchValidator, iter_report_sources
+    from excel_validator_cli import TEXT_SECTIONS
+
+    corpus = Counter()
+    batch = BatchValidator(None, options={}, reader=reader)
+    files = failed = 0
+    try:
+        for source in iter_report_sources(paths):
+            try:
+                snapshot = batch.read_snapshot(source)
+            except Exception as e:
+                print(f"エラー: {source.key}: {e}")
+                failed += 1
+                continue
+            for row, col, _, _ in TEXT_SECTIONS.values():
+                content = snapshot.cell(row=row, column=col).value
+                if content:
+                    corpus.update(tokens(content))
+            files += 1
+    finally:
+        batch.archives.close()
+
+    counts = {word: count for word, count in corpus.items() if count >= min_count}
+    for word in BASE_WORDS:
+        counts[word] = max(counts.get(word, 0), min_count)
+    dictionary_words = 0
+    for path in dictionaries:
+        for word, count in read_dictionary(path):
+            counts[word] = max(counts.get(word, 0), corpus[word], count or min_count)
+            dictionary_words += 1
+
+    write_index(output, counts)
+    print(f"語彙の索引を作成しました: {output}")
+    print(f"  報告書 {files}件（エラー {failed}件）/ 辞書 {dictionary_words}語 / 語彙 {len(counts)}語"
+          f"（出現 {min_count}回未満の {sum(1 for count in corpus.values() if count < min_count)}語は除外）")
+    return 1 if failed else 0
+
+
+def typo_index_main(argv=None):
+    import argparse
+    from excel_validator_cli import READERS, setup_console_encoding
+
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py typo-index',
+                                     description='語彙による誤字検出の索引（--vocabulary）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='提出済みの報告書と辞書から索引を作る')
+    build.add_argument('index', help='作成する索引ファイル')
+    build.add_argument('files', nargs='*', help='提出済みの報告書のファイル・フォルダ・zipアーカイブ')
+    build.add_argument('--dictionary', action='append', default=[], metavar='PATH',
+                       help='辞書ファイル（1行1語、UTF-8）。複数指定可')
+    build.add_argument('--min-count', type=int, default=DEFAULT_MIN_COUNT,
+                       help=f'報告書から語彙に含める最小出現回数（既定: {DEFAULT_MIN_COUNT}）')
+    build.add_argument('--reader', choices=READERS, default='stream', help='読み込み方式（既定: stream）')
+    lookup = subparsers.add_parser('lookup', help='語を索引で調べ、語彙にない場合は候補を表示する')
+    lookup.add_argument('index', help='索引ファイル')
+    lookup.add_argument('words', nargs='+', help='調べる語')
+    args = parser.parse_args(argv)
+
+    setup_console_encoding()
+    if args.command == 'build':
+        if not args.files and not args.dictionary:
+            parser.error('報告書か --dictionary を指定してください')
+        return build_index(args.index, args.files, args.dictionary, args.min_count, args.reader)
+
+    index = TypoIndex(args.index)
+    for word in args.words:
+        word = unicodedata.normalize('NFKC', word)
+        if word in index:
+            print(f"{word}: 語彙にあります")
+            continue
+        suggestions = index.suggest(word)
+        candidates = ', '.join(f"{candidate}（距離 {distance}, {count}回）"
+                               for candidate, distance, count in suggestions)
+        print(f"{word}: 語彙にありません" + (f" / 候補: {candidates}" if candidates else ''))
+    return 0
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常駐チェックサーバー
+openpyxl とチェックルールを読み込んだままのプロセスを起動しておき、
+ローカルのUnixドメインソケット経由でファイルパスを受け取ってチェック結果を返します。
+保存フック等から1ファイルずつ呼び出す場合に、毎回のインタプリタ起動と
+openpyxl の読み込みコストを省けます。
+
+起動:
+  python3 excel_validator_cli.py serve [--socket PATH]
+利用（クライアント）:
+  python3 excel_validator_cli.py 報告書.xlsx --socket PATH
+  （または環境変数 CHECK_EXCEL_SOCKET にソケットパスを設定）
+
+プロトコル: 1行1JSON（UTF-8）。
+  要求: {"file": "/abs/path.xlsx", "options": {"check_scores": true, ...}}
+  応答: {"result": {...}} をチェック結果の件数だけ送った後、
+        {"status": "ok"} または {"status": "error", "message": "..."} で終了
+"""
+
+import json
+import os
+import socket
+import sys
+
+# クライアントから受け付けるチェックオプション
+CHECK_OPTIONS = ('check_scores', 'check_text_length', 'check_spelling', 'check_content',
+                 'min_severity', 'fail_fast', 'reader', 'vocabulary', 'phrase_model',
+                 'skip')
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, f'check_excel-{os.getuid()}.sock')
+
+
+def check_via_server(validator, socket_path: str, file_path: str, options: dict):
+    """
+    常駐サーバーにチェックを依頼し、結果を validator に格納して表示する。
+    サーバーに接続できない場合は None を返す（呼び出し側でローカル実行に切り替える）。
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile('rwb') as stream:
+        request = {'file': os.path.abspath(file_path), 'options': options}
+        stream.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        stream.flush()
+
+        validator.validation_results = []
+        for line in stream:
+            message = json.loads(line)
+            if 'result' in message:
+                validator.validation_results.append(message['result'])
+            elif message.get('status') == 'ok':
+                validator.log(f"\nファイルを検証中: {file_path}（常駐サーバー）")
+                validator.log("=" * 80)
+                validator.display_results()
+                return True
+            else:
+                print(f"エラー: {message.get('message', '不明なエラー')}")
+                return False
+
+    print("エラー: 常駐サーバーとの接続が途中で切断されました")
+    return False
+
+
+def serve(socket_path: str, memory_trace=None):
+    """
+    memory_trace: MemoryTrace。指定すると要求ごとのメモリ使用量を1行ずつ表示し、終了時と
+                  SIGUSR1 受信時に全体の集計を表示する（計測中は要求を1件ずつ処理する）
+    """
+    import socketserver
+    import threading
+    from contextlib import nullcontext
+
+    # チェックエンジンと openpyxl を起動時に読み込んでおく
+    import openpyxl  # noqa: F401
+    import metrics
+    from excel_validator_cli import StudentReportValidatorCLI, SEVERITY_RANK
+    from report_reader import READERS
+
+    # 同時に処理した要求の割り当てが混ざらないよう、計測中は要求を1件ずつ処理する
+    trace_lock = threading.Lock() if memory_trace is not None else nullcontext()
+    metrics.set_gauge('check_excel_queue_depth', 0, queue='server')
+
+    class ValidationRequestHandler(socketserver.StreamRequestHandler):
+        def send(self, message):
+            self.wfile.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                file_path = request['file']
+                options = {key: value for key, value in request.get('options', {}).items()
+                           if key in CHECK_OPTIONS}
+                if options.get('min_severity') not in (None, *SEVERITY_RANK):
+                    raise ValueError(f"min_severity: {options['min_severity']}")
+                if options.get('reader') not in (None, *READERS):
+                    raise ValueError(f"reader: {options['reader']}")
+            except (ValueError, KeyError, AttributeError) as e:
+                self.send({'status': 'error', 'message': f"不正な要求です: {e}"})
+                return
+
+            if not os.path.exists(file_path):
+                self.send({'status': 'error', 'message': f"ファイルが見つかりません: {file_path}"})
+                return
+
+            validator = StudentReportValidatorCLI(verbose=False)
+            metrics.inc('check_excel_queue_depth', queue='server')
+            with trace_lock:
+                try:
+                    with memory_trace.track(file_path) if memory_trace is not None else nullcontext():
+                        results = validator.run_checks(file_path, **options)
+                except Exception as e:
+                    self.send({'status': 'error',
+                               'message': f"ファイルの読み込み中にエラーが発生しました:\n{str(e)}"})
+                    return
+                finally:
+                    metrics.inc('check_excel_queue_depth', -1, queue='server')
+                    if memory_trace is not None:
+                        print(memory_trace.last_line())
+                        sys.stdout.flush()
+
+            for result in results:
+                self.send({'result': result})
+            self.send({'status': 'ok'})
+
+    class ValidationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    # 前回異常終了したサーバーのソケットファイルが残っている場合は削除する
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+        else:
+            print(f"エラー: 既にサーバーが起動しています: {socket_path}")
+            return 1
+        finally:
+            probe.close()
+
+    # ソケットは起動したユーザーのみ読み書きできるようにする
+    old_umask = os.umask(0o177)
+    try:
+        server = ValidationServer(socket_path, ValidationRequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    print(f"常駐チェックサーバーを起動しました: {socket_path}")
+    print("終了するには Ctrl+C を押してください")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        if memory_trace is not None:
+            memory_trace.report(sys.stdout)
+    return 0
+
+
+def serve_main(argv=None):
+    import argparse
+    from excel_validator_cli import add_metrics_arguments
+    parser = argparse.ArgumentParser(prog='excel_validator_cli.py serve',
+                                     description='常駐チェックサーバーを起動')
+    parser.add_argument('--socket', default=os.environ.get('CHECK_EXCEL_SOCKET') or default_socket_path(),
+                        help='待ち受けるUnixドメインソケットのパス')
+    parser.add_argument('--trace-memory', action='store_true',
+                        default=os.environ.get('CHECK_EXCEL_TRACE_MEMORY', '') not in ('', '0'),
+                        help='要求ごとのメモリ使用量を表示し、終了時と SIGUSR1 受信時に'
+                             '割り当ての多い箇所と常駐メモリの推移を表示する'
+                             '（環境変数 CHECK_EXCEL_TRACE_MEMORY でも指定可）')
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print("エラー: この環境ではUnixドメインソケットを利用できません")
+        return 1
+
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # SIGTERM でもソケットファイルを片付けて終了する
+    signal.signal(signal.SIGTERM, stop)
+
+    memory_trace = None
+    if args.trace_memory:
+        from memory_trace import MemoryTrace
+        memory_trace = MemoryTrace()
+        # kill -USR1 <pid> で、止めずに集計を表示する
+        signal.signal(signal.SIGUSR1, lambda signum, frame: memory_trace.report(sys.stdout))
+
+    import metrics
+    try:
+        exporter = metrics.start_export(args)
+    except OSError as e:
+        print(f"エラー: メトリクスの出力を開始できません: {e}")
+        return 1
+    try:
+        return serve(args.socket, memory_trace)
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == "__main__":
+    sys.exit(serve_main())
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+旧形式（.xls、Excel 97-2003 / BIFF8）の報告書の読み込み
+.xls は OLE2 複合ファイルの中に BIFF8 のレコード列（Workbook ストリーム）を持つ形式です。
+openpyxl では読めないため、必要な部分だけを直接解析します。
+
+- OLE2: ヘッダー・FAT・ディレクトリから Workbook ストリームだけを取り出す
+- ブック全体のレコード: シート一覧（BOUNDSHEET）・アクティブシート（WINDOW1）・
+  共有文字列（SST と CONTINUE）の位置だけを記録する
+- アクティブシート: セルのレコード（LABELSST・NUMBER・RK・MULRK・LABEL・BOOLERR・FORMULA）を
+  読み、共有文字列は参照されたインデックスまでしかデコードしない
+
+値は report_reader の stream バックエンドに合わせ、整数値の数値は int、真偽値は bool、
+エラー値は '#DIV/0!' 等の文字列で返します（日付の書式は解釈せず数値のまま）。
+"""
+
+import struct
+
+from report_reader import ReportCell
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# OLE2 のセクター番号の特殊値
+END_OF_CHAIN = 0xFFFFFFFE
+
+# BIFF8 のレコード番号
+BOF = 0x0809
+EOF = 0x000A
+FILEPASS = 0x002F
+CONTINUE = 0x003C
+WINDOW1 = 0x003D
+BOUNDSHEET = 0x0085
+SST = 0x00FC
+LABELSST = 0x00FD
+NUMBER = 0x0203
+RK = 0x027E
+MULRK = 0x00BD
+LABEL = 0x0204
+RSTRING = 0x00D6
+BOOLERR = 0x0205
+FORMULA = 0x0006
+STRING = 0x0207
+
+BIFF8_VERSION = 0x0600
+
+ERROR_VALUES = {0x00: '#NULL!', 0x07: '#DIV/0!', 0x0F: '#VALUE!', 0x17: '#REF!',
+                0x1D: '#NAME?', 0x24: '#NUM!', 0x2A: '#N/A'}
+
+
+def is_xls(source) -> bool:
+    """OLE2 複合ファイル（.xls）かどうかを先頭の8バイトで判定する"""
+    if hasattr(source, 'read'):
+        position = source.tell()
+        head = source.read(len(OLE_SIGNATURE))
+        source.seek(position)
+    else:
+        try:
+            with open(source, 'rb') as f:
+                head = f.read(len(OLE_SIGNATURE))
+        except OSError:
+            return False
+    return head == OLE_SIGNATURE
+
+
+def read_ole_stream(data: bytes, names=('Workbook', 'Book')):
+    """OLE2 複合ファイルから、names のうち最初に見つかったストリームの内容を返す"""
+    if data[:8] != OLE_SIGNATURE:
+        raise ValueError(".xls（OLE2 形式）のファイルではありません")
+    sector_shift, mini_shift = struct.unpack_from('<HH', data, 0x1E)
+    sector_size = 1 << sector_shift
+    mini_size = 1 << mini_shift
+    fat_count, directory_start = struct.unpack_from('<II', data, 0x2C)
+    mini_cutoff, minifat_start, minifat_count, difat_start, difat_count = struct.unpack_from('<IIIII', data, 0x38)
+
+    def sector(number):
+        offset = (number + 1) * sector_size
+        return data[offset:offset + sector_size]
+
+    # FAT の位置はヘッダーの109件と、続きの DIFAT セクターに書かれている
+    fat_sectors = [n for n in struct.unpack_from('<109I', data, 0x4C) if n < END_OF_CHAIN]
+    per_difat = sector_size // 4 - 1
+    number = difat_start
+    for _ in range(difat_count):
+        if number >= END_OF_CHAIN:
+            break
+        entries = struct.unpack(f'<{per_difat + 1}I', sector(number))
+        fat_sectors.extend(n for n in entries[:per_difat] if n < END_OF_CHAIN)
+        number = entries[per_difat]
+    fat_sectors = fat_sectors[:fat_count]
+    fat = struct.unpack(f'<{len(fat_sectors) * sector_size // 4}I',
+                        b''.join(sector(n) for n in fat_sectors))
+
+    def chain(start, table):
+        seen = set()
+        while start < END_OF_CHAIN:
+            if start in seen or start >= len(table):
+                raise ValueError(".xls のセクターの連結が壊れています")
+            seen.add(start)
+            yield start
+            start = table[start]
+
+    def read_chain(start):
+        return b''.join(sector(n) for n in chain(start, fat))
+
+    directory = read_chain(directory_start)
+    entries = {}
+    root = None
+    for offset in range(0, len(directory) - 127, 128):
+        name_length, entry_type = struct.unpack_from('<HB', directory, offset + 0x40)
+        start, size = struct.unpack_from('<II', directory, offset + 0x74)
+        if entry_type == 5:
+            root = (start, size)
+        elif entry_type == 2 and name_length >= 2:
+            name = directory[offset:offset + name_length - 2].decode('utf-16-le', 'replace')
+            entries.setdefault(name, (start, size))
+
+    for name in names:
+        if name not in entries:
+            continue
+        start, size = entries[name]
+        if size >= mini_cutoff or root is None:
+            return read_chain(start)[:size]
+        # 小さなストリームはルートエントリのミニストリームに64バイト単位で格納されている
+        minifat_data = read_chain(minifat_start) if minifat_count else b''
+        minifat = struct.unpack(f'<{len(minifat_data) // 4}I', minifat_data)
+        mini_stream = read_chain(root[0])
+        return b''.join(mini_stream[n * mini_size:(n + 1) * mini_size]
+                        for n in chain(start, minifat))[:size]
+    raise ValueError(".xls 内にブックのデータ（Workbook ストリーム）が見つかりません")
+
+
+def iter_records(stream: bytes, position=0):
+    """BIFF レコードを (番号, 内容の開始位置, 長さ) で返す"""
+    end = len(stream)
+    unpack = struct.unpack_from
+    while position + 4 <= end:
+        record_type, length = unpack('<HH', stream, position)
+        yield record_type, position + 4, length
+        position += 4 + length
+
+
+def decode_rk(rk: int):
+    """RK形式（30ビットの整数または倍精度浮動小数点の上位30ビット、1/100倍フラグ付き）の数値"""
+    if rk & 2:
+        value = struct.unpack('<i', struct.pack('<I', rk & 0xFFFFFFFC))[0] >> 2
+    else:
+        value = struct.unpack('<d', struct.pack('<Q', (rk & 0xFFFFFFFC) << 32))[0]
+    if rk & 1:
+        value /= 100
+    return normalize_number(value)
+
+
+def normalize_number(value):
+    # xlsx を openpyxl で読んだ場合と同じく、整数値は int にする
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53:
+        return int(value)
+    return value
+
+
+def read_short_string(stream: bytes, offset: int, length_size=2):
+    """XLUnicodeString（文字数・フラグ・文字列）を (文字列, 次の位置) で返す"""
+    if length_size == 1:
+        count = stream[offset]
+    else:
+        count = struct.unpack_from('<H', stream, offset)[0]
+    offset += length_size
+    flags = stream[offset]
+    offset += 1
+    if flags & 0x01:
+        end = offset + count * 2
+        return stream[offset:end].decode('utf-16-le', 'replace'), end
+    end = offset + count
+    return stream[offset:end].decode('latin-1'), end
+
+
+class SharedStringTable:
+    """
+    SST レコード（と続く CONTINUE レコード）の共有文字列。
+    参照されたインデックスまでだけ先頭から順にデコードする。
+    文字列の途中で CONTINUE レコードに分かれる場合、続きの先頭に文字幅のフラグが入る。
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.segment = 0
+        self.position = 8 if segments else 0
+        self.total = struct.unpack_from('<I', segments[0], 4)[0] if segments else 0
+        self.strings = []
+
+    def _next_segment(self):
+        self.segment += 1
+        self.position = 0
+        if self.segment >= len(self.segments):
+            raise ValueError(".xls の共有文字列が途中で終わっています")
+
+    def _read(self, size: int) -> bytes:
+        parts = []
+        while size:
+            data = self.segments[self.segment]
+            if self.position >= len(data):
+                self._next_segment()
+                continue
+            chunk = data[self.position:self.position + size]
+            parts.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b''.join(parts)
+
+    def _read_chars(self, count: int, high_byte: bool) -> str:
+        parts = []
+        while count:
+            data = self.segments[self.segment]
+            if self.position >= len(data):
+                self._next_segment()
+                # 分割された文字列の続きは、先頭1バイトのフラグで文字幅が変わることがある
+                high_byte = bool(self.segments[self.segment][0] & 0x01)
+                self.position = 1
+                continue
+            width = 2 if high_byte else 1
+            take = min(count, (len(data) - self.position) // width)
+            end = self.position + take * width
+            raw = data[self.position:end]
+            parts.append(raw.decode('utf-16-le', 'replace') if high_byte else raw.decode('latin-1'))
+            self.position = end
+            count -= take
+        return ''.join(parts)
+
+    def _read_next(self):
+        count, flags = struct.unpack('<HB', self._read(3))
+        runs = struct.unpack('<H', self._read(2))[0] if flags & 0x08 else 0
+        extension = struct.unpack('<I', self._read(4))[0] if flags & 0x04 else 0
+        text = self._read_chars(count, bool(flags & 0x01))
+        # 書式の範囲（4バイト×数）とふりがな等の拡張データは読み飛ばす
+        self._read(runs * 4 + extension)
+        self.strings.append(text)
+
+    def __getitem__(self, index: int) -> str:
+        if index >= self.total:
+            raise IndexError(index)
+        while index >= len(self.strings):
+            self._read_next()
+        return self.strings[index]
+
+
+class XlsReport:
+    """
+    .xls のアクティブシートを読み込むバックエンド（report_reader の各バックエンドと同じ
+    cell()・close()・title を持つ）。ファイル全体をメモリに読み込み、アクティブシートのセルの
+    レコードを cell() で要求された行まで解析する（セルのレコードは行の順に並んでいる）。
+    """
+
+    def __init__(self, source):
+        if hasattr(source, 'read'):
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        try:
+            self.stream = read_ole_stream(data)
+            self.sheets, active, sst_segments = self._read_globals()
+        except (struct.error, IndexError) as e:
+            raise ValueError(f".xls の構造が壊れています（{e}）") from e
+        if not self.sheets:
+            raise ValueError(".xls にワークシートがありません")
+        self.title = self.sheets[active][0]
+        self.shared_strings = SharedStringTable(sst_segments)
+        self._records = self._iter_sheet_cells(self.sheets[active][1])
+        self._cells = {}
+        self._last_row = 0
+
+    def _read_globals(self):
+        stream = self.stream
+        records = iter_records(stream)
+        record_type, start, length = next(records, (None, 0, 0))
+        if record_type != BOF or struct.unpack_from('<H', stream, start)[0] != BIFF8_VERSION:
+            raise ValueError("Excel 97-2003（BIFF8）以外の .xls には対応していません")
+
+        # BOUNDSHEET はタブの順に並ぶ。WINDOW1 のアクティブシートはグラフシート等も含めた位置を指す
+        tabs = []
+        active = 0
+        sst_segments = []
+        previous = None
+        for record_type, start, length in records:
+            if record_type == EOF:
+                break
+            if record_type == FILEPASS:
+                raise ValueError("パスワードで保護された .xls は読み込めません")
+            if record_type == BOUNDSHEET:
+                position, visibility, sheet_type = struct.unpack_from('<IBB', stream, start)
+                name, _ = read_short_string(stream, start + 6, length_size=1)
+                tabs.append((name, position, sheet_type))
+            elif record_type == WINDOW1:
+                active = struct.unpack_from('<H', stream, start + 10)[0]
+            elif record_type == SST:
+                sst_segments.append(stream[start:start + length])
+            elif record_type == CONTINUE and previous == SST:
+                sst_segments.append(stream[start:start + length])
+                continue
+            previous = record_type
+
+        # アクティブなタブをワークシートの中の位置に直してから、グラフシート等を除く。
+        # アクティブなタブがワークシートでない場合は最初のワークシートを使う
+        worksheets = [index for index, (_, _, sheet_type) in enumerate(tabs) if sheet_type == 0]
+        sheets = [tabs[index][:2] for index in worksheets]
+        active = worksheets.index(active) if active in worksheets else 0
+        return sheets, active, sst_segments
+
+    def _iter_sheet_cells(self, position: int):
+        """シートのセルを ((行, 列), (種類, 値)) で返す（行・列は1始まり、種類 's' は共有文字列）"""
+        stream = self.stream
+        unpack = struct.unpack_from
+        depth = 0
+        pending_formula = None
+        for record_type, start, length in iter_records(stream, position):
+            if record_type == BOF:
+                depth += 1
+            elif record_type == EOF:
+                depth -= 1
+                if depth <= 0:
+                    break
+            elif depth > 1:
+                # シートに埋め込まれたグラフ等のレコードは読み飛ばす
+                continue
+            elif record_type == LABELSST:
+                row, col, _, index = unpack('<HHHI', stream, start)
+                yield (row + 1, col + 1), ('s', index)
+            elif record_type == NUMBER:
+                row, col, _, value = unpack('<HHHd', stream, start)
+                yield (row + 1, col + 1), ('v', normalize_number(value))
+            elif record_type == RK:
+                row, col, _, rk = unpack('<HHHI', stream, start)
+                yield (row + 1, col + 1), ('v', decode_rk(rk))
+            elif record_type == MULRK:
+                row, first = unpack('<HH', stream, start)
+                count = (length - 6) // 6
+                for i in range(count):
+                    rk = unpack('<I', stream, start + 4 + i * 6 + 2)[0]
+                    yield (row + 1, first + i + 1), ('v', decode_rk(rk))
+            elif record_type in (LABEL, RSTRING):
+                row, col = unpack('<HH', stream, start)
+                text, _ = read_short_string(stream, start + 6)
+                yield (row + 1, col + 1), ('v', text)
+            elif record_type == BOOLERR:
+                row, col, _, value, is_error = unpack('<HHHBB', stream, start)
+                yield (row + 1, col + 1), ('v', ERROR_VALUES.get(value, '#N/A') if is_error else bool(value))
+            elif record_type == FORMULA:
+                row, col = unpack('<HH', stream, start)
+                result = stream[start + 6:start + 14]
+                key = (row + 1, col + 1)
+                if result[6:8] != b'\xff\xff':
+                    yield key, ('v', normalize_number(unpack('<d', result)[0]))
+                elif result[0] == 0:
+                    # 文字列の結果は直後の STRING レコードに入っている
+                    pending_formula = key
+                elif result[0] == 1:
+                    yield key, ('v', bool(result[2]))
+                elif result[0] == 2:
+                    yield key, ('v', ERROR_VALUES.get(result[2], '#N/A'))
+                else:
+                    yield key, ('v', '')
+            elif record_type == STRING and pending_formula is not None:
+                yield pending_formula, ('v', read_short_string(stream, start)[0])
+                pending_formula = None
+
+    def _read_until(self, row: int):
+        while self._records is not None and self._last_row <= row:
+            try:
+                key, entry = next(self._records)
+            except StopIteration:
+                self._records = None
+                return
+            except (struct.error, IndexError) as e:
+                self._records = None
+                raise ValueError(f".xls のシートの構造が壊れています（{e}）") from e
+            self._cells[key] = entry
+            self._last_row = max(self._last_row, key[0])
+
+    def cell(self, row: int, column: int):
+        self._read_until(row)
+        entry = self._cells.get((row, column))
+        if entry is None:
+            return ReportCell(None)
+        kind, value = entry
+        return ReportCell(self.shared_strings[value] if kind == 's' else value)
+
+    def close(self):
+        self._records = None
+        self.stream = None
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+xlsx（zip）の部分的な書き換え
+指定したメンバーだけを新しい内容で圧縮し直し、それ以外のメンバーは圧縮済みの
+バイト列を元のファイルからそのままコピーします（展開・再圧縮しない）。
+中央ディレクトリはコピーしたメンバーの新しい位置に合わせて作り直します。
+"""
+
+import os
+import struct
+import time
+import zlib
+
+# zip の構造（ローカルヘッダ・中央ディレクトリ・終端レコード）
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5HLL')
+END_RECORD = struct.Struct('<4s4H2LH')
+LOCAL_SIGNATURE = b'PK\x03\x04'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+END_SIGNATURE = b'PK\x05\x06'
+
+COMPRESS_LEVEL = 6
+
+
+def central_directory(data: bytes):
+    """
+    zip の中央ディレクトリを読み、[(ファイル名, 中央ディレクトリのレコード, ローカルヘッダの位置), ...] と
+    中央ディレクトリの開始位置を返す（ZIP64 は扱わない）。
+    """
+    end = data.rfind(END_SIGNATURE, max(0, len(data) - 65536 - END_RECORD.size))
+    if end < 0:
+        raise ValueError("zipの終端レコードが見つかりません")
+    _, _, _, _, count, size, offset, _ = END_RECORD.unpack_from(data, end)
+    if offset == 0xFFFFFFFF or count == 0xFFFF:
+        raise ValueError("ZIP64形式のブックには書き込めません")
+    entries = []
+    position = offset
+    for _ in range(count):
+        fields = CENTRAL_HEADER.unpack_from(data, position)
+        if fields[0] != CENTRAL_SIGNATURE:
+            raise ValueError("zipの中央ディレクトリが壊れています")
+        name_length, extra_length, comment_length = fields[10:13]
+        record_end = position + CENTRAL_HEADER.size + name_length + extra_length + comment_length
+        name_bytes = data[position + CENTRAL_HEADER.size:position + CENTRAL_HEADER.size + name_length]
+        name = name_bytes.decode('utf-8' if fields[3] & 0x800 else 'cp437')
+        entries.append((name, data[position:record_end], fields[-1]))
+        position = record_end
+    return entries, offset
+
+
+def write_member(out, name: str, content, date_time, central_list):
+    """
+    1つのメンバーを deflate で圧縮して書き込み、中央ディレクトリのレコードを追加する。
+    content はバイト列か、バイト列を順に返すイテラブル（全体をメモリに載せずに圧縮する）。
+    サイズとCRCは書き込み後にローカルヘッダへ書き戻すため、out はシーク可能であること。
+    """
+    if isinstance(content, bytes):
+        content = (content,)
+    name_bytes = name.encode('utf-8')
+    flags = 0x800 if not name.isascii() else 0
+    dos_time = (date_time[3] << 11) | (date_time[4] << 5) | (date_time[5] // 2)
+    dos_date = ((date_time[0] - 1980) << 9) | (date_time[1] << 5) | date_time[2]
+
+    offset = out.tell()
+    out.write(LOCAL_HEADER.pack(LOCAL_SIGNATURE, 20, flags, 8, dos_time, dos_date,
+                                0, 0, 0, len(name_bytes), 0))
+    out.write(name_bytes)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    crc = size = compressed_size = 0
+    for chunk in content:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        compressed = compressor.compress(chunk)
+        compressed_size += len(compressed)
+        out.write(compressed)
+    compressed = compressor.flush()
+    compressed_size += len(compressed)
+    out.write(compressed)
+    if size >= 0xFFFFFFFF or compressed_size >= 0xFFFFFFFF:
+        raise ValueError(f"{name} が大きすぎるため書き込めません")
+
+    end = out.tell()
+    out.seek(offset)
+    out.write(LOCAL_HEADER.pack(LOCAL_SIGNATURE, 20, flags, 8, dos_time, dos_date,
+                                crc, compressed_size, size, len(name_bytes), 0))
+    out.seek(end)
+    central_list.append(CENTRAL_HEADER.pack(CENTRAL_SIGNATURE, 20, 20, flags, 8, dos_time, dos_date,
+                                            crc, compressed_size, size, len(name_bytes),
+                                            0, 0, 0, 0, 0, offset) + name_bytes)
+
+
+def write_patched_zip(data: bytes, replacements: dict, out):
+    """
+    元のzip data のメンバーを順に書き出す。replacements にあるメンバーは新しい内容で圧縮し、
+    それ以外はローカルヘッダから次のメンバーの直前までのバイト列をそのままコピーする。
+    replacements にしかないメンバーは末尾に追加する。
+    replacements の値はバイト列か、バイト列のイテラブルを返す関数（書き込む時に呼び出す）。
+    """
+    entries, directory_offset = central_directory(data)
+    boundaries = sorted({offset for _, _, offset in entries} | {directory_offset})
+    next_offset = {start: end for start, end in zip(boundaries, boundaries[1:])}
+    central = []
+    written = set()
+    for name, record, offset in entries:
+        if name in replacements:
+            fields = CENTRAL_HEADER.unpack_from(record)
+            dos_time, dos_date = fields[5], fields[6]
+            date_time = ((dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+                         dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2)
+            write_member(out, name, member_content(replacements[name]), date_time, central)
+        else:
+            if data[offset:offset + 4] != LOCAL_SIGNATURE:
+                raise ValueError(f"zipのメンバーが壊れています: {name}")
+            new_offset = out.tell()
+            out.write(data[offset:next_offset[offset]])
+            central.append(record[:42] + struct.pack('<L', new_offset) + record[46:])
+        written.add(name)
+
+    now = time.localtime()[:6]
+    for name, content in replacements.items():
+        if name not in written:
+            write_member(out, name, member_content(content), now, central)
+
+    start = out.tell()
+    for record in central:
+        out.write(record)
+    out.write(END_RECORD.pack(END_SIGNATURE, 0, 0, len(central), len(central),
+                              out.tell() - start, start, 0))
+
+
+def member_content(content):
+    return content if isinstance(content, bytes) else content()
+
+
+def save_patched_zip(data: bytes, replacements: dict, output: str):
+    """write_patched_zip の結果を一時ファイルに書き、output に置き換える（同じパスへの上書きも可）"""
+    temp_path = f"{output}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            write_patched_zip(data, replacements, f)
+        os.replace(temp_path, output)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise